@@ -0,0 +1,139 @@
+""" Write throughput with per-request commits against the group committing write queue.
+
+Every writer is one generated user creating, starting and stopping tasks of its project through
+async_crud, as request handlers do, with a session per operation. Both modes run on a fresh
+database with the engine settings of the environment (TASKER_DB_PROFILE, TASKER_DB_* values).
+
+Prints operations/s, p50/p99 latency (ms) and failed operations per mode as JSON, for the write
+queue also the number of batches and their average size.
+
+Usage:
+    python -m benchmarks.group_commit --writers 1,16,64 --operations 3000
+    TASKER_DB_PROFILE=production python -m benchmarks.group_commit --max-delay 1
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import time
+
+from typing import Any, Dict, List, Optional
+
+from sqlalchemy import select
+from sqlalchemy.orm import sessionmaker
+
+from benchmarks.load_test import percentile
+from database import async_crud, dataset_generator, migrations, models
+from database.db_init import create_sqlite_engine
+from database.write_queue import write_queue
+from rest.schemas import TaskCreate
+
+
+modes = ['per-request', 'group-commit']
+
+
+async def _writer(SessionLocal, username: str, project_id: int, operation_count: int,
+                  latencies: List[float], errors: Dict[str, int]):
+    async def operation(fn, *args):
+        start = time.perf_counter()
+        try:
+            with SessionLocal() as db:
+                result = await fn(db, *args)
+        except Exception as e:
+            errors[type(e).__name__] = errors.get(type(e).__name__, 0) + 1
+            return None
+        latencies.append(time.perf_counter() - start)
+        return result
+
+    for _ in range(operation_count // 3):
+        task = await operation(async_crud.create_task, username, project_id, TaskCreate(description='task'))
+        if task is not None:
+            await operation(async_crud.start_task, task.id)
+            await operation(async_crud.stop_task, task.id)
+
+
+async def _run_writers(SessionLocal, projects: List[Any], operation_count: int) -> Dict[str, Any]:
+    latencies = []
+    errors = {}
+    start = time.perf_counter()
+    await asyncio.gather(*(_writer(SessionLocal, project.owner_username, project.id,
+                                   operation_count // len(projects), latencies, errors)
+                           for project in projects))
+    duration = time.perf_counter() - start
+    latencies.sort()
+    return dict(operations=len(latencies),
+                errors=errors,
+                seconds=duration,
+                throughput=len(latencies) / duration,
+                p50=percentile(latencies, 0.5) * 1000 if latencies else None,
+                p99=percentile(latencies, 0.99) * 1000 if latencies else None)
+
+
+def run_mode(database: str, mode: str, writer_count: int, operation_count: int,
+             max_batch: int = 64, max_delay: float = 0.002) -> Dict[str, Any]:
+    if os.path.exists(database):
+        os.remove(database)
+    engine = create_sqlite_engine(f'sqlite:///{database}')
+    migrations.upgrade(engine)
+    SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+    with SessionLocal() as db:
+        dataset_generator.generate(db, writer_count, projects_per_user=1, tasks_per_project=0)
+        projects = db.execute(select(models.Project.id, models.Project.owner_username)).all()
+
+    previous = (write_queue.max_batch, write_queue.max_delay)
+    write_queue.max_batch, write_queue.max_delay = max_batch, max_delay
+    write_queue.bind(engine if mode == 'group-commit' else None)
+    batches = write_queue.stats()
+    try:
+        result = asyncio.run(_run_writers(SessionLocal, projects, operation_count))
+        if mode == 'group-commit':
+            stats = write_queue.stats()
+            result['batches'] = stats['batches'] - batches['batches']
+            result['average_batch'] = ((stats['operations'] - batches['operations']) / result['batches']
+                                       if result['batches'] else None)
+    finally:
+        write_queue.bind(None)
+        write_queue.max_batch, write_queue.max_delay = previous
+        engine.dispose()
+    return result
+
+
+def run(database: str, writer_counts: List[int], operation_count: int,
+        max_batch: int = 64, max_delay: float = 0.002) -> Dict[str, Any]:
+    levels = {}
+    for writer_count in writer_counts:
+        levels[str(writer_count)] = {mode: run_mode(database, mode, writer_count, operation_count,
+                                                    max_batch, max_delay)
+                                     for mode in modes}
+    return dict(config=dict(operations=operation_count, max_batch=max_batch, max_delay=max_delay),
+                levels=levels)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--writers', default='1,16,64', help='Comma separated numbers of concurrent writers')
+    parser.add_argument('--operations', type=int, default=3000, help='Operations per run')
+    parser.add_argument('--max-batch', type=int, default=64)
+    parser.add_argument('--max-delay', type=float, default=2.0, help='ms a batch waits for more operations')
+    parser.add_argument('--output', help='Write results to this file instead of stdout')
+    args = parser.parse_args(argv)
+
+    writer_counts = [int(count) for count in args.writers.split(',')]
+    with tempfile.TemporaryDirectory() as directory:
+        results = run(os.path.join(directory, 'group_commit.db'), writer_counts, args.operations,
+                      args.max_batch, args.max_delay / 1000)
+
+    encoded = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, 'w') as output:
+            output.write(encoded)
+    else:
+        print(encoded)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,339 @@
+""" In-process HTTP load test of the API.
+
+Generates a dataset with database.dataset_generator, then drives the ASGI app through httpx with
+a mixed workload (token auth, listing, task CRUD and start/stop) at each of the given
+concurrency levels. Every virtual user acts as one generated user with a bearer token.
+
+Writes p50/p95/p99 latency (ms), throughput (requests/s) and status codes per route template as
+JSON. With --compare the results are checked against a saved baseline and the exit status is 1
+when any route regressed by more than --tolerance.
+
+Usage:
+    python -m benchmarks.load_test --users 1000 --concurrency 1,8,32 --output baseline.json
+    python -m benchmarks.load_test --users 1000 --concurrency 1,8,32 --compare baseline.json
+"""
+
+import argparse
+import asyncio
+import json
+import math
+import os
+import random
+import sys
+import tempfile
+import time
+
+from collections import defaultdict
+from typing import Any, Dict, List, Optional
+
+import httpx
+
+from sqlalchemy import select
+from sqlalchemy.orm import sessionmaker
+
+from database import dataset_generator, migrations, models
+from database.db_init import create_async_sqlite_engine, create_sqlite_engine
+from database.write_queue import write_queue
+from rest.main import app, get_read_db, get_write_db
+from utils.settings import settings
+
+
+# Relative frequency of workload operations
+weights = dict(auth=1, me=2, list_projects=4, list_tasks=4, get_task=4,
+               create_task=2, update_task=2, start_task=2, stop_task=2, delete_task=1)
+
+
+def _session_dependency(url: str, engine, read_only: bool):
+    if settings.async_database:
+        from sqlalchemy.ext.asyncio import async_sessionmaker
+
+        async_engine = create_async_sqlite_engine(url, read_only=read_only)
+        AsyncBenchmarkSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
+
+        async def get_benchmark_db():
+            async with AsyncBenchmarkSessionLocal() as db:
+                yield db
+    else:
+        BenchmarkSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+        def get_benchmark_db():
+            db = BenchmarkSessionLocal()
+            try:
+                yield db
+            finally:
+                db.close()
+    return get_benchmark_db
+
+
+def use_database(path: str):
+    """ Points the app to the database at `path` and returns its (sync) write and read engines.
+
+    Overrides the `get_write_db` and `get_read_db` dependencies, callers restore the previous
+    overrides when done.
+    """
+    url = f'sqlite:///{path}'
+    engine = create_sqlite_engine(url)
+    read_engine = create_sqlite_engine(url, read_only=True)
+    app.dependency_overrides[get_write_db] = _session_dependency(url, engine, read_only=False)
+    app.dependency_overrides[get_read_db] = _session_dependency(url, read_engine, read_only=True)
+    if write_queue.enabled:
+        write_queue.bind(engine)
+    return engine, read_engine
+
+
+def load_virtual_users(engine, count: int, seed: int) -> List[Dict[str, Any]]:
+    """ Picks generated users with ids of their projects and tasks. """
+    with sessionmaker(bind=engine)() as db:
+        usernames = db.scalars(select(models.User.username)
+                               .where(models.User.username.like('user%'))
+                               .order_by(models.User.username)).all()
+        usernames = random.Random(seed).sample(usernames, min(count, len(usernames)))
+        virtual_users = {username: dict(username=username, tasks=defaultdict(list)) for username in usernames}
+        rows = db.execute(select(models.Project.owner_username, models.Project.id, models.Task.id)
+                          .outerjoin(models.Task, models.Task.project_id == models.Project.id)
+                          .where(models.Project.owner_username.in_(usernames)))
+        for username, project_id, task_id in rows:
+            tasks = virtual_users[username]['tasks'][project_id]
+            if task_id is not None:
+                tasks.append(task_id)
+    return [virtual_user for virtual_user in virtual_users.values() if virtual_user['tasks']]
+
+
+class VirtualUser:
+    def __init__(self, client: httpx.AsyncClient, data: Dict[str, Any], rng: random.Random, record):
+        self.client = client
+        self.username = data['username']
+        self.tasks = data['tasks']
+        self.rng = rng
+        self.record = record
+        self.headers = None
+        # Tasks created by this virtual user by timer state, only they are started, stopped and deleted
+        self.created = []
+        self.running = []
+        self.stopped = []
+
+    async def request(self, route: str, method: str, url: str, **kwargs) -> httpx.Response:
+        start = time.perf_counter()
+        response = await self.client.request(method, url, headers=self.headers, **kwargs)
+        self.record(route, time.perf_counter() - start, response.status_code)
+        return response
+
+    def _project_url(self, project_id: int) -> str:
+        return f'/api/users/{self.username}/projects/{project_id}'
+
+    async def auth(self):
+        response = await self.request('POST /api/auth/token', 'POST', '/api/auth/token',
+                                      auth=(self.username, dataset_generator.password))
+        self.headers = {'Authorization': f"Bearer {response.json()['access_token']}"}
+
+    async def me(self):
+        await self.request('GET /api/users/me', 'GET', '/api/users/me')
+
+    async def list_projects(self):
+        await self.request('GET /api/users/{username}/projects', 'GET', f'/api/users/{self.username}/projects')
+
+    async def list_tasks(self):
+        project_id = self.rng.choice(list(self.tasks))
+        await self.request('GET /api/users/{username}/projects/{project_id}/tasks', 'GET',
+                           f'{self._project_url(project_id)}/tasks')
+
+    async def get_task(self):
+        project_id = self.rng.choice(list(self.tasks))
+        task_id = self.rng.choice(self.tasks[project_id] or [0])
+        await self.request('GET /api/users/{username}/projects/{project_id}/tasks/{task_id}', 'GET',
+                           f'{self._project_url(project_id)}/tasks/{task_id}')
+
+    async def create_task(self):
+        project_id = self.rng.choice(list(self.tasks))
+        response = await self.request('POST /api/users/{username}/projects/{project_id}/tasks', 'POST',
+                                      f'{self._project_url(project_id)}/tasks',
+                                      json=dict(description='Load test task'))
+        if response.status_code == 200:
+            self.created.append((project_id, response.json()['id']))
+
+    async def update_task(self):
+        if not self.created:
+            return await self.create_task()
+        project_id, task_id = self.rng.choice(self.created)
+        await self.request('PATCH /api/users/{username}/projects/{project_id}/tasks/{task_id}', 'PATCH',
+                           f'{self._project_url(project_id)}/tasks/{task_id}',
+                           json=dict(description='Updated load test task'))
+
+    async def start_task(self):
+        if not self.created:
+            return await self.create_task()
+        project_id, task_id = self.created.pop()
+        await self.request('POST /api/users/{username}/projects/{project_id}/tasks/{task_id}/start', 'POST',
+                           f'{self._project_url(project_id)}/tasks/{task_id}/start')
+        self.running.append((project_id, task_id))
+
+    async def stop_task(self):
+        if not self.running:
+            return await self.start_task()
+        project_id, task_id = self.running.pop()
+        await self.request('POST /api/users/{username}/projects/{project_id}/tasks/{task_id}/stop', 'POST',
+                           f'{self._project_url(project_id)}/tasks/{task_id}/stop')
+        self.stopped.append((project_id, task_id))
+
+    async def delete_task(self):
+        if not self.stopped:
+            return await self.stop_task()
+        project_id, task_id = self.stopped.pop()
+        await self.request('DELETE /api/users/{username}/projects/{project_id}/tasks/{task_id}', 'DELETE',
+                           f'{self._project_url(project_id)}/tasks/{task_id}')
+
+
+def percentile(sorted_values: List[float], fraction: float) -> float:
+    """ Nearest-rank percentile of already sorted values. """
+    return sorted_values[max(0, math.ceil(fraction * len(sorted_values)) - 1)]
+
+
+def summarize(latencies: Dict[str, List[float]], statuses: Dict[str, Dict[int, int]],
+              elapsed: float) -> Dict[str, Dict[str, Any]]:
+    summary = {}
+    for route, route_latencies in sorted(latencies.items()):
+        route_latencies = sorted(route_latencies)
+        summary[route] = dict(count=len(route_latencies),
+                              p50=percentile(route_latencies, 0.50) * 1000,
+                              p95=percentile(route_latencies, 0.95) * 1000,
+                              p99=percentile(route_latencies, 0.99) * 1000,
+                              throughput=len(route_latencies) / elapsed,
+                              statuses={str(code): count for code, count in sorted(statuses[route].items())})
+    return summary
+
+
+async def run_level(virtual_users: List[Dict[str, Any]], concurrency: int, request_count: int,
+                    seed: int) -> Dict[str, Any]:
+    latencies = defaultdict(list)
+    statuses = defaultdict(lambda: defaultdict(int))
+    operations = list(weights)
+    operation_weights = list(weights.values())
+    remaining = request_count
+
+    def record(route: str, latency: float, status_code: int):
+        latencies[route].append(latency)
+        statuses[route][status_code] += 1
+
+    async def worker(index: int):
+        nonlocal remaining
+        rng = random.Random(seed * 1000003 + index)
+        virtual_user = VirtualUser(client, virtual_users[index % len(virtual_users)], rng, record)
+        await virtual_user.auth()
+        while remaining > 0:
+            remaining -= 1
+            operation = rng.choices(operations, operation_weights)[0]
+            await getattr(virtual_user, operation)()
+
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url='http://load-test') as client:
+        start = time.perf_counter()
+        await asyncio.gather(*[worker(index) for index in range(concurrency)])
+        elapsed = time.perf_counter() - start
+
+    requests = sum(len(route_latencies) for route_latencies in latencies.values())
+    return dict(requests=requests,
+                elapsed=elapsed,
+                throughput=requests / elapsed,
+                routes=summarize(latencies, statuses, elapsed))
+
+
+def compare(baseline: Dict[str, Any], results: Dict[str, Any], tolerance: float) -> List[str]:
+    """ Descriptions of routes whose p95 latency or throughput regressed by more than `tolerance`. """
+    regressions = []
+    for concurrency, level in results['levels'].items():
+        baseline_level = baseline['levels'].get(concurrency)
+        if baseline_level is None:
+            continue
+        for route, stats in level['routes'].items():
+            baseline_stats = baseline_level['routes'].get(route)
+            if baseline_stats is None:
+                continue
+            if stats['p95'] > baseline_stats['p95'] * (1 + tolerance):
+                regressions.append(f"concurrency {concurrency}, {route}: p95 "
+                                   f"{baseline_stats['p95']:.2f} ms -> {stats['p95']:.2f} ms")
+            if stats['throughput'] < baseline_stats['throughput'] * (1 - tolerance):
+                regressions.append(f"concurrency {concurrency}, {route}: throughput "
+                                   f"{baseline_stats['throughput']:.1f}/s -> {stats['throughput']:.1f}/s")
+    return regressions
+
+
+def run(database: str, user_count: int, projects_per_user: int, tasks_per_project: int,
+        concurrency_levels: List[int], request_count: int, virtual_user_count: int = 100,
+        seed: int = 0, generate: bool = True) -> Dict[str, Any]:
+    previous_overrides = {dependency: app.dependency_overrides.get(dependency)
+                          for dependency in [get_write_db, get_read_db]}
+    engine, read_engine = use_database(database)
+    dataset = None
+    if generate:
+        migrations.upgrade(engine)
+        with sessionmaker(bind=engine)() as db:
+            dataset = dataset_generator.generate(db, user_count, projects_per_user, tasks_per_project, seed=seed)
+    virtual_users = load_virtual_users(engine, virtual_user_count, seed)
+
+    levels = {}
+    for concurrency in concurrency_levels:
+        levels[str(concurrency)] = asyncio.run(run_level(virtual_users, concurrency, request_count, seed))
+    for dependency, previous_override in previous_overrides.items():
+        if previous_override is None:
+            app.dependency_overrides.pop(dependency, None)
+        else:
+            app.dependency_overrides[dependency] = previous_override
+    if write_queue.enabled:
+        write_queue.stop()
+    engine.dispose()
+    read_engine.dispose()
+    return dict(config=dict(users=user_count,
+                            projects_per_user=projects_per_user,
+                            tasks_per_project=tasks_per_project,
+                            requests=request_count,
+                            virtual_users=len(virtual_users),
+                            seed=seed,
+                            async_database=settings.async_database,
+                            write_queue=write_queue.enabled,
+                            db_profile=settings.db_profile),
+                dataset=dataset,
+                levels=levels)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--database', help='Existing generated database, a temporary one is generated if not set')
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--projects-per-user', type=int, default=5)
+    parser.add_argument('--tasks-per-project', type=int, default=20)
+    parser.add_argument('--concurrency', default='1,8,32', help='Comma separated concurrency levels')
+    parser.add_argument('--requests', type=int, default=2000, help='Requests per concurrency level')
+    parser.add_argument('--virtual-users', type=int, default=100)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='Write results to this file instead of stdout')
+    parser.add_argument('--compare', help='Baseline results to check for regressions')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='Allowed relative regression')
+    args = parser.parse_args(argv)
+
+    concurrency_levels = [int(level) for level in args.concurrency.split(',')]
+    with tempfile.TemporaryDirectory() as directory:
+        results = run(args.database or os.path.join(directory, 'load_test.db'),
+                      args.users, args.projects_per_user, args.tasks_per_project,
+                      concurrency_levels, args.requests,
+                      virtual_user_count=args.virtual_users,
+                      seed=args.seed,
+                      generate=args.database is None)
+
+    encoded = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, 'w') as output:
+            output.write(encoded)
+    else:
+        print(encoded)
+
+    if args.compare:
+        with open(args.compare) as baseline_file:
+            regressions = compare(json.load(baseline_file), results, args.tolerance)
+        for regression in regressions:
+            print(f'REGRESSION {regression}', file=sys.stderr)
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,93 @@
+""" Micro-benchmark of response encoding per endpoint.
+
+Encodes the same results the way FastAPI does it for each route, before and after declaring
+response models everywhere and switching to orjson:
+    before: routes that had no response model go through jsonable_encoder, the others through
+            their response model, both rendered by the stdlib JSONResponse
+    after:  declared response model (from_attributes validation) rendered by ORJSONResponse
+
+Usage: python -m benchmarks.serialization [--items N] [--repeat N]
+"""
+
+import argparse
+import asyncio
+import datetime
+import time
+
+from fastapi.responses import JSONResponse
+from fastapi.routing import APIRoute, serialize_response
+from sqlalchemy.orm.attributes import set_committed_value
+
+from database import models
+from rest.main import app
+from rest.schemas import ProjectVisibility, Role
+
+
+# Routes that returned ORM objects without a response model before
+_untyped_routes = {'create_project', 'get_project', 'create_task', 'get_task', 'get_tasks', 'update_task'}
+
+
+def _task(task_id: int) -> models.Task:
+    now = datetime.datetime.now()
+    return models.Task(id=task_id, description=f'task {task_id} description', project_id=1,
+                       owner_username='username01', start_timestamp=now, end_timestamp=now, version=1)
+
+
+def _project(project_id: int, task_count: int) -> models.Project:
+    project = models.Project(id=project_id, name=f'project {project_id}', description='description',
+                             visibility=ProjectVisibility.PUBLIC, owner_username='username01', version=1)
+    # Loaded like a selectin load does it, without back references jsonable_encoder would recurse into
+    set_committed_value(project, 'tasks', [_task(project_id * 1000 + i) for i in range(task_count)])
+    return project
+
+
+def _user() -> models.User:
+    user = models.User(username='username01', email='username01@gmail.com', bio='bio',
+                       role=Role.BASIC, hashed_password='hash')
+    set_committed_value(user, 'projects', [_project(1, 0)])
+    set_committed_value(user, 'tasks', [_task(1)])
+    return user
+
+
+def sample_responses(item_count: int):
+    """ Typical response content of each benchmarked endpoint, keyed by route name. """
+    return dict(
+        get_current_user=_user(),
+        get_users=dict(items=[models.User(username=f'username{i}') for i in range(item_count)],
+                       next_cursor='abc'),
+        update_user_info=_user(),
+        create_project=_project(1, 0),
+        get_projects=dict(items=[_project(i, 10) for i in range(item_count)], next_cursor='abc'),
+        get_project=_project(1, item_count),
+        create_task=_task(1),
+        get_task=_task(1),
+        get_tasks=dict(items=[_task(i) for i in range(item_count)], next_cursor='abc'),
+        update_task=_task(1),
+    )
+
+
+async def _time(field, response_class, content, repeat: int) -> float:
+    start = time.perf_counter()
+    for _ in range(repeat):
+        encoded = await serialize_response(field=field, response_content=content)
+        response_class(encoded)
+    return (time.perf_counter() - start) / repeat
+
+
+async def run(item_count: int, repeat: int):
+    routes = {route.name: route for route in app.routes if isinstance(route, APIRoute)}
+    print(f'{"endpoint":<20} {"before [us]":>12} {"after [us]":>12} {"speedup":>8}')
+    for name, content in sample_responses(item_count).items():
+        route = routes[name]
+        before_field = None if name in _untyped_routes else route.response_field
+        before = await _time(before_field, JSONResponse, content, repeat)
+        after = await _time(route.response_field, route.response_class, content, repeat)
+        print(f'{name:<20} {before * 1e6:>12.1f} {after * 1e6:>12.1f} {before / after:>7.2f}x')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--items', type=int, default=50, help='Items per list response')
+    parser.add_argument('--repeat', type=int, default=200, help='Encodings per endpoint')
+    args = parser.parse_args()
+    asyncio.run(run(args.items, args.repeat))
@@ -0,0 +1,94 @@
+""" Awaitable versions of `crud` functions.
+
+Each function accepts either a sync `Session` or an `AsyncSession`. With an `AsyncSession` the crud
+function runs through `AsyncSession.run_sync` on the async driver, so the event loop is never
+blocked. With a sync `Session` it is offloaded to a worker thread.
+
+Mutating functions go to `write_queue` instead of the given session when it is enabled.
+"""
+
+import functools
+
+import anyio.to_thread
+from sqlalchemy import Row, Select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+from typing import Any, AsyncIterator, Callable, List, Union
+
+from . import crud
+from .write_queue import write_queue
+
+
+AnySession = Union[Session, AsyncSession]
+
+
+async def run(db: AnySession, fn: Callable[..., Any], *args, **kwargs) -> Any:
+    if isinstance(db, AsyncSession):
+        return await db.run_sync(fn, *args, **kwargs)
+    return await anyio.to_thread.run_sync(functools.partial(fn, db, *args, **kwargs))
+
+
+async def stream(db: AnySession, statement: Select, batch_size: int) -> AsyncIterator[List[Row]]:
+    """ Yields result rows in batches of `batch_size` without loading the whole result. """
+    statement = statement.execution_options(yield_per=batch_size)
+    if isinstance(db, AsyncSession):
+        result = await db.stream(statement)
+        async for partition in result.partitions():
+            yield partition
+        return
+
+    partitions = (await anyio.to_thread.run_sync(db.execute, statement)).partitions()
+    while True:
+        partition = await anyio.to_thread.run_sync(next, partitions, None)
+        if partition is None:
+            break
+        yield partition
+
+
+def _awaitable(fn: Callable[..., Any]) -> Callable[..., Any]:
+    @functools.wraps(fn)
+    async def wrapper(db: AnySession, *args, **kwargs):
+        return await run(db, fn, *args, **kwargs)
+    return wrapper
+
+
+def _mutation(fn: Callable[..., Any]) -> Callable[..., Any]:
+    @functools.wraps(fn)
+    async def wrapper(db: AnySession, *args, **kwargs):
+        if write_queue.enabled:
+            return await write_queue.run(fn, *args, **kwargs)
+        return await run(db, fn, *args, **kwargs)
+    return wrapper
+
+
+get_user_by_username = _awaitable(crud.get_user_by_username)
+get_user_by_email = _awaitable(crud.get_user_by_email)
+get_users = _awaitable(crud.get_users)
+create_user = _mutation(crud.create_user)
+update_user_password_hash = _mutation(crud.update_user_password_hash)
+update_user_info = _mutation(crud.update_user_info)
+update_user_role = _mutation(crud.update_user_role)
+get_user_token_epoch = _awaitable(crud.get_user_token_epoch)
+get_projects = _awaitable(crud.get_projects)
+get_project_by_id = _awaitable(crud.get_project_by_id)
+get_projects_by_owner_username_and_name = _awaitable(crud.get_projects_by_owner_username_and_name)
+get_project_by_id_and_owner_username = _awaitable(crud.get_project_by_id_and_owner_username)
+create_project = _mutation(crud.create_project)
+create_task = _mutation(crud.create_task)
+create_tasks = _mutation(crud.create_tasks)
+get_tasks_by_owner_username = _awaitable(crud.get_tasks_by_owner_username)
+get_tasks_by_project_id = _awaitable(crud.get_tasks_by_project_id)
+get_tasks_by_owner_username_and_project_id = _awaitable(crud.get_tasks_by_owner_username_and_project_id)
+get_task_by_id = _awaitable(crud.get_task_by_id)
+get_project_and_task = _awaitable(crud.get_project_and_task)
+get_project_version = _awaitable(crud.get_project_version)
+get_task_version = _awaitable(crud.get_task_version)
+update_task_info = _mutation(crud.update_task_info)
+delete_task = _mutation(crud.delete_task)
+start_task = _mutation(crud.start_task)
+stop_task = _mutation(crud.stop_task)
+start_tasks = _mutation(crud.start_tasks)
+stop_tasks = _mutation(crud.stop_tasks)
+rebuild_time_rollups = _awaitable(crud.rebuild_time_rollups)
+get_time_report = _awaitable(crud.get_time_report)
@@ -1,14 +1,25 @@
 import datetime
+import json
 
 import sqlalchemy.exc
-from sqlalchemy.orm import Session
-from sqlalchemy import and_
+from sqlalchemy.orm import Session, selectinload
+from sqlalchemy.orm.attributes import set_committed_value
+from sqlalchemy import and_, delete, func, insert, select, update, Select
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
 
-from typing import Optional
+from collections import defaultdict
+from typing import Dict, Iterable, List, Optional, Tuple
 
 from . import models
 import rest.schemas
 from utils import password_hasher
+from utils.principal_cache import invalidate_on_commit
+from utils.tokens import set_epoch_on_commit
+from utils.project_list_cache import mark_changed
+
+
+# Loads ids behind Project.task_ids for all fetched projects in one extra SELECT
+_project_task_ids = selectinload(models.Project.tasks).load_only(models.Task.id)
 
 
 def get_user_by_username(db: Session, username: str) -> Optional[models.User]:
@@ -19,8 +30,11 @@ def get_user_by_email(db: Session, email: str):
     return db.query(models.User).filter(models.User.email == email).first()
 
 
-def get_users(db: Session, skip: int = 0, limit: int = 10):
-    return db.query(models.User).offset(skip).limit(limit).all()
+def get_users(db: Session, limit: int = 10, after_username: Optional[str] = None):
+    query = db.query(models.User)
+    if after_username is not None:
+        query = query.filter(models.User.username > after_username)
+    return query.order_by(models.User.username).limit(limit).all()
 
 
 def create_user(db: Session, user: rest.schemas.UserCreate):
@@ -36,35 +50,106 @@ def create_user(db: Session, user: rest.schemas.UserCreate):
     return db_user
 
 
-def update_user_info(db: Session, username: str, user_info: rest.schemas.UserUpdateInfo):
-    db_user = get_user_by_username(db, username)
-    if user_info.email is not None:
-        db_user.email = user_info.email
-    if user_info.bio is not None:
-        db_user.bio = user_info.bio
-
-    db.add(db_user)
+def update_user_password_hash(db: Session, username: str, old_hash: str, new_hash: str) -> bool:
+    """ Replaces a password hash unless it was changed since `old_hash` was read. """
+    result = db.execute(update(models.User)
+                        .where(models.User.username == username, models.User.hashed_password == old_hash)
+                        .values(hashed_password=new_hash))
     db.commit()
-    db.refresh(db_user)
+    return result.rowcount == 1
+
+
+def _update_returning(db: Session, model, conditions: list, values: dict, *columns):
+    """ Applies `values` and bumps version with one UPDATE ... RETURNING, the object or None if nothing matched.
+
+    With extra `columns` the whole returned row is given back, the object first. The object is
+    expunged before the commit so it stays loaded instead of being expired and selected again.
+    """
+    row = db.execute(
+        update(model).where(and_(*conditions)).values(**values, version=model.version + 1).returning(model, *columns)
+    ).first()
+    if row is None:
+        db.rollback()
+        return None
+    db.expunge(row[0])
+    return row if columns else row[0]
+
+
+def _user_ids_columns() -> list:
+    """ Ids behind User.project_ids and User.task_ids as JSON arrays, selected or returned with the user. """
+    return [
+        select(func.json_group_array(model.id)).where(
+            model.owner_username == models.User.username
+        ).correlate(models.User).scalar_subquery()
+        for model in (models.Project, models.Task)
+    ]
+
+
+def _with_user_ids(row) -> Optional[models.User]:
+    if row is None:
+        return None
+    db_user, project_ids, task_ids = row
+    set_committed_value(db_user, 'projects', [models.Project(id=id) for id in json.loads(project_ids)])
+    set_committed_value(db_user, 'tasks', [models.Task(id=id) for id in json.loads(task_ids)])
     return db_user
 
 
-def update_user_role(db: Session, username: str, user: rest.schemas.UserUpdateRole):
-    db_user = get_user_by_username(db, username)
-    db_user.role = user.role
-    db.add(db_user)
+def update_user_info(db: Session, username: str, user_info: rest.schemas.UserUpdateInfo,
+                     expected_version: Optional[int] = None) -> Optional[models.User]:
+    """ Updates provided fields, None if the user doesn't exist or its version isn't `expected_version`. """
+    conditions = [
+        models.User.username == username,
+        models.User.version == expected_version if expected_version is not None else True
+    ]
+    values = user_info.model_dump(exclude_none=True)
+    if not values:
+        # Nothing to change, only the precondition is checked
+        return _with_user_ids(db.execute(select(models.User, *_user_ids_columns()).where(and_(*conditions))).first())
+    db_user = _with_user_ids(_update_returning(db, models.User, conditions, values, *_user_ids_columns()))
+    if db_user is not None:
+        invalidate_on_commit(db, username)
+        db.commit()
+    return db_user
+
+
+def update_user_role(db: Session, username: str, user: rest.schemas.UserUpdateRole,
+                     expected_version: Optional[int] = None) -> Optional[models.User]:
+    """ Updates role, None if the user doesn't exist or its version isn't `expected_version`. """
+    conditions = [
+        models.User.username == username,
+        models.User.version == expected_version if expected_version is not None else True
+    ]
+    # Tokens carry the role, so they are revoked along with it
+    db_user = _with_user_ids(_update_returning(db, models.User, conditions,
+                                               dict(role=user.role, token_epoch=models.User.token_epoch + 1),
+                                               *_user_ids_columns()))
+    if db_user is None:
+        return None
+    # Applied after the real commit, with the write queue db.commit() only ends a savepoint
+    invalidate_on_commit(db, username)
+    set_epoch_on_commit(db, username, db_user.token_epoch)
     db.commit()
-    db.refresh(db_user)
     return db_user
 
 
+def get_user_token_epoch(db: Session, username: str) -> Optional[int]:
+    return db.scalar(select(models.User.token_epoch).where(models.User.username == username))
+
+
 def get_projects(db: Session, username: str,
-                 project_visibility: Optional[rest.schemas.ProjectVisibility] = None):
+                 project_visibility: Optional[rest.schemas.ProjectVisibility] = None,
+                 limit: Optional[int] = None, after_id: Optional[int] = None):
     conditions = [
         models.Project.owner_username == username,
-        models.Project.visibility == project_visibility if project_visibility is not None else True
+        models.Project.visibility == project_visibility if project_visibility is not None else True,
+        models.Project.id > after_id if after_id is not None else True
     ]
-    return db.query(models.Project).filter(and_(*conditions)).all()
+    query = db.query(models.Project).options(_project_task_ids).filter(
+        and_(*conditions)
+    ).order_by(models.Project.id)
+    if limit is not None:
+        query = query.limit(limit)
+    return query.all()
 
 
 def get_project_by_id(db: Session, project_id: int):
@@ -79,12 +164,16 @@ def get_projects_by_owner_username_and_name(db: Session, username: str, project_
     return db.query(models.Project).filter(and_(*conditions)).all()
 
 
-def get_project_by_id_and_owner_username(db: Session, project_id: int, username: str):
+def get_project_by_id_and_owner_username(db: Session, project_id: int, username: str,
+                                         load_task_ids: bool = False):
     conditions = [
         models.Project.id == project_id,
         models.Project.owner_username == username
     ]
-    return db.query(models.Project).filter(and_(*conditions)).first()
+    query = db.query(models.Project)
+    if load_task_ids:
+        query = query.options(_project_task_ids)
+    return query.filter(and_(*conditions)).first()
 
 
 def create_project(db: Session, username: str, project: rest.schemas.ProjectCreate):
@@ -93,21 +182,80 @@ def create_project(db: Session, username: str, project: rest.schemas.ProjectCrea
                                 visibility=project.visibility,
                                 owner_username=username)
     db.add(db_project)
+    mark_changed(db, [username])
     db.commit()
     db.refresh(db_project)
+    # New project has no tasks, no need to lazy load them for ProjectGet.task_ids
+    set_committed_value(db_project, 'tasks', [])
     return db_project
 
 
+def _bump_project_versions(db: Session, project_ids: Iterable[int]):
+    owners = db.scalars(update(models.Project).where(
+        models.Project.id.in_(set(project_ids))
+    ).values(version=models.Project.version + 1).returning(
+        models.Project.owner_username
+    ).execution_options(synchronize_session=False)).all()
+    mark_changed(db, owners)
+
+
+def get_project_version(db: Session, project_id: int, username: str):
+    """ Only what's needed for access check and ETag, (visibility, version) row or None. """
+    return db.query(models.Project.visibility, models.Project.version).filter(
+        and_(
+            models.Project.id == project_id,
+            models.Project.owner_username == username
+        )
+    ).first()
+
+
+def get_task_version(db: Session, project_id: int, username: str, task_id: int):
+    """ Only what's needed for access check and ETag, (visibility, task version) row or None.
+
+    Task version is None when the task doesn't exist or belongs to another project.
+    """
+    return db.query(models.Project.visibility, models.Task.version).outerjoin(
+        models.Task,
+        and_(
+            models.Task.project_id == models.Project.id,
+            models.Task.id == task_id
+        )
+    ).filter(
+        and_(
+            models.Project.id == project_id,
+            models.Project.owner_username == username
+        )
+    ).first()
+
+
 def create_task(db: Session, username: str, project_id: int, task: rest.schemas.TaskCreate):
     task_db = models.Task(description=task.description,
                           owner_username=username,
                           project_id=project_id)
     db.add(task_db)
+    _bump_project_versions(db, [project_id])
     db.commit()
     db.refresh(task_db)
     return task_db
 
 
+def create_tasks(db: Session, username: str, project_id: int,
+                 tasks: List[rest.schemas.TaskCreate]) -> List[int]:
+    """ Inserts all tasks in one transaction and returns their ids in the order of `tasks`. """
+    if not tasks:
+        return []
+    rows = [dict(description=task.description,
+                 owner_username=username,
+                 project_id=project_id)
+            for task in tasks]
+    # Batched as multi-row INSERT ... RETURNING. Rows get ascending rowids in the order of VALUES,
+    # sorting ids is cheaper than sort_by_parameter_order which falls back to a statement per row
+    task_ids = db.scalars(insert(models.Task).returning(models.Task.id), rows).all()
+    _bump_project_versions(db, [project_id])
+    db.commit()
+    return sorted(task_ids)
+
+
 def get_tasks_by_owner_username(db: Session, username: str,
                                 project_visibility: Optional[rest.schemas.ProjectVisibility] = None):
     if project_visibility is None:
@@ -120,16 +268,46 @@ def get_tasks_by_owner_username(db: Session, username: str,
     ).all()
 
 
-def get_tasks_by_project_id(db: Session, project_id: int,
-                            project_visibility: Optional[rest.schemas.ProjectVisibility] = None):
+def get_task_rows_by_owner_username_statement(
+        username: str,
+        project_visibility: Optional[rest.schemas.ProjectVisibility] = None) -> Select:
+    """ Plain column rows instead of ORM objects, meant for streaming large results. """
+    statement = select(models.Task.id,
+                       models.Task.project_id,
+                       models.Task.owner_username,
+                       models.Task.description,
+                       models.Task.start_timestamp,
+                       models.Task.end_timestamp)
     if project_visibility is None:
-        return db.query(models.Task).filter(models.Task.project_id == project_id).all()
-    return db.query(models.Task).join(models.Project).filter(
+        return statement.where(models.Task.owner_username == username).order_by(models.Task.id)
+    return statement.join(models.Project).where(
         and_(
-            models.Task.project_id == project_id,
+            models.Task.owner_username == username,
             models.Project.visibility == project_visibility
         )
-    ).all()
+    ).order_by(models.Task.id)
+
+
+def get_tasks_by_project_id(db: Session, project_id: int,
+                            project_visibility: Optional[rest.schemas.ProjectVisibility] = None,
+                            limit: Optional[int] = None, after_id: Optional[int] = None):
+    conditions = [
+        models.Task.project_id == project_id,
+        models.Task.id > after_id if after_id is not None else True
+    ]
+    if project_visibility is None:
+        query = db.query(models.Task).filter(and_(*conditions))
+    else:
+        query = db.query(models.Task).join(models.Project).filter(
+            and_(
+                *conditions,
+                models.Project.visibility == project_visibility
+            )
+        )
+    query = query.order_by(models.Task.id)
+    if limit is not None:
+        query = query.limit(limit)
+    return query.all()
 
 
 def get_tasks_by_owner_username_and_project_id(db: Session, username: str, project_id: int,
@@ -152,45 +330,330 @@ def get_task_by_id(db: Session, task_id: int):
     return db.query(models.Task).filter(models.Task.id == task_id).first()
 
 
-def update_task_info(db: Session, task_id: int, task_info: rest.schemas.TaskUpdate):
-    db_task = get_task_by_id(db, task_id)
-    if task_info.description is not None:
-        db_task.description = task_info.description
-        db.add(db_task)
-        db.commit()
-        db.refresh(db_task)
+def get_project_and_task(db: Session, project_id: int, username: str,
+                         task_id: int) -> Tuple[Optional[models.Project], Optional[models.Task]]:
+    """ Loads project and its task in a single SELECT.
+
+    Task is None when it doesn't exist or belongs to another project.
+    """
+    row = db.query(models.Project, models.Task).outerjoin(
+        models.Task,
+        and_(
+            models.Task.project_id == models.Project.id,
+            models.Task.id == task_id
+        )
+    ).filter(
+        and_(
+            models.Project.id == project_id,
+            models.Project.owner_username == username
+        )
+    ).first()
+    if row is None:
+        return None, None
+    return row[0], row[1]
+
+
+def update_task_info(db: Session, task_id: int, task_info: rest.schemas.TaskUpdate,
+                     expected_version: Optional[int] = None) -> Optional[models.Task]:
+    """ Updates provided fields, None if the task doesn't exist or its version isn't `expected_version`. """
+    conditions = [
+        models.Task.id == task_id,
+        models.Task.version == expected_version if expected_version is not None else True
+    ]
+    values = task_info.model_dump(exclude_none=True)
+    if not values:
+        # Nothing to change, only the precondition is checked
+        return db.query(models.Task).filter(and_(*conditions)).first()
+    db_task = _update_returning(db, models.Task, conditions, values)
+    if db_task is None:
+        return None
+    _bump_project_versions(db, [db_task.project_id])
+    db.commit()
     return db_task
 
 
-def delete_task(db: Session, task_id: int):
+def delete_task(db: Session, task_id: int) -> Optional[bool]:
+    """ Deletes the task with one DELETE ... RETURNING, None if it doesn't exist, False if it couldn't be deleted. """
     try:
-        db_task = get_task_by_id(db, task_id)
-        db.delete(db_task)
+        deleted = db.execute(delete(models.Task).where(models.Task.id == task_id).returning(
+            models.Task.owner_username, models.Task.project_id, models.Task.start_timestamp, models.Task.end_timestamp
+        )).first()
+        if deleted is None:
+            db.rollback()
+            return None
+        owner_username, project_id, start_timestamp, end_timestamp = deleted
+        if start_timestamp is not None and end_timestamp is not None:
+            _add_tracked_time(db, [(owner_username, project_id, start_timestamp, end_timestamp)], sign=-1)
+        _bump_project_versions(db, [project_id])
         db.commit()
     except sqlalchemy.exc.DatabaseError:
+        db.rollback()
         return False
     return True
 
 
-def start_task(db: Session, task_id: int):
+def _task_conditions(task_id: int, project_id: Optional[int], username: Optional[str],
+                     include_private: bool) -> list:
+    """ Selects the task, with `project_id` and `username` only if it is accessible under that path.
+
+    Same rule as get_accessible_task in the API, tasks of private projects are hidden unless
+    `include_private` is set.
+    """
+    if project_id is None:
+        return [models.Task.id == task_id]
+    return [
+        models.Task.id == task_id,
+        models.Task.project_id == project_id,
+        select(models.Project.id).where(
+            and_(
+                models.Project.id == project_id,
+                models.Project.owner_username == username,
+                models.Project.visibility == rest.schemas.ProjectVisibility.PUBLIC if not include_private else True
+            )
+        ).exists()
+    ]
+
+
+def _transition_failure(db: Session, conditions: list, starting: bool) -> rest.schemas.TaskTransitionResult:
+    """ Tells why a conditional start/stop UPDATE matched no row. """
+    Result = rest.schemas.TaskTransitionResult
+    db.rollback()
+    task = db.query(models.Task.start_timestamp, models.Task.end_timestamp).filter(
+        and_(*conditions)
+    ).first()
+    if task is None:
+        return Result.NOT_FOUND
+    if starting:
+        return Result.ALREADY_STARTED
+    if task.start_timestamp is None:
+        return Result.NOT_STARTED
+    return Result.ALREADY_STOPPED
+
+
+def start_task(db: Session, task_id: int, project_id: Optional[int] = None, username: Optional[str] = None,
+               include_private: bool = True) -> Optional[rest.schemas.TaskTransitionResult]:
+    """ Starts a task with one conditional UPDATE, concurrent starts can't both succeed.
+
+    With `project_id` and `username` the UPDATE also checks the task is accessible under them,
+    see `_task_conditions`. Only a failed transition reads the task to tell why. Returns None if
+    the database failed.
+    """
+    conditions = _task_conditions(task_id, project_id, username, include_private)
     try:
-        now = datetime.datetime.now()
-        db_task = get_task_by_id(db, task_id)
-        db_task.start_timestamp = now
-        db.add(db_task)
+        started_task = db.execute(
+            update(models.Task).where(
+                and_(
+                    *conditions,
+                    models.Task.start_timestamp.is_(None)
+                )
+            ).values(start_timestamp=datetime.datetime.now(),
+                     version=models.Task.version + 1).returning(models.Task.project_id)
+        ).first()
+        if started_task is None:
+            return _transition_failure(db, conditions, starting=True)
+        _bump_project_versions(db, [started_task.project_id])
         db.commit()
     except sqlalchemy.exc.DatabaseError:
-        return False
-    return True
+        db.rollback()
+        return None
+    return rest.schemas.TaskTransitionResult.STARTED
+
 
+def stop_task(db: Session, task_id: int, project_id: Optional[int] = None, username: Optional[str] = None,
+              include_private: bool = True) -> Optional[rest.schemas.TaskTransitionResult]:
+    """ Stops a running task with one conditional UPDATE, concurrent stops can't both succeed.
 
-def stop_task(db: Session, task_id: int):
+    Access is checked like in `start_task`. Returns None if the database failed.
+    """
+    conditions = _task_conditions(task_id, project_id, username, include_private)
     try:
         now = datetime.datetime.now()
-        db_task = get_task_by_id(db, task_id)
-        db_task.end_timestamp = now
-        db.add(db_task)
+        stopped_task = db.execute(
+            update(models.Task).where(
+                and_(
+                    *conditions,
+                    models.Task.start_timestamp.is_not(None),
+                    models.Task.end_timestamp.is_(None)
+                )
+            ).values(end_timestamp=now,
+                     version=models.Task.version + 1).returning(models.Task.owner_username,
+                                                                models.Task.project_id,
+                                                                models.Task.start_timestamp)
+        ).first()
+        if stopped_task is None:
+            return _transition_failure(db, conditions, starting=False)
+        _bump_project_versions(db, [stopped_task.project_id])
+        _add_tracked_time(db, [(stopped_task.owner_username, stopped_task.project_id,
+                                stopped_task.start_timestamp, now)])
         db.commit()
     except sqlalchemy.exc.DatabaseError:
-        return False
-    return True
+        db.rollback()
+        return None
+    return rest.schemas.TaskTransitionResult.STOPPED
+
+
+def _get_accessible_tasks(db: Session, username: str, task_ids: List[int],
+                          include_private: bool) -> List[models.Task]:
+    conditions = [
+        models.Task.id.in_(task_ids),
+        models.Project.owner_username == username,
+        models.Project.visibility == rest.schemas.ProjectVisibility.PUBLIC if not include_private else True
+    ]
+    return db.query(models.Task).join(models.Project).filter(and_(*conditions)).all()
+
+
+def start_tasks(db: Session, username: str, task_ids: List[int],
+                include_private: bool) -> Dict[int, rest.schemas.TaskTransitionResult]:
+    """ Starts tasks of `username` projects with a single UPDATE and one commit.
+
+    Tasks in private projects are treated as not found unless `include_private` is set.
+    """
+    Result = rest.schemas.TaskTransitionResult
+    results = {task_id: Result.NOT_FOUND for task_id in task_ids}
+    startable_ids = []
+    for db_task in _get_accessible_tasks(db, username, task_ids, include_private):
+        if db_task.start_timestamp is not None:
+            results[db_task.id] = Result.ALREADY_STARTED
+        else:
+            startable_ids.append(db_task.id)
+            # Started concurrently unless the UPDATE below returns it
+            results[db_task.id] = Result.ALREADY_STARTED
+
+    if startable_ids:
+        started_tasks = db.execute(
+            update(models.Task).where(
+                and_(
+                    models.Task.id.in_(startable_ids),
+                    models.Task.start_timestamp.is_(None)
+                )
+            ).values(start_timestamp=datetime.datetime.now(),
+                     version=models.Task.version + 1).returning(models.Task.id, models.Task.project_id)
+        ).all()
+        for started_task in started_tasks:
+            results[started_task.id] = Result.STARTED
+        if started_tasks:
+            _bump_project_versions(db, [started_task.project_id for started_task in started_tasks])
+    db.commit()
+    return results
+
+
+def stop_tasks(db: Session, username: str, task_ids: List[int],
+               include_private: bool) -> Dict[int, rest.schemas.TaskTransitionResult]:
+    """ Stops tasks of `username` projects with a single UPDATE and one commit.
+
+    Tasks in private projects are treated as not found unless `include_private` is set.
+    """
+    Result = rest.schemas.TaskTransitionResult
+    results = {task_id: Result.NOT_FOUND for task_id in task_ids}
+    stoppable_ids = []
+    for db_task in _get_accessible_tasks(db, username, task_ids, include_private):
+        if db_task.start_timestamp is None:
+            results[db_task.id] = Result.NOT_STARTED
+        elif db_task.end_timestamp is not None:
+            results[db_task.id] = Result.ALREADY_STOPPED
+        else:
+            stoppable_ids.append(db_task.id)
+            # Stopped concurrently unless the UPDATE below returns it
+            results[db_task.id] = Result.ALREADY_STOPPED
+
+    if stoppable_ids:
+        now = datetime.datetime.now()
+        stopped_tasks = db.execute(
+            update(models.Task).where(
+                and_(
+                    models.Task.id.in_(stoppable_ids),
+                    models.Task.start_timestamp.is_not(None),
+                    models.Task.end_timestamp.is_(None)
+                )
+            ).values(end_timestamp=now,
+                     version=models.Task.version + 1).returning(models.Task.id,
+                                                  models.Task.owner_username,
+                                                  models.Task.project_id,
+                                                  models.Task.start_timestamp)
+        ).all()
+        for stopped_task in stopped_tasks:
+            results[stopped_task.id] = Result.STOPPED
+        if stopped_tasks:
+            _bump_project_versions(db, [stopped_task.project_id for stopped_task in stopped_tasks])
+        _add_tracked_time(db, [(stopped_task.owner_username, stopped_task.project_id,
+                                stopped_task.start_timestamp, now)
+                               for stopped_task in stopped_tasks])
+    db.commit()
+    return results
+
+
+def _split_by_day(start: datetime.datetime,
+                  end: datetime.datetime) -> List[Tuple[datetime.date, float]]:
+    parts = []
+    while start.date() < end.date():
+        next_day = datetime.datetime.combine(start.date() + datetime.timedelta(days=1), datetime.time())
+        parts.append((start.date(), (next_day - start).total_seconds()))
+        start = next_day
+    if end > start:
+        parts.append((start.date(), (end - start).total_seconds()))
+    return parts
+
+
+def _tracked_time_by_key(intervals: Iterable[Tuple[str, int, datetime.datetime, datetime.datetime]],
+                         sign: int = 1) -> Dict[Tuple[str, int, datetime.date], float]:
+    tracked = defaultdict(float)
+    for username, project_id, start, end in intervals:
+        for day, seconds in _split_by_day(start, end):
+            tracked[(username, project_id, day)] += sign * seconds
+    return tracked
+
+
+def _add_tracked_time(db: Session,
+                      intervals: Iterable[Tuple[str, int, datetime.datetime, datetime.datetime]],
+                      sign: int = 1):
+    """ Adds (username, project id, start, end) intervals to time rollups, without committing. """
+    tracked = _tracked_time_by_key(intervals, sign)
+    if not tracked:
+        return
+    statement = sqlite_insert(models.TimeRollup)
+    statement = statement.on_conflict_do_update(
+        index_elements=[models.TimeRollup.username, models.TimeRollup.day, models.TimeRollup.project_id],
+        set_=dict(tracked_seconds=models.TimeRollup.tracked_seconds + statement.excluded.tracked_seconds)
+    )
+    db.execute(statement, [dict(username=username, project_id=project_id, day=day, tracked_seconds=seconds)
+                           for (username, project_id, day), seconds in tracked.items()])
+
+
+def rebuild_time_rollups(db: Session, batch_size: int = 1000) -> int:
+    """ Recomputes all time rollups from stopped tasks and returns number of rollup rows. """
+    db.execute(delete(models.TimeRollup))
+    stopped_tasks = db.query(models.Task.owner_username,
+                             models.Task.project_id,
+                             models.Task.start_timestamp,
+                             models.Task.end_timestamp).filter(
+        and_(
+            models.Task.start_timestamp.is_not(None),
+            models.Task.end_timestamp.is_not(None)
+        )
+    ).yield_per(batch_size)
+    tracked = _tracked_time_by_key(stopped_tasks)
+    if tracked:
+        db.execute(insert(models.TimeRollup),
+                   [dict(username=username, project_id=project_id, day=day, tracked_seconds=seconds)
+                    for (username, project_id, day), seconds in tracked.items()])
+    db.commit()
+    return len(tracked)
+
+
+def get_time_report(db: Session, username: str,
+                    from_day: Optional[datetime.date] = None,
+                    to_day: Optional[datetime.date] = None,
+                    group_by: rest.schemas.TimeReportGrouping = rest.schemas.TimeReportGrouping.DAY):
+    group_column = {
+        rest.schemas.TimeReportGrouping.DAY: models.TimeRollup.day,
+        rest.schemas.TimeReportGrouping.PROJECT: models.TimeRollup.project_id,
+    }[group_by]
+    conditions = [
+        models.TimeRollup.username == username,
+        models.TimeRollup.day >= from_day if from_day is not None else True,
+        models.TimeRollup.day <= to_day if to_day is not None else True
+    ]
+    return db.query(group_column,
+                    func.sum(models.TimeRollup.tracked_seconds)).filter(
+        and_(*conditions)
+    ).group_by(group_column).order_by(group_column).all()
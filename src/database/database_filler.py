@@ -88,6 +88,8 @@ tasks = {
 
 
 def run(db: Session):
+    """ Seeds the small fixed dataset used by tests, see dataset_generator for large ones. """
+    user_projects_models.clear()
     for user in users:
         user_schema = schemas.UserCreate(**user)
         crud.create_user(db, user_schema)
@@ -99,7 +101,5 @@ def run(db: Session):
             user_projects_models[username].append(project)
 
     for (username, project_name), user_tasks in tasks.items():
-        for user_task in user_tasks:
-            project = crud.get_projects_by_owner_username_and_name(db, username, project_name)[0]
-            create_task_schema = schemas.TaskCreate(**user_task)
-            crud.create_task(db, username, project.id, create_task_schema)
+        project = next(project for project in user_projects_models[username] if project.name == project_name)
+        crud.create_tasks(db, username, project.id, [schemas.TaskCreate(**user_task) for user_task in user_tasks])
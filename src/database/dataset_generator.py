@@ -0,0 +1,156 @@
+""" Synthetic dataset generator for reproducing performance problems on realistic data volumes.
+
+Rows are inserted with executemany in transactions of `batch_size` rows, project and task ids
+are assigned up front so nothing has to be read back. Generated users all share the password
+`password` so it is hashed only once.
+
+Usage: python -m database.dataset_generator --users 10000 --projects-per-user 10 --tasks-per-project 20
+"""
+
+import argparse
+import datetime
+import os
+import random
+import time
+
+from sqlalchemy import func, insert, select
+from sqlalchemy.orm import Session
+
+from typing import Any, Dict, Iterator, List
+
+from . import crud, migrations, models
+from rest import schemas
+from utils import password_hasher
+
+
+password = 'password'
+
+
+def _batches(rows: Iterator[Dict[str, Any]], batch_size: int) -> Iterator[List[Dict[str, Any]]]:
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def _next_id(db: Session, model) -> int:
+    return (db.scalar(select(func.max(model.id))) or 0) + 1
+
+
+def generate(db: Session,
+             user_count: int,
+             projects_per_user: int,
+             tasks_per_project: int,
+             running_ratio: float = 0.05,
+             finished_ratio: float = 0.5,
+             public_ratio: float = 0.5,
+             seed: int = 0,
+             batch_size: int = 10000,
+             username_prefix: str = 'user') -> Dict[str, float]:
+    """ Inserts generated users with their projects and tasks, returns row counts and duration.
+
+    Of the tasks `running_ratio` have a running timer, `finished_ratio` were started and stopped
+    and the rest were never started. Time rollups are rebuilt at the end.
+    """
+    rng = random.Random(seed)
+    start = time.perf_counter()
+    now = datetime.datetime.now()
+    hashed_password = password_hasher.hash_password(password)
+    usernames = [f'{username_prefix}{index:07d}' for index in range(user_count)]
+    first_project_id = _next_id(db, models.Project)
+    first_task_id = _next_id(db, models.Task)
+
+    def users():
+        for username in usernames:
+            yield dict(username=username,
+                       email=f'{username}@example.com',
+                       bio=f'{username} bio',
+                       role=schemas.Role.BASIC,
+                       hashed_password=hashed_password)
+
+    def projects():
+        project_id = first_project_id
+        for username in usernames:
+            for index in range(projects_per_user):
+                visibility = (schemas.ProjectVisibility.PUBLIC if rng.random() < public_ratio
+                              else schemas.ProjectVisibility.PRIVATE)
+                yield dict(id=project_id,
+                           name=f'{username}_project{index:04d}',
+                           description=f'{username} project {index} description',
+                           visibility=visibility,
+                           owner_username=username)
+                project_id += 1
+
+    def tasks():
+        task_id = first_task_id
+        project_id = first_project_id
+        for username in usernames:
+            for _ in range(projects_per_user):
+                for index in range(tasks_per_project):
+                    start_timestamp = end_timestamp = None
+                    state = rng.random()
+                    if state < running_ratio + finished_ratio:
+                        start_timestamp = now - datetime.timedelta(seconds=rng.randrange(1, 30 * 24 * 3600))
+                    if running_ratio <= state < running_ratio + finished_ratio:
+                        end_timestamp = min(now, start_timestamp +
+                                            datetime.timedelta(seconds=rng.randrange(60, 8 * 3600)))
+                    yield dict(id=task_id,
+                               description=f'Task {index} of project {project_id}',
+                               project_id=project_id,
+                               owner_username=username,
+                               start_timestamp=start_timestamp,
+                               end_timestamp=end_timestamp)
+                    task_id += 1
+                project_id += 1
+
+    counts = dict(users=0, projects=0, tasks=0)
+    for name, model, rows in [('users', models.User, users()),
+                              ('projects', models.Project, projects()),
+                              ('tasks', models.Task, tasks())]:
+        for batch in _batches(rows, batch_size):
+            # Core insert of the table, the ORM one splits batches on every change of NULL columns
+            db.execute(insert(model.__table__), batch)
+            db.commit()
+            counts[name] += len(batch)
+
+    counts['time_rollups'] = crud.rebuild_time_rollups(db, batch_size=batch_size)
+    counts['seconds'] = time.perf_counter() - start
+    return counts
+
+
+if __name__ == '__main__':
+    from .db_init import create_sqlite_engine, get_db_path
+    from sqlalchemy.orm import sessionmaker
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--database', default=get_db_path(), help='Path of the SQLite database')
+    parser.add_argument('--reset', action='store_true', help='Delete the database first')
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--projects-per-user', type=int, default=10)
+    parser.add_argument('--tasks-per-project', type=int, default=20)
+    parser.add_argument('--running-ratio', type=float, default=0.05)
+    parser.add_argument('--finished-ratio', type=float, default=0.5)
+    parser.add_argument('--public-ratio', type=float, default=0.5)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--batch-size', type=int, default=10000)
+    args = parser.parse_args()
+
+    if args.reset and os.path.exists(args.database):
+        os.remove(args.database)
+    engine = create_sqlite_engine(f'sqlite:///{args.database}')
+    migrations.upgrade(engine)
+    with sessionmaker(bind=engine)() as session:
+        result = generate(session, args.users, args.projects_per_user, args.tasks_per_project,
+                          running_ratio=args.running_ratio,
+                          finished_ratio=args.finished_ratio,
+                          public_ratio=args.public_ratio,
+                          seed=args.seed,
+                          batch_size=args.batch_size)
+    rows = result['users'] + result['projects'] + result['tasks'] + result['time_rollups']
+    print(f"Inserted {result['users']} users, {result['projects']} projects, {result['tasks']} tasks "
+          f"and {result['time_rollups']} time rollups in {result['seconds']:.1f} s "
+          f"({rows / result['seconds']:.0f} rows/s)")
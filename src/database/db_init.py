@@ -1,9 +1,37 @@
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import Engine
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import QueuePool
 
+import logging
 import os
 from pathlib import Path
+from typing import Any, Dict
+
+from utils import metrics
+from utils.slow_queries import slow_query_recorder
+from utils.settings import Settings, settings
+
+from .write_queue import write_queue
+
+
+logger = logging.getLogger(__name__)
+
+_pragma_names = ['journal_mode', 'synchronous', 'busy_timeout', 'cache_size', 'mmap_size']
+_pool_option_names = ['pool_size', 'max_overflow', 'pool_timeout']
+
+profiles: Dict[str, Dict[str, Any]] = {
+    'default': dict(),
+    'production': dict(journal_mode='WAL',
+                       synchronous='NORMAL',
+                       busy_timeout=5000,
+                       cache_size=-64 * 1024,
+                       mmap_size=256 * 1024 * 1024,
+                       pool_size=10,
+                       max_overflow=20,
+                       pool_timeout=30),
+}
 
 
 def get_db_path():
@@ -12,9 +40,154 @@ def get_db_path():
     return str(parent_path.joinpath("database.db"))
 
 
-engine = create_engine(
-    f"sqlite:///{get_db_path()}", connect_args={"check_same_thread": False}
-)
+def get_engine_options(engine_settings: Settings) -> Dict[str, Any]:
+    options = dict(profiles[engine_settings.db_profile])
+    for name in _pragma_names + _pool_option_names:
+        value = getattr(engine_settings, f'db_{name}')
+        if value is not None:
+            options[name] = value
+    return options
+
+
+def get_read_engine_options(engine_settings: Settings) -> Dict[str, Any]:
+    """ Options of read-only engines, db_read_* pool options override the ones of writers. """
+    options = get_engine_options(engine_settings)
+    # Journal mode is a property of the database file, it is set by writers
+    options.pop('journal_mode', None)
+    for name in _pool_option_names:
+        value = getattr(engine_settings, f'db_read_{name}')
+        if value is not None:
+            options[name] = value
+    options['query_only'] = 'ON'
+    return options
+
+
+def read_only_url(url: str) -> str:
+    """ URI filename URL opening the database of `url` with mode=ro. """
+    prefix, path = url.split(':///', 1)
+    return f'{prefix}:///file:{path}?mode=ro&uri=true'
+
+
+def get_pool_options(options: Dict[str, Any]) -> Dict[str, Any]:
+    return {name: options[name] for name in _pool_option_names if name in options}
+
+
+def set_pragmas(engine: Engine, options: Dict[str, Any]):
+    pragmas = [(name, options[name]) for name in _pragma_names + ['query_only'] if name in options]
+    if not pragmas:
+        return
+
+    @event.listens_for(engine, 'connect')
+    def on_connect(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for name, value in pragmas:
+            cursor.execute(f'PRAGMA {name} = {value}')
+        cursor.close()
+
+
+def create_sqlite_engine(url: str, engine_settings: Settings = settings, read_only: bool = False,
+                         **kwargs) -> Engine:
+    """ Engine with the pragmas and pool options of the settings, with mode=ro and query_only if `read_only`. """
+    if read_only:
+        options = get_read_engine_options(engine_settings)
+        url = read_only_url(url)
+    else:
+        options = get_engine_options(engine_settings)
+    engine = create_engine(url, connect_args={"check_same_thread": False},
+                           **get_pool_options(options), **kwargs)
+    set_pragmas(engine, options)
+    return engine
+
+
+def create_async_sqlite_engine(url: str, engine_settings: Settings = settings, read_only: bool = False,
+                               **kwargs):
+    """ Like `create_sqlite_engine` on the aiosqlite driver. """
+    # Imported only in async mode, aiosqlite is not needed otherwise
+    from sqlalchemy.ext.asyncio import create_async_engine
+
+    if read_only:
+        options = get_read_engine_options(engine_settings)
+        url = read_only_url(url)
+    else:
+        options = get_engine_options(engine_settings)
+    async_engine = create_async_engine(url.replace('sqlite://', 'sqlite+aiosqlite://'),
+                                       **get_pool_options(options), **kwargs)
+    set_pragmas(async_engine.sync_engine, options)
+    return async_engine
+
+
+def get_pool_stats(engine: Engine) -> Dict[str, float]:
+    """ Connections of a queue pool by state, empty for pools without a fixed size. """
+    pool = engine.pool
+    if not isinstance(pool, QueuePool):
+        return {}
+    checked_out = pool.checkedout()
+    return dict(size=pool.size(),
+                checked_out=checked_out,
+                checked_in=pool.checkedin(),
+                overflow=max(pool.overflow(), 0),
+                utilization=checked_out / pool.size() if pool.size() else 0.0)
+
+
+def get_effective_settings(engine: Engine) -> Dict[str, Any]:
+    """ Reads back settings as SQLite and the pool actually applied them. """
+    with engine.connect() as conn:
+        effective = {name: conn.exec_driver_sql(f'PRAGMA {name}').scalar() for name in _pragma_names}
+    effective['pool'] = engine.pool.status()
+    return effective
+
+
+def log_effective_settings(engine: Engine):
+    logger.info('Database %s: %s', engine.url, get_effective_settings(engine))
+
+
+def _instrument(engine: Engine):
+    if settings.metrics_enabled:
+        metrics.instrument_engine(engine)
+    if settings.slow_query_threshold is not None:
+        slow_query_recorder.instrument(engine)
+
+
+# Mutations go through the write engine, GET routes read through the read-only one which in WAL
+# mode never waits for writers
+engine = create_sqlite_engine(f"sqlite:///{get_db_path()}")
+read_engine = create_sqlite_engine(f"sqlite:///{get_db_path()}", read_only=True)
+_instrument(engine)
+_instrument(read_engine)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+ReadSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=read_engine)
+if settings.write_queue_enabled:
+    write_queue.bind(engine)
+
+# Engines serving requests by pool name, for utilization metrics
+pools: Dict[str, Engine] = dict(write=engine, read=read_engine)
+
+async_engine = None
+async_read_engine = None
+AsyncSessionLocal = None
+AsyncReadSessionLocal = None
+if settings.async_database:
+    from sqlalchemy.ext.asyncio import async_sessionmaker
+
+    async_engine = create_async_sqlite_engine(f"sqlite:///{get_db_path()}")
+    async_read_engine = create_async_sqlite_engine(f"sqlite:///{get_db_path()}", read_only=True)
+    _instrument(async_engine.sync_engine)
+    _instrument(async_read_engine.sync_engine)
+    # Objects must stay loaded after commit, expired attributes can't be lazy loaded in async code
+    AsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
+    AsyncReadSessionLocal = async_sessionmaker(async_read_engine, autoflush=False, expire_on_commit=False)
+    pools = dict(write=async_engine.sync_engine, read=async_read_engine.sync_engine)
+
+
+def _after_fork_in_child():
+    # SQLite connections must not be shared with the parent, a forked process drops the pooled
+    # ones without closing them (that would affect the parent) and opens its own. All engines,
+    # not only those in `pools`, the write queue keeps using `engine` also in async mode.
+    for created_engine in [engine, read_engine, async_engine, async_read_engine]:
+        if created_engine is not None:
+            getattr(created_engine, 'sync_engine', created_engine).dispose(close=False)
+
+
+os.register_at_fork(after_in_child=_after_fork_in_child)
 
 Base = declarative_base()
@@ -0,0 +1,126 @@
+""" Versioned schema migrations for the SQLite database.
+
+Schema version is kept in `PRAGMA user_version`. Fresh databases are created from the models and
+stamped with the latest version, existing ones get pending migrations applied in place.
+
+SQLite runs DDL outside of the transaction, so every migration has to be idempotent in case it is
+interrupted and run again.
+
+Usage: python -m database.migrations
+"""
+
+from sqlalchemy import inspect
+from sqlalchemy.engine import Connection, Engine
+
+from typing import Callable, List, Tuple
+
+from . import models
+from .db_init import Base
+
+
+def get_version(conn: Connection) -> int:
+    return conn.exec_driver_sql('PRAGMA user_version').scalar()
+
+
+def set_version(conn: Connection, version: int):
+    conn.exec_driver_sql(f'PRAGMA user_version = {int(version)}')
+
+
+def create_index(conn: Connection, name: str, table: str, columns: List[str]):
+    conn.exec_driver_sql(f'CREATE INDEX IF NOT EXISTS {name} ON {table} ({", ".join(columns)})')
+
+
+def add_column(conn: Connection, table: str, name: str, definition: str):
+    existing_columns = [row[1] for row in conn.exec_driver_sql(f'PRAGMA table_info({table})')]
+    if name not in existing_columns:
+        conn.exec_driver_sql(f'ALTER TABLE {table} ADD COLUMN {name} {definition}')
+
+
+def _add_secondary_indexes(conn: Connection):
+    create_index(conn, 'ix_projects_owner_username_visibility', 'projects',
+                 ['owner_username', 'visibility'])
+    create_index(conn, 'ix_projects_owner_username_name', 'projects', ['owner_username', 'name'])
+    create_index(conn, 'ix_tasks_project_id', 'tasks', ['project_id'])
+    create_index(conn, 'ix_tasks_owner_username', 'tasks', ['owner_username'])
+
+
+def _add_time_rollups(conn: Connection):
+    conn.exec_driver_sql('''
+        CREATE TABLE IF NOT EXISTS time_rollups (
+            username VARCHAR NOT NULL REFERENCES users (username),
+            day DATE NOT NULL,
+            project_id INTEGER NOT NULL REFERENCES projects (id),
+            tracked_seconds FLOAT NOT NULL,
+            PRIMARY KEY (username, day, project_id)
+        )
+    ''')
+    # Tracked time of stopped tasks split at midnights, as the schema of this version stores it.
+    # Plain SQL so that later changes of crud or the models don't change this migration.
+    conn.exec_driver_sql('DELETE FROM time_rollups')
+    conn.exec_driver_sql('''
+        WITH RECURSIVE parts (username, project_id, start, "end") AS (
+            SELECT owner_username, project_id, start_timestamp, end_timestamp FROM tasks
+            WHERE start_timestamp IS NOT NULL AND end_timestamp IS NOT NULL
+                AND julianday(end_timestamp) > julianday(start_timestamp)
+            UNION ALL
+            SELECT username, project_id, datetime(date(start), '+1 day'), "end" FROM parts
+            WHERE julianday(date(start), '+1 day') < julianday("end")
+        )
+        INSERT INTO time_rollups (username, day, project_id, tracked_seconds)
+        SELECT username, date(start), project_id,
+            round(sum((min(julianday("end"), julianday(date(start), '+1 day')) - julianday(start)) * 86400), 6)
+        FROM parts
+        GROUP BY username, date(start), project_id
+    ''')
+
+
+def _add_versions(conn: Connection):
+    add_column(conn, 'projects', 'version', 'INTEGER NOT NULL DEFAULT 1')
+    add_column(conn, 'tasks', 'version', 'INTEGER NOT NULL DEFAULT 1')
+
+
+def _add_token_epochs(conn: Connection):
+    add_column(conn, 'users', 'token_epoch', 'INTEGER NOT NULL DEFAULT 0')
+
+
+def _add_user_versions(conn: Connection):
+    add_column(conn, 'users', 'version', 'INTEGER NOT NULL DEFAULT 1')
+
+
+# Version of the schema after a migration is its position in this list + 1. Only append!
+migrations: List[Tuple[str, Callable[[Connection], None]]] = [
+    ('Add secondary indexes on projects and tasks', _add_secondary_indexes),
+    ('Add time rollups table', _add_time_rollups),
+    ('Add project and task versions', _add_versions),
+    ('Add token epochs of users', _add_token_epochs),
+    ('Add user versions', _add_user_versions),
+]
+
+latest_version = len(migrations)
+
+
+def upgrade(engine: Engine) -> List[str]:
+    """ Brings database schema to the latest version and returns descriptions of applied migrations. """
+    with engine.begin() as conn:
+        if not inspect(conn).has_table(models.User.__tablename__):
+            Base.metadata.create_all(bind=conn)
+            set_version(conn, latest_version)
+            return []
+        version = get_version(conn)
+
+    applied = []
+    for version, (description, migrate) in enumerate(migrations[version:], start=version + 1):
+        with engine.begin() as conn:
+            migrate(conn)
+            set_version(conn, version)
+        applied.append(description)
+    return applied
+
+
+if __name__ == '__main__':
+    from .db_init import engine
+
+    for description in upgrade(engine):
+        print(f'Applied: {description}')
+    with engine.connect() as connection:
+        print(f'Schema version: {get_version(connection)}')
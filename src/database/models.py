@@ -1,4 +1,4 @@
-from sqlalchemy import Enum, Column, ForeignKey, Integer, String, DateTime
+from sqlalchemy import Enum, Column, ForeignKey, Index, Integer, String, Date, DateTime, Float
 from sqlalchemy.orm import relationship
 
 from .db_init import Base
@@ -13,6 +13,9 @@ class User(Base):
     bio = Column(String, nullable=False)
     hashed_password = Column(String)
     role = Column(Enum(user.Role), nullable=False)
+    # Bumped to revoke all bearer tokens issued to the user
+    token_epoch = Column(Integer, nullable=False, default=0, server_default='0')
+    version = Column(Integer, nullable=False, default=1, server_default='1')
 
     projects = relationship('Project', back_populates='owner')
     tasks = relationship('Task', back_populates='owner')
@@ -28,12 +31,18 @@ class User(Base):
 
 class Project(Base):
     __tablename__ = 'projects'
+    __table_args__ = (
+        Index('ix_projects_owner_username_visibility', 'owner_username', 'visibility'),
+        Index('ix_projects_owner_username_name', 'owner_username', 'name'),
+    )
 
     id = Column(Integer, primary_key=True)
     name = Column(String, nullable=False)
     description = Column(String, nullable=False)
     visibility = Column(Enum(project.ProjectVisibility), nullable=False)
     owner_username = Column(Integer, ForeignKey('users.username'))
+    # Bumped by every write to the project or its tasks, used for ETags
+    version = Column(Integer, nullable=False, default=1, server_default='1')
 
     owner = relationship('User', back_populates='projects')
     tasks = relationship('Task', back_populates='project')
@@ -45,6 +54,10 @@ class Project(Base):
 
 class Task(Base):
     __tablename__ = 'tasks'
+    __table_args__ = (
+        Index('ix_tasks_project_id', 'project_id'),
+        Index('ix_tasks_owner_username', 'owner_username'),
+    )
 
     id = Column(Integer, primary_key=True)
     description = Column(String, nullable=False)
@@ -52,6 +65,18 @@ class Task(Base):
     end_timestamp = Column(DateTime, nullable=True)
     project_id = Column(Integer, ForeignKey('projects.id'))
     owner_username = Column(Integer, ForeignKey('users.username'))
+    # Bumped by every write to the task, used for ETags
+    version = Column(Integer, nullable=False, default=1, server_default='1')
 
     project = relationship('Project', back_populates='tasks')
     owner = relationship('User', back_populates='tasks')
+
+
+class TimeRollup(Base):
+    """ Tracked seconds of stopped tasks per (user, project, day), maintained by crud writes. """
+    __tablename__ = 'time_rollups'
+
+    username = Column(String, ForeignKey('users.username'), primary_key=True)
+    day = Column(Date, primary_key=True)
+    project_id = Column(Integer, ForeignKey('projects.id'), primary_key=True)
+    tracked_seconds = Column(Float, nullable=False, default=0)
@@ -0,0 +1,184 @@
+""" Single writer with group commit for SQLite.
+
+With the queue bound to an engine, mutating crud functions are not run on the request session
+but handed to one writer thread. The writer takes whatever operations are pending, up to
+`max_batch` of them or those arriving within `max_delay` seconds of the first, and runs them in
+a single BEGIN IMMEDIATE transaction. Every operation runs in its own SAVEPOINT, commits and
+rollbacks issued by the crud function only end that savepoint, so a failing operation never
+takes the others of its batch down. Futures of the callers resolve once the whole batch is
+committed, each with the result or exception of its own operation.
+
+Writers no longer wait on the SQLite file lock against each other and a burst of mutations
+costs one commit (and one fsync) instead of one per request.
+"""
+
+import asyncio
+import concurrent.futures
+import contextvars
+import queue
+import threading
+import time
+
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session, SessionTransaction, sessionmaker
+
+from utils.settings import settings
+
+
+class GroupCommitSession(Session):
+    """ Session of the writer, while an operation runs commit and rollback only end its savepoint. """
+
+    _savepoint: Optional[SessionTransaction] = None
+
+    def begin_operation(self):
+        self._savepoint = self.begin_nested()
+
+    def end_operation(self):
+        self._savepoint.commit()
+        self._savepoint = None
+
+    def abort_operation(self):
+        savepoint, self._savepoint = self._savepoint, None
+        # Also after a failed flush, which leaves the savepoint inactive but not rolled back
+        savepoint.rollback()
+
+    def commit(self):
+        if self._savepoint is None:
+            return super().commit()
+        self._savepoint.commit()
+        self._savepoint = self.begin_nested()
+
+    def rollback(self):
+        if self._savepoint is None:
+            return super().rollback()
+        self._savepoint.rollback()
+        self._savepoint = self.begin_nested()
+
+
+class _Operation:
+    __slots__ = ('fn', 'args', 'kwargs', 'context', 'future', 'result', 'exception')
+
+    def __init__(self, fn: Callable[..., Any], args: Tuple, kwargs: Dict[str, Any]):
+        self.fn = fn
+        self.args = args
+        self.kwargs = kwargs
+        # Statements are attributed to the caller's request by utils.metrics
+        self.context = contextvars.copy_context()
+        self.future = concurrent.futures.Future()
+        self.result = None
+        self.exception = None
+
+
+class WriteQueue:
+    def __init__(self, max_batch: int = 64, max_delay: float = 0.002):
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self.batches = 0
+        self.operations = 0
+        self.failed_batches = 0
+        self.largest_batch = 0
+        self._session_factory: Optional[sessionmaker] = None
+        self._queue: queue.Queue = queue.Queue()
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return self._session_factory is not None
+
+    def bind(self, engine: Optional[Engine]):
+        """ Routes mutations to the writer of `engine`, back to request sessions with None. """
+        self.stop()
+        self._session_factory = (sessionmaker(bind=engine, class_=GroupCommitSession,
+                                              autoflush=False, expire_on_commit=False)
+                                 if engine is not None else None)
+
+    def submit(self, fn: Callable[..., Any], *args, **kwargs) -> concurrent.futures.Future:
+        """ Queues `fn(db, *args, **kwargs)` for the writer, the future resolves after its commit. """
+        if not self.enabled:
+            raise RuntimeError('Write queue is not bound to an engine')
+        operation = _Operation(fn, args, kwargs)
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='write-queue', daemon=True)
+                self._thread.start()
+            self._queue.put(operation)
+        return operation.future
+
+    async def run(self, fn: Callable[..., Any], *args, **kwargs) -> Any:
+        return await asyncio.wrap_future(self.submit(fn, *args, **kwargs))
+
+    def stop(self):
+        """ Lets the writer finish queued operations and waits for it. """
+        with self._lock:
+            thread, self._thread = self._thread, None
+            if thread is not None:
+                self._queue.put(None)
+        if thread is not None:
+            thread.join()
+
+    def _run(self):
+        stopping = False
+        while not stopping:
+            operation = self._queue.get()
+            if operation is None:
+                break
+            batch = [operation]
+            deadline = time.monotonic() + self.max_delay
+            while len(batch) < self.max_batch:
+                try:
+                    operation = self._queue.get(timeout=max(deadline - time.monotonic(), 0))
+                except queue.Empty:
+                    break
+                if operation is None:
+                    stopping = True
+                    break
+                batch.append(operation)
+            self._execute(batch)
+
+    def _execute(self, batch: List[_Operation]):
+        db = self._session_factory()
+        try:
+            # Takes the write lock up front, SAVEPOINT alone would start the transaction and
+            # releasing it would commit
+            db.connection().exec_driver_sql('BEGIN IMMEDIATE')
+            for operation in batch:
+                db.begin_operation()
+                try:
+                    operation.result = operation.context.run(operation.fn, db, *operation.args,
+                                                             **operation.kwargs)
+                    db.end_operation()
+                except Exception as e:
+                    operation.exception = e
+                    db.abort_operation()
+            db.commit()
+        except Exception as e:
+            # Whole transaction, not only the savepoint of an operation
+            Session.rollback(db)
+            with self._lock:
+                self.failed_batches += 1
+            for operation in batch:
+                operation.future.set_exception(e)
+            return
+        finally:
+            db.close()
+
+        with self._lock:
+            self.batches += 1
+            self.operations += len(batch)
+            self.largest_batch = max(self.largest_batch, len(batch))
+        for operation in batch:
+            if operation.exception is not None:
+                operation.future.set_exception(operation.exception)
+            else:
+                operation.future.set_result(operation.result)
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return dict(batches=self.batches, operations=self.operations, failed_batches=self.failed_batches,
+                        largest_batch=self.largest_batch, queued=self._queue.qsize())
+
+
+write_queue = WriteQueue(settings.write_queue_max_batch, settings.write_queue_max_delay / 1000)
@@ -0,0 +1,69 @@
+import hashlib
+import urllib.parse
+
+from fastapi import HTTPException, Response, status
+
+from typing import Optional
+
+
+def make_etag(*parts) -> str:
+    """ Strong ETag of a resource, `parts` must identify the resource and its version. """
+    digest = hashlib.blake2b('/'.join(str(part) for part in parts).encode(), digest_size=12)
+    return f'"{digest.hexdigest()}"'
+
+
+def make_version_etag(kind: str, key, version: int) -> str:
+    """ ETag the server can read the version back from with `if_match_version`. """
+    return f'"{kind}-{urllib.parse.quote(str(key), safe="")}-v{version}"'
+
+
+def if_match_version(if_match: Optional[str], kind: str, key) -> Optional[int]:
+    """ Version If-Match requires the resource to still have, None if any version is fine.
+
+    Nothing is read to check it, the conditional UPDATE matches the version itself. ETags that
+    aren't of this resource can't match, versions only grow so of several listed the highest
+    is the one that can still be current.
+    """
+    if if_match is None or if_match.strip() == '*':
+        return None
+    prefix = make_version_etag(kind, key, '')[:-1]
+    versions = []
+    for candidate in if_match.split(','):
+        candidate = candidate.strip()
+        if candidate.startswith(prefix) and candidate.endswith('"') and candidate[len(prefix):-1].isdigit():
+            versions.append(int(candidate[len(prefix):-1]))
+    if not versions:
+        raise precondition_failed()
+    return max(versions)
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    if if_none_match is None:
+        return False
+    if if_none_match.strip() == '*':
+        return True
+    # If-None-Match uses weak comparison, W/ prefix is ignored
+    candidates = [candidate.strip().removeprefix('W/') for candidate in if_none_match.split(',')]
+    return etag in candidates
+
+
+def if_match_satisfied(if_match: Optional[str], etag: Optional[str]) -> bool:
+    """ Strong comparison of If-Match with ETag of the current resource, None if it doesn't exist. """
+    if if_match is None:
+        return True
+    if etag is None:
+        return False
+    if if_match.strip() == '*':
+        return True
+    return etag in [candidate.strip() for candidate in if_match.split(',')]
+
+
+def precondition_failed() -> HTTPException:
+    return HTTPException(
+        status_code=status.HTTP_412_PRECONDITION_FAILED,
+        detail="Precondition failed"
+    )
+
+
+def not_modified(etag: str) -> Response:
+    return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers={'ETag': etag})
@@ -0,0 +1,39 @@
+import csv
+import datetime
+import io
+import json
+
+from sqlalchemy import Row
+
+from typing import AsyncIterator, List
+
+
+task_export_columns = ['id', 'project_id', 'owner_username', 'description',
+                       'start_timestamp', 'end_timestamp']
+
+
+def _export_value(value):
+    if isinstance(value, datetime.datetime):
+        return value.isoformat()
+    return value
+
+
+async def encode_ndjson(partitions: AsyncIterator[List[Row]]) -> AsyncIterator[bytes]:
+    async for rows in partitions:
+        yield ''.join(json.dumps({column: _export_value(value)
+                                  for column, value in zip(task_export_columns, row)}) + '\n'
+                      for row in rows).encode()
+
+
+async def encode_csv(partitions: AsyncIterator[List[Row]]) -> AsyncIterator[bytes]:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(task_export_columns)
+    async for rows in partitions:
+        writer.writerows([[_export_value(value) for value in row] for row in rows])
+        yield buffer.getvalue().encode()
+        buffer.seek(0)
+        buffer.truncate()
+    # Header of an empty export
+    if buffer.tell():
+        yield buffer.getvalue().encode()
@@ -0,0 +1,437 @@
+""" Pre-forking launcher of the API.
+
+The master binds the listening socket and forks the workers, which import the app only after
+the fork, so each of them creates its own database engines and connections. Every worker runs a
+uvicorn server on the shared socket and reports its health to the master through a pipe every
+`health_interval` seconds. Reports are sent from the worker's event loop, a worker with a
+blocked loop stops reporting.
+
+The master
+- replaces workers which exit or don't report for `health_timeout` seconds,
+- on SIGHUP restarts the workers one at a time, an old worker is stopped only once its
+  replacement reported and gets `graceful_timeout` seconds to finish its requests,
+- on SIGTERM or SIGINT stops all workers gracefully,
+- writes the health of all workers as JSON to `status_path`,
+- generates `token_secret` before forking if it isn't set, so all workers accept each other's tokens,
+- with more than one worker caps TTLs of the per-process caches (principals, token epochs, public
+  project listings) to `server_worker_cache_ttl`. A write invalidates only the caches of the
+  worker which handled it, other workers may serve the old role, a revoked token or a stale
+  listing for up to that many seconds.
+
+Usage: python -m rest.launcher --workers 4 --port 8000
+"""
+
+import argparse
+import importlib.util
+import json
+import logging
+import os
+import secrets
+import select
+import signal
+import socket
+import sys
+import time
+
+from typing import Any, Dict, List, Optional
+
+import uvicorn
+
+from utils.settings import settings
+
+
+logger = logging.getLogger(__name__)
+
+app_path = 'rest.main:app'
+
+# uvicorn calls Server.on_tick every 0.1 s
+_tick_interval = 0.1
+
+
+def check_implementations(loop: str, http: str):
+    """ Fails early if an explicitly selected event loop or HTTP parser is not installed. """
+    for option, value, module in [('loop', loop, 'uvloop'), ('http', http, 'httptools')]:
+        if value == module and importlib.util.find_spec(module) is None:
+            raise ValueError(f'{option} {value} is selected but the {module} package is not installed')
+
+
+class WorkerServer(uvicorn.Server):
+    """ Uvicorn server reporting its health on `health_fd`. """
+
+    def __init__(self, config: uvicorn.Config, health_fd: int, generation: int, health_interval: float,
+                 log_database_settings: bool = False):
+        super().__init__(config)
+        self.health_fd = health_fd
+        self.generation = generation
+        self.ticks_per_report = max(round(health_interval / _tick_interval), 1)
+        self.log_database_settings = log_database_settings
+        self.started = time.time()
+
+    async def startup(self, sockets: Optional[List[socket.socket]] = None):
+        await super().startup(sockets=sockets)
+        if self.log_database_settings:
+            import database.db_init
+            # Connecting would create an empty database
+            if os.path.exists(database.db_init.get_db_path()):
+                database.db_init.log_effective_settings(database.db_init.engine)
+
+    async def on_tick(self, counter: int) -> bool:
+        # First tick comes right after startup, the report tells the master the worker is ready
+        if counter % self.ticks_per_report == 0:
+            self.report()
+        return await super().on_tick(counter)
+
+    def report(self):
+        health = dict(pid=os.getpid(),
+                      generation=self.generation,
+                      started=self.started,
+                      reported=time.time(),
+                      requests=self.server_state.total_requests,
+                      connections=len(self.server_state.connections),
+                      tasks=len(self.server_state.tasks))
+        try:
+            os.write(self.health_fd, json.dumps(health).encode() + b'\n')
+        except BlockingIOError:
+            # Master is behind, the next report will do
+            pass
+
+
+class Worker:
+    def __init__(self, pid: int, slot: int, generation: int, health_fd: int):
+        self.pid = pid
+        self.slot = slot
+        self.generation = generation
+        self.health_fd = health_fd
+        self.started = time.time()
+        self.health: Optional[Dict[str, Any]] = None
+        self.last_report: Optional[float] = None
+        self.retiring = False
+        self._buffer = b''
+
+    def read_reports(self):
+        try:
+            data = os.read(self.health_fd, 65536)
+        except BlockingIOError:
+            return
+        lines = (self._buffer + data).split(b'\n')
+        self._buffer = lines.pop()
+        for line in lines:
+            self.health = json.loads(line)
+            self.last_report = time.monotonic()
+
+    def status(self, health_timeout: float) -> Dict[str, Any]:
+        healthy = self.last_report is not None and time.monotonic() - self.last_report < health_timeout
+        return dict(pid=self.pid, slot=self.slot, generation=self.generation, retiring=self.retiring,
+                    healthy=healthy, health=self.health)
+
+
+class Launcher:
+    def __init__(self, worker_count: int, host: str, port: int,
+                 backlog: int = 2048,
+                 health_interval: float = 5.0,
+                 health_timeout: float = 30.0,
+                 graceful_timeout: int = 30,
+                 status_path: Optional[str] = None,
+                 **server_options):
+        self.worker_count = worker_count
+        self.host = host
+        self.port = port
+        self.backlog = backlog
+        self.health_interval = health_interval
+        self.health_timeout = health_timeout
+        self.graceful_timeout = graceful_timeout
+        self.status_path = status_path
+        self.server_options = server_options
+        self.generation = 0
+        self.workers: Dict[int, Worker] = {}
+        self.socket: Optional[socket.socket] = None
+        self._stopping = False
+        self._restart_requested = False
+        self._restarting: List[Worker] = []
+        self._replacement: Optional[Worker] = None
+        self._wakeup_fds = None
+
+    def bind(self) -> socket.socket:
+        config = uvicorn.Config(app_path, host=self.host, port=self.port, backlog=self.backlog)
+        self.socket = config.bind_socket()
+        self.port = self.socket.getsockname()[1]
+        return self.socket
+
+    def spawn(self, slot: int) -> Worker:
+        read_fd, write_fd = os.pipe()
+        os.set_blocking(read_fd, False)
+        pid = os.fork()
+        if pid == 0:
+            os.close(read_fd)
+            exit_code = 1
+            try:
+                self._run_worker(slot, write_fd)
+                exit_code = 0
+            except BaseException:
+                logger.exception('Worker %d failed', os.getpid())
+            finally:
+                os._exit(exit_code)
+        os.close(write_fd)
+        worker = Worker(pid, slot, self.generation, read_fd)
+        self.workers[pid] = worker
+        logger.info('Started worker %d (slot %d, generation %d)', pid, slot, self.generation)
+        return worker
+
+    def _run_worker(self, slot: int, health_fd: int):
+        for signum in [signal.SIGHUP, signal.SIGCHLD, signal.SIGTERM, signal.SIGINT]:
+            signal.signal(signum, signal.SIG_DFL)
+        signal.set_wakeup_fd(-1)
+        for fd in self._wakeup_fds or ():
+            os.close(fd)
+        for worker in self.workers.values():
+            os.close(worker.health_fd)
+        os.set_blocking(health_fd, False)
+
+        config = uvicorn.Config(app_path,
+                                backlog=self.backlog,
+                                timeout_graceful_shutdown=self.graceful_timeout,
+                                **self.server_options)
+        server = WorkerServer(config, health_fd, self.generation, self.health_interval,
+                              log_database_settings=slot == 0 and self.generation == 0)
+        server.run(sockets=[self.socket])
+
+    def _handle_signal(self, signum, frame):
+        if signum == signal.SIGHUP:
+            self._restart_requested = True
+        elif signum in (signal.SIGTERM, signal.SIGINT):
+            self._stopping = True
+
+    def run(self) -> int:
+        if self.socket is None:
+            self.bind()
+        read_fd, write_fd = os.pipe()
+        os.set_blocking(read_fd, False)
+        os.set_blocking(write_fd, False)
+        self._wakeup_fds = (read_fd, write_fd)
+        # Signals interrupt the select below through the wakeup pipe
+        signal.set_wakeup_fd(write_fd)
+        for signum in [signal.SIGHUP, signal.SIGTERM, signal.SIGINT]:
+            signal.signal(signum, self._handle_signal)
+        signal.signal(signal.SIGCHLD, lambda signum, frame: None)
+
+        share_token_secret()
+        limit_cache_ttls(self.worker_count)
+        logger.info('Listening on %s:%d with %d workers', self.host, self.port, self.worker_count)
+        for slot in range(self.worker_count):
+            self.spawn(slot)
+
+        while not self._stopping:
+            fds = [read_fd] + [worker.health_fd for worker in self.workers.values()]
+            try:
+                readable, _, _ = select.select(fds, [], [], self.health_interval)
+            except InterruptedError:
+                readable = []
+            if read_fd in readable:
+                try:
+                    while os.read(read_fd, 1024):
+                        pass
+                except BlockingIOError:
+                    pass
+            for worker in list(self.workers.values()):
+                if worker.health_fd in readable:
+                    worker.read_reports()
+            self._reap()
+            self._check_health()
+            self._rolling_restart()
+            self.write_status()
+
+        self.stop()
+        os.close(read_fd)
+        os.close(write_fd)
+        return 0
+
+    def _reap(self):
+        while self.workers:
+            try:
+                pid, wait_status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                return
+            if pid == 0:
+                return
+            worker = self.workers.pop(pid, None)
+            if worker is None:
+                continue
+            os.close(worker.health_fd)
+            if worker.retiring or self._stopping:
+                logger.info('Worker %d stopped', pid)
+                continue
+            exit_code = os.waitstatus_to_exitcode(wait_status)
+            if worker is self._replacement:
+                # Old workers keep serving, the rolling restart tries again
+                logger.warning('Replacement worker %d exited with %d', pid, exit_code)
+                self._replacement = None
+                time.sleep(1)
+                continue
+            if exit_code == 0:
+                # Reached server_max_requests
+                logger.info('Worker %d exited, replacing it', pid)
+            else:
+                logger.warning('Worker %d exited with %d, replacing it', pid, exit_code)
+                if worker.last_report is None:
+                    # Failed on startup, don't fork in a tight loop
+                    time.sleep(1)
+            if worker in self._restarting:
+                # Its slot gets a worker of the new generation below, a replacement already
+                # started for it would make one worker too many
+                if worker is self._restarting[0] and self._replacement is not None:
+                    self._replacement.retiring = True
+                    self._kill(self._replacement.pid, signal.SIGTERM)
+                    self._replacement = None
+                self._restarting.remove(worker)
+            self.spawn(worker.slot)
+
+    def _check_health(self):
+        now = time.monotonic()
+        started = time.time()
+        for worker in self.workers.values():
+            last_report = worker.last_report
+            if last_report is None:
+                stale = started - worker.started > self.health_timeout
+            else:
+                stale = now - last_report > self.health_timeout
+            if stale and not worker.retiring:
+                logger.warning('Worker %d did not report for %.0f s, killing it', worker.pid, self.health_timeout)
+                self._kill(worker.pid, signal.SIGKILL)
+
+    def _rolling_restart(self):
+        if self._restart_requested and not self._restarting:
+            self._restart_requested = False
+            self.generation += 1
+            self._restarting = [worker for worker in self.workers.values() if not worker.retiring]
+            logger.info('Restarting %d workers (generation %d)', len(self._restarting), self.generation)
+
+        replacement = self._replacement
+        if replacement is not None and replacement.last_report is None:
+            return
+        if replacement is not None:
+            # Replacement is serving, the worker it replaces can finish its requests and exit
+            old = self._restarting.pop(0)
+            old.retiring = True
+            self._kill(old.pid, signal.SIGTERM)
+            self._replacement = None
+        while self._restarting and self._restarting[0].pid not in self.workers:
+            # Exited on its own and was replaced already
+            self._restarting.pop(0)
+        if self._restarting:
+            self._replacement = self.spawn(self._restarting[0].slot)
+
+    @staticmethod
+    def _kill(pid: int, signum: int):
+        try:
+            os.kill(pid, signum)
+        except ProcessLookupError:
+            pass
+
+    def stop(self):
+        logger.info('Stopping %d workers', len(self.workers))
+        for worker in self.workers.values():
+            worker.retiring = True
+            self._kill(worker.pid, signal.SIGTERM)
+        deadline = time.monotonic() + self.graceful_timeout + 5
+        while self.workers and time.monotonic() < deadline:
+            self._reap()
+            time.sleep(0.1)
+        for worker in self.workers.values():
+            self._kill(worker.pid, signal.SIGKILL)
+        while self.workers:
+            pid, _ = os.waitpid(-1, 0)
+            worker = self.workers.pop(pid, None)
+            if worker is not None:
+                os.close(worker.health_fd)
+        self.socket.close()
+        self.write_status()
+
+    def status(self) -> Dict[str, Any]:
+        return dict(pid=os.getpid(),
+                    port=self.port,
+                    generation=self.generation,
+                    stopping=self._stopping,
+                    restarting=bool(self._restarting),
+                    workers=sorted((worker.status(self.health_timeout) for worker in self.workers.values()),
+                                   key=lambda status: (status['slot'], status['generation'])))
+
+    def write_status(self):
+        if self.status_path is None:
+            return
+        temporary_path = f'{self.status_path}.tmp'
+        with open(temporary_path, 'w') as status_file:
+            json.dump(self.status(), status_file)
+        os.replace(temporary_path, self.status_path)
+
+
+def share_token_secret():
+    """ Sets a random `token_secret` if none is configured, workers forked afterwards all sign with it. """
+    if settings.token_secret is None:
+        settings.token_secret = secrets.token_urlsafe(32)
+        logger.warning('token_secret is not set, bearer tokens will not be accepted after a restart of the master')
+
+
+# Per-process caches, setting of the TTL with the module and name of the cache
+_process_caches = [
+    ('principal_cache_ttl', 'utils.principal_cache', 'principal_cache'),
+    ('token_epoch_ttl', 'utils.tokens', 'token_epochs'),
+    ('project_list_cache_ttl', 'utils.project_list_cache', 'project_list_cache'),
+]
+
+
+def limit_cache_ttls(worker_count: int):
+    """ Caps TTLs of per-process caches to `server_worker_cache_ttl` if there are several workers. """
+    if worker_count <= 1:
+        return
+    for setting, module_name, cache_name in _process_caches:
+        ttl = min(getattr(settings, setting), settings.server_worker_cache_ttl)
+        setattr(settings, setting, ttl)
+        # Caches already exist if the master imported the app, e.g. when started as rest/main.py
+        module = sys.modules.get(module_name)
+        if module is not None:
+            getattr(module, cache_name).ttl = ttl
+    logger.info('Caches are per worker, changes reach other workers within %s s', settings.server_worker_cache_ttl)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--host', default=settings.server_host)
+    parser.add_argument('--port', type=int, default=settings.server_port)
+    parser.add_argument('--workers', type=int, default=settings.server_workers or os.cpu_count() or 1)
+    parser.add_argument('--backlog', type=int, default=settings.server_backlog)
+    parser.add_argument('--keep-alive', type=int, default=settings.server_keep_alive, help='Keep-alive timeout (s)')
+    parser.add_argument('--loop', choices=['auto', 'asyncio', 'uvloop'], default=settings.server_loop)
+    parser.add_argument('--http', choices=['auto', 'h11', 'httptools'], default=settings.server_http)
+    parser.add_argument('--limit-concurrency', type=int, default=settings.server_limit_concurrency,
+                        help='Connections per worker, requests above get 503')
+    parser.add_argument('--max-requests', type=int, default=settings.server_max_requests,
+                        help='Requests after which a worker is replaced')
+    parser.add_argument('--graceful-timeout', type=int, default=settings.server_graceful_timeout)
+    parser.add_argument('--health-interval', type=float, default=settings.server_health_interval)
+    parser.add_argument('--health-timeout', type=float, default=settings.server_health_timeout)
+    parser.add_argument('--status-path', default=settings.server_status_path,
+                        help='JSON file with the health of all workers')
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+    try:
+        check_implementations(args.loop, args.http)
+    except ValueError as e:
+        parser.error(str(e))
+
+    launcher = Launcher(args.workers, args.host, args.port,
+                        backlog=args.backlog,
+                        health_interval=args.health_interval,
+                        health_timeout=args.health_timeout,
+                        graceful_timeout=args.graceful_timeout,
+                        status_path=args.status_path,
+                        loop=args.loop,
+                        http=args.http,
+                        timeout_keep_alive=args.keep_alive,
+                        limit_concurrency=args.limit_concurrency,
+                        limit_max_requests=args.max_requests)
+    return launcher.run()
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,28 +1,45 @@
 """ Sources:
     Basic auth: https://fastapi.tiangolo.com/advanced/security/http-basic-auth/#__tabbed_2_1
 
-    WARNING: Currently using only SHA256 for password hashing without salting -> NOT SECURE
-             Should use proper password hashing with bcrypt!!
+    Bearer tokens issued by /api/auth/token are verified in memory, Basic auth verifies the
+    password on a principal cache miss.
+
+    Passwords are hashed with scrypt (configurable) in a bounded thread pool, hashes of the old
+    unsalted SHA256 scheme are upgraded on the next successful login.
 
 """
 
-from fastapi import FastAPI, Depends, HTTPException, APIRouter, status
+from fastapi import FastAPI, Depends, HTTPException, APIRouter, Header, Query, Response, status
 from fastapi.openapi.docs import get_swagger_ui_html
-from fastapi.security import HTTPBasic, HTTPBasicCredentials
+from fastapi.responses import ORJSONResponse, PlainTextResponse, StreamingResponse
+from fastapi.security import HTTPAuthorizationCredentials, HTTPBasic, HTTPBasicCredentials, HTTPBearer
 
 from typing import Annotated, Optional, List
 
-from sqlalchemy.orm import Session
-
-import uvicorn
+import datetime
+import sys
 
 import database.db_init
 import database.models
 
-from database.db_init import SessionLocal
-from database import crud
+from database.db_init import SessionLocal, ReadSessionLocal, AsyncSessionLocal, AsyncReadSessionLocal
+from database import async_crud, crud
+from database.async_crud import AnySession
+from database.write_queue import write_queue
 
 from utils import password_hasher
+from utils.password_hasher import hashing_pool
+from utils.principal_cache import principal_cache, credential_digest
+from utils.metrics import MetricsMiddleware, metrics
+from utils.project_list_cache import project_list_cache
+from utils.settings import settings
+from utils.slow_queries import slow_query_recorder
+from utils.tokens import decode_token, issue_token, token_epochs
+
+from rest.pagination import decode_cursor, make_page, page_size
+from rest.export import encode_csv, encode_ndjson
+from rest.conditional import (etag_matches, if_match_satisfied, if_match_version, make_etag, make_version_etag,
+                              not_modified, precondition_failed)
 
 from rest.schemas import *
 
@@ -30,13 +47,17 @@ from rest.schemas import *
 description = "APUW lab excercise"
 
 app = FastAPI(openapi_url='/',
-              description=description)
+              description=description,
+              default_response_class=ORJSONResponse)
 prefix_router = APIRouter(prefix='/api')
+if settings.metrics_enabled:
+    app.add_middleware(MetricsMiddleware)
 
-security = HTTPBasic()
+basic_security = HTTPBasic(auto_error=False)
+bearer_security = HTTPBearer(auto_error=False)
 
 
-def get_db():
+def get_sync_write_db():
     db = SessionLocal()
     try:
         yield db
@@ -44,24 +65,88 @@ def get_db():
         db.close()
 
 
-def verify_user(credentials: Annotated[HTTPBasicCredentials, Depends(security)],
-                db: Annotated[Session, Depends(get_db)]) -> Optional[User]:
-    user = crud.get_user_by_username(db, credentials.username)
+def get_sync_read_db():
+    db = ReadSessionLocal()
+    try:
+        yield db
+    finally:
+        db.close()
+
+
+async def get_async_write_db():
+    async with AsyncSessionLocal() as db:
+        yield db
+
+
+async def get_async_read_db():
+    async with AsyncReadSessionLocal() as db:
+        yield db
+
+
+# Sessions connect on first use, depending on a session which ends up unused costs nothing
+get_write_db = get_async_write_db if settings.async_database else get_sync_write_db
+get_read_db = get_async_read_db if settings.async_database else get_sync_read_db
+
+
+def _unauthorized(detail: str, scheme: str) -> HTTPException:
+    return HTTPException(status_code=status.HTTP_401_UNAUTHORIZED,
+                         detail=detail,
+                         headers={"WWW-Authenticate": scheme})
+
+
+async def get_token_epoch(db: AnySession, username: str) -> Optional[int]:
+    epoch = token_epochs.get(username)
+    if epoch is None:
+        epoch = await async_crud.get_user_token_epoch(db, username)
+        if epoch is not None:
+            token_epochs.set(username, epoch)
+    return epoch
+
+
+async def verify_credentials(credentials: Annotated[Optional[HTTPBasicCredentials], Depends(basic_security)],
+                             db: Annotated[AnySession, Depends(get_read_db)],
+                             write_db: Annotated[AnySession, Depends(get_write_db)]) -> Principal:
+    if credentials is None:
+        raise _unauthorized("Not authenticated", "Basic")
+    digest = credential_digest(credentials.password)
+    principal = principal_cache.get(credentials.username, digest)
+    if principal is not None:
+        return principal
+    generation = principal_cache.generation(credentials.username)
+    user = await async_crud.get_user_by_username(db, credentials.username)
     if user is not None and \
-            password_hasher.hash_password(credentials.password) == user.hashed_password:
-        return user
-    raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED,
-                        detail="Incorrect username or password",
-                        headers={"WWW-Authenticate": "Basic"})
+            await hashing_pool.run(password_hasher.verify_password, credentials.password, user.hashed_password):
+        # Cache a detached snapshot since the ORM instance dies with the request session
+        principal = Principal.model_validate(user, from_attributes=True)
+        if password_hasher.needs_rehash(user.hashed_password):
+            new_hash = await hashing_pool.run(password_hasher.hash_password, credentials.password)
+            await async_crud.update_user_password_hash(write_db, user.username, user.hashed_password, new_hash)
+        principal_cache.put(credentials.username, digest, principal, generation)
+        return principal
+    raise _unauthorized("Incorrect username or password", "Basic")
+
+
+async def verify_token(token: str, db: AnySession) -> Principal:
+    claims = decode_token(token)
+    if claims is None or claims.epoch != await get_token_epoch(db, claims.username):
+        raise _unauthorized("Invalid or expired token", "Bearer")
+    return Principal(username=claims.username, role=Role(claims.role))
+
+
+async def verify_user(credentials: Annotated[Optional[HTTPBasicCredentials], Depends(basic_security)],
+                      token: Annotated[Optional[HTTPAuthorizationCredentials], Depends(bearer_security)],
+                      db: Annotated[AnySession, Depends(get_read_db)],
+                      write_db: Annotated[AnySession, Depends(get_write_db)]) -> Principal:
+    if token is not None:
+        return await verify_token(token.credentials, db)
+    return await verify_credentials(credentials, db, write_db)
 
 
 class RoleChecker:
     def __init__(self, role: Role):
         self.role = role
 
-    def __call__(self, db: Annotated[Session, Depends(get_db)],
-                 credentials: Annotated[HTTPBasicCredentials, Depends(security)]):
-        user = crud.get_user_by_username(db, credentials.username)
+    async def __call__(self, user: Annotated[Principal, Depends(verify_user)]):
         if user.role != self.role:
             raise HTTPException(
                 status_code=status.HTTP_403_FORBIDDEN,
@@ -70,38 +155,129 @@ class RoleChecker:
         return user
 
 
+def includes_private(user: Principal, username: str) -> bool:
+    """ Whether `user` may see private projects of `username`. """
+    return user.role == Role.ADMIN or username == user.username
+
+
+def check_project_access(project: Optional[database.models.Project], username: str, user: Principal):
+    if project is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Project not found",
+        )
+    # We raise 404 to not revel whether private projects exists or not
+    if not includes_private(user, username) and project.visibility == ProjectVisibility.PRIVATE:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Project not found"
+        )
+
+
+_transition_errors = {
+    TaskTransitionResult.NOT_FOUND: (status.HTTP_404_NOT_FOUND, "Task not found"),
+    TaskTransitionResult.ALREADY_STARTED: (status.HTTP_400_BAD_REQUEST, "Task already started"),
+    TaskTransitionResult.NOT_STARTED: (status.HTTP_400_BAD_REQUEST, "Cannot stop task that wasn't started"),
+    TaskTransitionResult.ALREADY_STOPPED: (status.HTTP_400_BAD_REQUEST, "Task already stopped"),
+}
+
+
+def check_transition(result: TaskTransitionResult):
+    if result in _transition_errors:
+        status_code, detail = _transition_errors[result]
+        raise HTTPException(
+            status_code=status_code,
+            detail=detail
+        )
+
+
+async def get_accessible_project(username: str,
+                                 project_id: int,
+                                 user: Annotated[Principal, Depends(verify_user)],
+                                 db: Annotated[AnySession, Depends(get_read_db)]) -> database.models.Project:
+    project = await async_crud.get_project_by_id_and_owner_username(db, project_id, username)
+    check_project_access(project, username, user)
+    return project
+
+
+async def get_accessible_task(username: str,
+                              project_id: int,
+                              task_id: int,
+                              user: Annotated[Principal, Depends(verify_user)],
+                              db: Annotated[AnySession, Depends(get_read_db)]) -> database.models.Task:
+    project, task = await async_crud.get_project_and_task(db, project_id, username, task_id)
+    check_project_access(project, username, user)
+    if task is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Task not found"
+        )
+    return task
+
+
+@prefix_router.post("/auth/token")
+async def create_token(user: Annotated[Principal, Depends(verify_credentials)],
+                       db: Annotated[AnySession, Depends(get_read_db)]) -> Token:
+    epoch = await get_token_epoch(db, user.username)
+    return Token(access_token=issue_token(user.username, user.role.value, epoch),
+                 expires_in=settings.token_ttl)
+
+
 @prefix_router.get("/users/me")
-def get_current_user(user: Annotated[User, Depends(verify_user)],
-                     db: Annotated[Session, Depends(get_db)]) -> User:
-    return crud.get_user_by_username(db, user.username)
+async def get_current_user(user: Annotated[Principal, Depends(verify_user)],
+                           db: Annotated[AnySession, Depends(get_read_db)]) -> User:
+    return await async_crud.get_user_by_username(db, user.username)
 
 
 @prefix_router.get("/users")
-def get_users(user: Annotated[User, Depends(verify_user)],
-              db: Annotated[Session, Depends(get_db)]) -> List[UserGetIdentity]:
-    return crud.get_users(db)
+async def get_users(user: Annotated[Principal, Depends(verify_user)],
+                    db: Annotated[AnySession, Depends(get_read_db)],
+                    limit: Annotated[int, Query(ge=1)] = settings.default_page_size,
+                    cursor: Optional[str] = None) -> Page[UserGetIdentity]:
+    limit = page_size(limit)
+    users = await async_crud.get_users(db, limit + 1, decode_cursor(cursor, str))
+    return make_page(users, limit, lambda db_user: db_user.username)
 
 
 @prefix_router.get("/users/{username}")
-def get_user(user: Annotated[User, Depends(verify_user)],
-              username: str,
-              db: Annotated[Session, Depends(get_db)]) -> User:
-    db_user = crud.get_user_by_username(db, username)
+async def get_user(user: Annotated[Principal, Depends(verify_user)],
+                   username: str,
+                   response: Response,
+                   db: Annotated[AnySession, Depends(get_read_db)]) -> User:
+    db_user = await async_crud.get_user_by_username(db, username)
     if db_user is None:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="User not found"
         )
+    response.headers['ETag'] = make_version_etag('user', db_user.username, db_user.version)
+    return db_user
+
+
+def updated_user(db_user: Optional[database.models.User], if_match: Optional[str],
+                 response: Response) -> database.models.User:
+    if db_user is None:
+        if if_match is not None:
+            raise precondition_failed()
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="User not found"
+        )
+    response.headers['ETag'] = make_version_etag('user', db_user.username, db_user.version)
     return db_user
 
 
 @prefix_router.patch("/users/{username}")
-def update_user_info(user: Annotated[User, Depends(verify_user)],
-                     username: str,
-                     user_info: UserUpdateInfo,
-                     db: Annotated[Session, Depends(get_db)]) -> UserGet:
+async def update_user_info(user: Annotated[Principal, Depends(verify_user)],
+                           username: str,
+                           user_info: UserUpdateInfo,
+                           response: Response,
+                           db: Annotated[AnySession, Depends(get_write_db)],
+                           if_match: Annotated[Optional[str], Header()] = None) -> UserGet:
     if username == user.username or user.role == Role.ADMIN:
-        return crud.update_user_info(db, user.username, user_info)
+        db_user = await async_crud.update_user_info(db, username, user_info,
+                                                    if_match_version(if_match, 'user', username))
+        return updated_user(db_user, if_match, response)
     else:
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN,
@@ -110,304 +286,335 @@ def update_user_info(user: Annotated[User, Depends(verify_user)],
 
 
 @prefix_router.patch("/users/{username}/role", dependencies=[Depends(RoleChecker(Role.ADMIN))])
-def update_user_role(user: Annotated[User, Depends(verify_user)],
-                     user_role_update: UserUpdateRole,
-                     username: str,
-                     db: Annotated[Session, Depends(get_db)]):
-    crud.update_user_role(db, username, user_role_update)
+async def update_user_role(user: Annotated[Principal, Depends(verify_user)],
+                           user_role_update: UserUpdateRole,
+                           username: str,
+                           response: Response,
+                           db: Annotated[AnySession, Depends(get_write_db)],
+                           if_match: Annotated[Optional[str], Header()] = None) -> UserGet:
+    db_user = await async_crud.update_user_role(db, username, user_role_update,
+                                                if_match_version(if_match, 'user', username))
+    return updated_user(db_user, if_match, response)
 
 
 @prefix_router.post("/users/{username}/projects")
-def create_project(username: str,
-                   user: Annotated[User, Depends(verify_user)],
-                   project_info: ProjectCreate,
-                   db: Annotated[Session, Depends(get_db)]):
+async def create_project(username: str,
+                         user: Annotated[Principal, Depends(verify_user)],
+                         project_info: ProjectCreate,
+                         db: Annotated[AnySession, Depends(get_write_db)]) -> ProjectGet:
     if username != user.username:
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN,
             detail="Unauthorized"
         )
-    project = crud.create_project(db, user.username, project_info)
+    project = await async_crud.create_project(db, user.username, project_info)
     return project
 
 
 @prefix_router.get("/users/{username}/projects")
-def get_projects(username: str,
-                 user: Annotated[User, Depends(verify_user)],
-                 db: Annotated[Session, Depends(get_db)],
-                 visibility: Optional[ProjectVisibility] = None) -> List[ProjectGet]:
-    projects = []
-    if visibility == ProjectVisibility.PRIVATE:
-        if username != user.username and user.role != Role.ADMIN:
-            raise HTTPException(
-                status_code=status.HTTP_403_FORBIDDEN,
-                detail="Unauthorized"
-            )
-        projects.extend(crud.get_projects(db, username, ProjectVisibility.PRIVATE))
-    elif visibility == ProjectVisibility.PUBLIC:
-        projects.extend(crud.get_projects(db, username, ProjectVisibility.PUBLIC))
-    elif visibility is None:
-        if user.username == username or user.role == Role.ADMIN:
-            projects.extend(crud.get_projects(db, username))
-        projects.extend(crud.get_projects(db, username, ProjectVisibility.PUBLIC))
-    return projects
+async def get_projects(username: str,
+                       user: Annotated[Principal, Depends(verify_user)],
+                       db: Annotated[AnySession, Depends(get_read_db)],
+                       visibility: Optional[ProjectVisibility] = None,
+                       limit: Annotated[int, Query(ge=1)] = settings.default_page_size,
+                       cursor: Optional[str] = None) -> Page[ProjectGet]:
+    can_see_private = user.username == username or user.role == Role.ADMIN
+    if visibility == ProjectVisibility.PRIVATE and not can_see_private:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Unauthorized"
+        )
+    if visibility is None and not can_see_private:
+        visibility = ProjectVisibility.PUBLIC
+    limit = page_size(limit)
+    after_id = decode_cursor(cursor, int)
+
+    async def get_page():
+        projects = await async_crud.get_projects(db, username, visibility, limit + 1, after_id)
+        return make_page(projects, limit, lambda project: project.id)
+
+    if visibility != ProjectVisibility.PUBLIC or project_list_cache.maxsize == 0:
+        return await get_page()
+
+    async def build_page_body():
+        return Page[ProjectGet].model_validate(await get_page()).model_dump_json().encode()
+
+    body = await project_list_cache.get_or_build(username, (limit, cursor), build_page_body)
+    return Response(body, media_type='application/json')
 
 
 @prefix_router.get("/users/{username}/projects/{project_id}")
-def get_project(username: str,
-                project_id: int,
-                user: Annotated[User, Depends(verify_user)],
-                db: Annotated[Session, Depends(get_db)],
-                visibility: Optional[ProjectVisibility] = None):
-    project = crud.get_project_by_id_and_owner_username(db, project_id, username)
-    if project is None:
-        raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND,
-            detail="Project not found",
-        )
-    # We raise 404 to not revel whether private projects exists or not
-    if (user.role != Role.ADMIN and
-            username != user.username and
-            project.visibility == ProjectVisibility.PRIVATE):
-        raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND,
-            detail="Project not found"
-        )
+async def get_project(username: str,
+                      project_id: int,
+                      user: Annotated[Principal, Depends(verify_user)],
+                      db: Annotated[AnySession, Depends(get_read_db)],
+                      response: Response,
+                      visibility: Optional[ProjectVisibility] = None,
+                      if_none_match: Annotated[Optional[str], Header()] = None) -> ProjectGet:
+    if if_none_match is not None:
+        project_version = await async_crud.get_project_version(db, project_id, username)
+        if project_version is not None:
+            check_project_access(project_version, username, user)
+            etag = make_etag('project', project_id, project_version.version)
+            if etag_matches(if_none_match, etag):
+                return not_modified(etag)
+    project = await async_crud.get_project_by_id_and_owner_username(db, project_id, username,
+                                                                    load_task_ids=True)
+    check_project_access(project, username, user)
+    response.headers['ETag'] = make_etag('project', project.id, project.version)
     return project
 
 
 @prefix_router.post("/users/{username}/projects/{project_id}/tasks")
-def create_task(username: str,
-                project_id: int,
-                task: TaskCreate,
-                user: Annotated[User, Depends(verify_user)],
-                db: Annotated[Session, Depends(get_db)]):
-    project = crud.get_project_by_id(db, project_id)
-    if project is None:
-        raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND,
-            detail="Project not found",
-        )
-    # We raise 404 to not revel whether private projects exists or not
-    if (user.role != Role.ADMIN and
-            username != user.username and
-            project.visibility == ProjectVisibility.PRIVATE):
+async def create_task(task: TaskCreate,
+                      user: Annotated[Principal, Depends(verify_user)],
+                      project: Annotated[database.models.Project, Depends(get_accessible_project)],
+                      db: Annotated[AnySession, Depends(get_write_db)]) -> TaskGet:
+    return await async_crud.create_task(db, user.username, project.id, task)
+
+
+@prefix_router.post("/users/{username}/projects/{project_id}/tasks:bulk")
+async def create_tasks(tasks: List[TaskCreate],
+                       user: Annotated[Principal, Depends(verify_user)],
+                       project: Annotated[database.models.Project, Depends(get_accessible_project)],
+                       db: Annotated[AnySession, Depends(get_write_db)]) -> List[int]:
+    if len(tasks) > settings.max_bulk_size:
         raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND,
-            detail="Project not found"
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            detail=f"At most {settings.max_bulk_size} tasks can be created at once"
         )
-    return crud.create_task(db, user.username, project.id, task)
+    return await async_crud.create_tasks(db, user.username, project.id, tasks)
 
 
 @prefix_router.get("/users/{username}/projects/{project_id}/tasks/{task_id}")
-def get_task(username: str,
-             project_id: int,
-             task_id: int,
-             user: Annotated[User, Depends(verify_user)],
-             db: Annotated[Session, Depends(get_db)]):
-    project = crud.get_project_by_id(db, project_id)
-    if project is None:
-        raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND,
-            detail="Project not found",
-        )
-    # We raise 404 to not revel whether private projects exists or not
-    if (user.role != Role.ADMIN and
-            username != user.username and
-            project.visibility == ProjectVisibility.PRIVATE):
-        raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND,
-            detail="Project not found"
-        )
-    task = crud.get_task_by_id(db, task_id)
-    if task is None:
-        raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND,
-            detail="Task not found"
-        )
+async def get_task(username: str,
+                   project_id: int,
+                   task_id: int,
+                   user: Annotated[Principal, Depends(verify_user)],
+                   db: Annotated[AnySession, Depends(get_read_db)],
+                   response: Response,
+                   if_none_match: Annotated[Optional[str], Header()] = None) -> TaskGet:
+    if if_none_match is not None:
+        task_version = await async_crud.get_task_version(db, project_id, username, task_id)
+        if task_version is not None and task_version.version is not None:
+            check_project_access(task_version, username, user)
+            etag = make_etag('task', task_id, task_version.version)
+            if etag_matches(if_none_match, etag):
+                return not_modified(etag)
+    task = await get_accessible_task(username, project_id, task_id, user, db)
+    response.headers['ETag'] = make_etag('task', task.id, task.version)
     return task
 
 
 @prefix_router.get("/users/{username}/projects/{project_id}/tasks")
-def get_tasks(username: str,
-              project_id: int,
-              user: Annotated[User, Depends(verify_user)],
-              db: Annotated[Session, Depends(get_db)]):
-    project = crud.get_project_by_id(db, project_id)
-    if project is None:
-        raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND,
-            detail="Project not found",
-        )
-    # We raise 404 to not revel whether private projects exists or not
-    if (user.role != Role.ADMIN and
-            username != user.username and
-            project.visibility == ProjectVisibility.PRIVATE):
-        raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND,
-            detail="Project not found"
-        )
-    return crud.get_tasks_by_project_id(db, project_id)
+async def get_tasks(username: str,
+                    project_id: int,
+                    user: Annotated[Principal, Depends(verify_user)],
+                    db: Annotated[AnySession, Depends(get_read_db)],
+                    response: Response,
+                    limit: Annotated[int, Query(ge=1)] = settings.default_page_size,
+                    cursor: Optional[str] = None,
+                    if_none_match: Annotated[Optional[str], Header()] = None) -> Page[TaskGet]:
+    limit = page_size(limit)
+    # Project version is bumped by every task write, so it versions the task list too
+    if if_none_match is not None:
+        project_version = await async_crud.get_project_version(db, project_id, username)
+        if project_version is not None:
+            check_project_access(project_version, username, user)
+            etag = make_etag('tasks', project_id, project_version.version, limit, cursor)
+            if etag_matches(if_none_match, etag):
+                return not_modified(etag)
+    project = await get_accessible_project(username, project_id, user, db)
+    response.headers['ETag'] = make_etag('tasks', project.id, project.version, limit, cursor)
+    tasks = await async_crud.get_tasks_by_project_id(db, project.id, limit=limit + 1,
+                                                     after_id=decode_cursor(cursor, int))
+    return make_page(tasks, limit, lambda task: task.id)
 
 
 @prefix_router.patch("/users/{username}/projects/{project_id}/tasks/{task_id}")
-def update_task(username: str,
-                project_id: int,
-                task_id: int,
-                task_update_info: TaskUpdate,
-                user: Annotated[User, Depends(verify_user)],
-                db: Annotated[Session, Depends(get_db)]):
-    project = crud.get_project_by_id(db, project_id)
-    if project is None:
-        raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND,
-            detail="Project not found",
-        )
-    # We raise 404 to not revel whether private projects exists or not
-    if (user.role != Role.ADMIN and
-            username != user.username and
-            project.visibility == ProjectVisibility.PRIVATE):
-        raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND,
-            detail="Project not found"
-        )
-    task = crud.get_task_by_id(db, task_id)
-    if task is None:
+async def update_task(task_update_info: TaskUpdate,
+                      task: Annotated[database.models.Task, Depends(get_accessible_task)],
+                      response: Response,
+                      db: Annotated[AnySession, Depends(get_write_db)],
+                      if_match: Annotated[Optional[str], Header()] = None) -> TaskGet:
+    expected_version = None
+    if if_match is not None:
+        if not if_match_satisfied(if_match, make_etag('task', task.id, task.version)):
+            raise precondition_failed()
+        # The UPDATE checks the version again in case the task changed since it was read
+        expected_version = task.version if if_match.strip() != '*' else None
+    db_task = await async_crud.update_task_info(db, task.id, task_update_info, expected_version)
+    if db_task is None:
+        if if_match is not None:
+            raise precondition_failed()
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="Task not found"
         )
-    return crud.update_task_info(db, task_id, task_update_info)
+    response.headers['ETag'] = make_etag('task', db_task.id, db_task.version)
+    return db_task
 
 
 @prefix_router.delete("/users/{username}/projects/{project_id}/tasks/{task_id}")
-def delete_task(username: str,
-                project_id: int,
-                task_id: int,
-                user: Annotated[User, Depends(verify_user)],
-                db: Annotated[Session, Depends(get_db)]):
-    project = crud.get_project_by_id(db, project_id)
-    if project is None:
-        raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND,
-            detail="Project not found",
-        )
-    # We raise 404 to not revel whether private projects exists or not
-    if (user.role != Role.ADMIN and
-            username != user.username and
-            project.visibility == ProjectVisibility.PRIVATE):
-        raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND,
-            detail="Project not found"
-        )
-    task = crud.get_task_by_id(db, task_id)
-    if task is None:
+async def delete_task(task: Annotated[database.models.Task, Depends(get_accessible_task)],
+                      db: Annotated[AnySession, Depends(get_write_db)]) -> Detail:
+    sucess = await async_crud.delete_task(db, task.id)
+    if sucess is None:
+        # Deleted by another request since it was read
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="Task not found"
         )
-    sucess = crud.delete_task(db, task_id)
     if not sucess:
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail="Task could not be deleted"
         )
-    raise HTTPException(
-        status_code=status.HTTP_200_OK
-    )
+    return Detail(detail="OK")
 
 
 @prefix_router.post("/users/{username}/projects/{project_id}/tasks/{task_id}/start")
-def start_task(username: str,
-                project_id: int,
-                task_id: int,
-                user: Annotated[User, Depends(verify_user)],
-                db: Annotated[Session, Depends(get_db)]):
-    project = crud.get_project_by_id(db, project_id)
-    if project is None:
-        raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND,
-            detail="Project not found",
-        )
-    # We raise 404 to not revel whether private projects exists or not
-    if (user.role != Role.ADMIN and
-            username != user.username and
-            project.visibility == ProjectVisibility.PRIVATE):
-        raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND,
-            detail="Project not found"
-        )
-    task = crud.get_task_by_id(db, task_id)
-    if task is None:
-        raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND,
-            detail="Task not found"
-        )
-    if task.start_timestamp is not None:
-        raise HTTPException(
-            status_code=status.HTTP_400_BAD_REQUEST,
-            detail="Task already started"
-        )
-    sucess = crud.start_task(db, task_id)
-    if not sucess:
+async def start_task(username: str,
+                     project_id: int,
+                     task_id: int,
+                     user: Annotated[Principal, Depends(verify_user)],
+                     db: Annotated[AnySession, Depends(get_write_db)]) -> Detail:
+    # Access is checked by the UPDATE itself, an inaccessible task is reported as not found
+    result = await async_crud.start_task(db, task_id, project_id, username, includes_private(user, username))
+    if result is None:
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail="Task could not be started"
         )
-    raise HTTPException(
-        status_code=status.HTTP_200_OK
-    )
+    check_transition(result)
+    return Detail(detail="OK")
 
 
 @prefix_router.post("/users/{username}/projects/{project_id}/tasks/{task_id}/stop")
-def stop_task(username: str,
-              project_id: int,
-              task_id: int,
-              user: Annotated[User, Depends(verify_user)],
-              db: Annotated[Session, Depends(get_db)]):
-    project = crud.get_project_by_id(db, project_id)
-    if project is None:
-        raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND,
-            detail="Project not found",
-        )
-    # We raise 404 to not revel whether private projects exists or not
-    if (user.role != Role.ADMIN and
-            username != user.username and
-            project.visibility == ProjectVisibility.PRIVATE):
+async def stop_task(username: str,
+                    project_id: int,
+                    task_id: int,
+                    user: Annotated[Principal, Depends(verify_user)],
+                    db: Annotated[AnySession, Depends(get_write_db)]) -> Detail:
+    # Access is checked by the UPDATE itself, an inaccessible task is reported as not found
+    result = await async_crud.stop_task(db, task_id, project_id, username, includes_private(user, username))
+    if result is None:
         raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND,
-            detail="Project not found"
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail="Task could not be stopped"
         )
-    task = crud.get_task_by_id(db, task_id)
-    if task is None:
+    check_transition(result)
+    return Detail(detail="OK")
+
+
+@prefix_router.post("/users/{username}/tasks:start")
+async def start_tasks(username: str,
+                      task_ids: List[int],
+                      user: Annotated[Principal, Depends(verify_user)],
+                      db: Annotated[AnySession, Depends(get_write_db)]) -> List[TaskTransition]:
+    if len(task_ids) > settings.max_bulk_size:
         raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND,
-            detail="Task not found"
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            detail=f"At most {settings.max_bulk_size} tasks can be started at once"
         )
-    if task.start_timestamp is None:
+    # Tasks of hidden private projects are reported as not found
+    include_private = includes_private(user, username)
+    results = await async_crud.start_tasks(db, username, task_ids, include_private)
+    return [TaskTransition(task_id=task_id, result=results[task_id]) for task_id in task_ids]
+
+
+@prefix_router.post("/users/{username}/tasks:stop")
+async def stop_tasks(username: str,
+                     task_ids: List[int],
+                     user: Annotated[Principal, Depends(verify_user)],
+                     db: Annotated[AnySession, Depends(get_write_db)]) -> List[TaskTransition]:
+    if len(task_ids) > settings.max_bulk_size:
         raise HTTPException(
-            status_code=status.HTTP_400_BAD_REQUEST,
-            detail="Cannot stop task that wasn't started"
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            detail=f"At most {settings.max_bulk_size} tasks can be stopped at once"
         )
-    if task.end_timestamp is not None:
-        raise HTTPException(
-            status_code=status.HTTP_400_BAD_REQUEST,
-            detail="Task already stopped"
+    # Tasks of hidden private projects are reported as not found
+    include_private = includes_private(user, username)
+    results = await async_crud.stop_tasks(db, username, task_ids, include_private)
+    return [TaskTransition(task_id=task_id, result=results[task_id]) for task_id in task_ids]
+
+
+@prefix_router.get("/users/{username}/tasks/export", response_class=StreamingResponse,
+                   response_model=None)
+async def export_tasks(username: str,
+                       user: Annotated[Principal, Depends(verify_user)],
+                       db: Annotated[AnySession, Depends(get_read_db)],
+                       export_format: Annotated[TaskExportFormat,
+                                                Query(alias='format')] = TaskExportFormat.NDJSON):
+    visibility = None if username == user.username or user.role == Role.ADMIN else ProjectVisibility.PUBLIC
+    statement = crud.get_task_rows_by_owner_username_statement(username, visibility)
+    partitions = async_crud.stream(db, statement, settings.export_batch_size)
+    if export_format == TaskExportFormat.CSV:
+        return StreamingResponse(
+            encode_csv(partitions),
+            media_type='text/csv',
+            headers={'Content-Disposition': f'attachment; filename="{username}_tasks.csv"'}
         )
-    sucess = crud.stop_task(db, task_id)
-    if not sucess:
+    return StreamingResponse(encode_ndjson(partitions), media_type='application/x-ndjson')
+
+
+@prefix_router.get("/users/{username}/reports/time")
+async def get_time_report(username: str,
+                          user: Annotated[Principal, Depends(verify_user)],
+                          db: Annotated[AnySession, Depends(get_read_db)],
+                          from_day: Annotated[Optional[datetime.date], Query(alias='from')] = None,
+                          to_day: Annotated[Optional[datetime.date], Query(alias='to')] = None,
+                          group_by: TimeReportGrouping = TimeReportGrouping.DAY) -> List[TimeReportEntry]:
+    if username != user.username and user.role != Role.ADMIN:
         raise HTTPException(
-            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-            detail="Task could not be stopped"
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Unauthorized"
         )
-    raise HTTPException(
-        status_code=status.HTTP_200_OK
-    )
+    rows = await async_crud.get_time_report(db, username, from_day, to_day, group_by)
+    if group_by == TimeReportGrouping.DAY:
+        return [TimeReportEntry(day=day, tracked_seconds=seconds) for day, seconds in rows]
+    return [TimeReportEntry(project_id=project_id, tracked_seconds=seconds) for project_id, seconds in rows]
+
+
+@prefix_router.get("/metrics", response_class=PlainTextResponse)
+async def get_metrics() -> str:
+    principal_cache_stats = principal_cache.stats()
+    hashing_pool_stats = hashing_pool.stats()
+    project_list_cache_stats = project_list_cache.stats()
+    gauges = dict(tasker_principal_cache_hits=principal_cache_stats['hits'],
+                  tasker_principal_cache_misses=principal_cache_stats['misses'],
+                  tasker_principal_cache_size=principal_cache_stats['size'],
+                  tasker_project_list_cache_hits=project_list_cache_stats['hits'],
+                  tasker_project_list_cache_misses=project_list_cache_stats['misses'],
+                  tasker_project_list_cache_size=project_list_cache_stats['size'],
+                  tasker_password_hash_queued=hashing_pool_stats['queued'],
+                  tasker_password_hash_active=hashing_pool_stats['active'],
+                  tasker_password_hash_completed=hashing_pool_stats['completed'],
+                  tasker_password_hash_wait_seconds=hashing_pool_stats['total_wait'])
+    for pool_name, pool_engine in database.db_init.pools.items():
+        for name, value in database.db_init.get_pool_stats(pool_engine).items():
+            gauges[f'tasker_db_{pool_name}_pool_{name}'] = value
+    if write_queue.enabled:
+        write_queue_stats = write_queue.stats()
+        gauges.update(tasker_write_queue_batches=write_queue_stats['batches'],
+                      tasker_write_queue_operations=write_queue_stats['operations'],
+                      tasker_write_queue_failed_batches=write_queue_stats['failed_batches'],
+                      tasker_write_queue_largest_batch=write_queue_stats['largest_batch'],
+                      tasker_write_queue_queued=write_queue_stats['queued'])
+    return PlainTextResponse(metrics.render(gauges), media_type='text/plain; version=0.0.4')
+
+
+@prefix_router.get("/admin/slow-queries", dependencies=[Depends(RoleChecker(Role.ADMIN))])
+async def get_slow_queries(limit: Annotated[int, Query(ge=1, le=100)] = 20) -> List[SlowQuery]:
+    return slow_query_recorder.top(limit)
 
 
 app.include_router(prefix_router)
 
 
 if __name__ == "__main__":
-    uvicorn.run(app, host="0.0.0.0", port=8000)
+    # Running this module already created the database engines here. Workers inherit them and
+    # drop the inherited connections after the fork (db_init._after_fork_in_child), the app is
+    # imported again as rest.main in each of them.
+    from rest import launcher
+    sys.exit(launcher.main())
@@ -0,0 +1,48 @@
+import base64
+import binascii
+import json
+
+from fastapi import HTTPException, status
+
+from typing import Any, Callable, Optional
+
+from utils.settings import settings
+
+
+def encode_cursor(key: Any) -> str:
+    return base64.urlsafe_b64encode(json.dumps(key).encode()).decode().rstrip('=')
+
+
+def _invalid_cursor() -> HTTPException:
+    return HTTPException(
+        status_code=status.HTTP_400_BAD_REQUEST,
+        detail="Invalid cursor"
+    )
+
+
+def decode_cursor(cursor: Optional[str], key_type: type) -> Any:
+    """ Decodes a cursor of `make_page`, its key must be of `key_type` (the type of the keyset column). """
+    if cursor is None:
+        return None
+    try:
+        padding = '=' * (-len(cursor) % 4)
+        key = json.loads(base64.urlsafe_b64decode(cursor + padding))
+    except (binascii.Error, ValueError):
+        raise _invalid_cursor()
+    # bool is an int subclass but never a valid key
+    if type(key) is not key_type:
+        raise _invalid_cursor()
+    return key
+
+
+def page_size(limit: int) -> int:
+    return min(limit, settings.max_page_size)
+
+
+def make_page(rows: list, limit: int, key: Callable[[Any], Any]) -> dict:
+    """ Builds page from `limit + 1` fetched rows, the extra row only tells there is a next page. """
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(key(rows[-1]))
+    return dict(items=rows, next_cursor=next_cursor)
@@ -1,3 +1,8 @@
+from .auth import *
+from .detail import *
+from .page import *
 from .project import *
+from .report import *
+from .slow_query import *
 from .task import *
 from .user import *
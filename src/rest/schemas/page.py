@@ -0,0 +1,10 @@
+from pydantic import BaseModel
+from typing import Generic, List, Optional, TypeVar
+
+
+_T = TypeVar('_T')
+
+
+class Page(BaseModel, Generic[_T]):
+    items: List[_T]
+    next_cursor: Optional[str] = None
@@ -1,4 +1,4 @@
-from pydantic import BaseModel
+from pydantic import BaseModel, ConfigDict
 from typing import Optional, List
 
 from enum import Enum, auto
@@ -28,8 +28,7 @@ class _ProjectOwner(BaseModel):
 
 
 class ProjectGet(_ProjectIdentity, _ProjectInfo, _ProjectTasks, _ProjectOwner):
-    class Config:
-        orm_mode = True
+    model_config = ConfigDict(from_attributes=True)
 
 
 class ProjectCreate(_ProjectInfo):
@@ -0,0 +1,16 @@
+from pydantic import BaseModel
+from typing import Optional
+
+import datetime
+from enum import Enum
+
+
+class TimeReportGrouping(Enum):
+    DAY = 'day'
+    PROJECT = 'project'
+
+
+class TimeReportEntry(BaseModel):
+    day: Optional[datetime.date] = None
+    project_id: Optional[int] = None
+    tracked_seconds: float
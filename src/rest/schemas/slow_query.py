@@ -0,0 +1,12 @@
+from pydantic import BaseModel
+from typing import Any, List, Optional
+
+
+class SlowQuery(BaseModel):
+    statement: str
+    crud_function: Optional[str]
+    plan: Optional[List[str]]
+    parameters: Any
+    count: int
+    total_ms: float
+    max_ms: float
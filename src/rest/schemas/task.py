@@ -1,7 +1,8 @@
-from pydantic import BaseModel
+from pydantic import BaseModel, ConfigDict
 from typing import Optional
 
 import datetime
+from enum import Enum
 
 
 class _TaskIdentity(BaseModel):
@@ -26,7 +27,7 @@ class _TaskOwner(BaseModel):
 
 class _TaskTime(BaseModel):
     start_timestamp: Optional[datetime.datetime]
-    end_timestamp: Optional[datetime.date]
+    end_timestamp: Optional[datetime.datetime]
 
 
 class TaskCreate(_TaskInfo):
@@ -34,9 +35,27 @@ class TaskCreate(_TaskInfo):
 
 
 class TaskGet(_TaskIdentity, _TaskProject, _TaskInfo, _TaskOwner, _TaskTime):
-    class Config:
-        orm_mode = True
+    model_config = ConfigDict(from_attributes=True)
 
 
 class TaskUpdate(_TaskInfo):
     description: Optional[str] = None
+
+
+class TaskTransitionResult(Enum):
+    STARTED = 'started'
+    STOPPED = 'stopped'
+    ALREADY_STARTED = 'already_started'
+    ALREADY_STOPPED = 'already_stopped'
+    NOT_STARTED = 'not_started'
+    NOT_FOUND = 'not_found'
+
+
+class TaskTransition(BaseModel):
+    task_id: int
+    result: TaskTransitionResult
+
+
+class TaskExportFormat(Enum):
+    NDJSON = 'ndjson'
+    CSV = 'csv'
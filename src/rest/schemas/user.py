@@ -1,4 +1,4 @@
-from pydantic import BaseModel
+from pydantic import BaseModel, ConfigDict
 from typing import List, Optional
 
 from enum import Enum
@@ -32,7 +32,11 @@ class _UserData(BaseModel):
 
 
 class User(_UserIdentity, _UserRole, _UserInfo):
-    pass
+    model_config = ConfigDict(from_attributes=True)
+
+
+class Principal(_UserIdentity, _UserRole):
+    model_config = ConfigDict(from_attributes=True)
 
 
 class UserCreate(_UserIdentity, _UserRole, _UserInfo):
@@ -53,12 +57,8 @@ class UserUpdateInfo(_UserInfo):
 
 
 class UserGet(_UserIdentity, _UserInfo, _UserRole, _UserData):
-    pass
-
-    class Config:
-        orm_mode = True
+    model_config = ConfigDict(from_attributes=True)
 
 
 class UserGetIdentity(_UserIdentity):
-    class Config:
-        orm_mode = True
+    model_config = ConfigDict(from_attributes=True)
@@ -2,9 +2,12 @@ import pytest
 
 from fastapi.testclient import TestClient
 
-from rest.main import app, get_db
+from rest.main import app, get_read_db, get_write_db
 from database.db_init import Base
 from database import database_filler
+from utils.principal_cache import principal_cache
+from utils.tokens import token_epochs
+from utils.project_list_cache import project_list_cache
 
 from db import TestSessionLocal, engine, get_test_db
 
@@ -22,6 +25,9 @@ def db_session(create_database):
 
 @pytest.fixture()
 def create_database():
+    principal_cache.clear()
+    token_epochs.clear()
+    project_list_cache.clear()
     Base.metadata.create_all(bind=engine)
     yield
     Base.metadata.drop_all(bind=engine)
@@ -29,6 +35,9 @@ def create_database():
 
 @pytest.fixture()
 def create_and_fill_database():
+    principal_cache.clear()
+    token_epochs.clear()
+    project_list_cache.clear()
     Base.metadata.create_all(bind=engine)
     db = TestSessionLocal()
     database_filler.run(db)
@@ -43,4 +52,5 @@ def client():
         yield test_client
 
 
-app.dependency_overrides[get_db] = get_test_db
+app.dependency_overrides[get_read_db] = get_test_db
+app.dependency_overrides[get_write_db] = get_test_db
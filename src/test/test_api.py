@@ -2,11 +2,24 @@ import itertools
 
 from fastapi import status
 from rest.main import description
+from rest.pagination import encode_cursor
 import rest.schemas
 
 from database import database_filler
 
+from db import count_statements, db_session, engine
+from database import crud
+from utils import password_hasher
+from utils.metrics import instrument_engine, metrics
+from utils.project_list_cache import project_list_cache
+from utils.settings import settings
+from utils.principal_cache import principal_cache
+
 import base64
+import hashlib
+import csv
+import io
+import json
 
 
 def _get_credentials(user):
@@ -44,8 +57,10 @@ def test_get_current_user(client, create_and_fill_database):
 def test_get_users(client, create_and_fill_database):
     response = client.get("/api/users", headers={"Authorization": f"Basic {admin_credentials}"})
     assert response.status_code == status.HTTP_200_OK
-    for expected_user, actual_user in zip(database_filler.users, response.json()):
-        assert expected_user['username'] == actual_user['username']
+    # Users are listed in keyset order
+    expected_usernames = sorted(user['username'] for user in database_filler.users)
+    assert [user['username'] for user in response.json()['items']] == expected_usernames
+    assert response.json()['next_cursor'] is None
 
 
 def test_update_user_info(client, create_and_fill_database):
@@ -78,6 +93,19 @@ def test_update_user_info(client, create_and_fill_database):
                             json=update_info.model_dump())
     assert response.status_code == status.HTTP_403_FORBIDDEN
 
+    # Admin updates another user, conditionally on that user's ETag
+    admin_headers = {"Authorization": f"Basic {admin_credentials}"}
+    etag = client.get(f"/api/users/{user['username']}", headers=admin_headers).headers['ETag']
+    response = client.patch(f"/api/users/{user['username']}", headers={**admin_headers, "If-Match": etag},
+                            json={'bio': 'bio by admin'})
+    assert response.status_code == status.HTTP_200_OK
+    assert (response.json()['username'], response.json()['bio']) == (user['username'], 'bio by admin')
+    response = client.patch(f"/api/users/{user['username']}", headers={**admin_headers, "If-Match": etag},
+                            json={'bio': 'other bio'})
+    assert response.status_code == status.HTTP_412_PRECONDITION_FAILED
+    response = client.get("/api/users/me", headers=admin_headers)
+    assert response.json()['bio'] != 'bio by admin'
+
 
 def test_update_user_role(client, create_and_fill_database):
     new_role_info = rest.schemas.UserUpdateRole(role=rest.schemas.Role.ADMIN.value)
@@ -86,7 +114,7 @@ def test_update_user_role(client, create_and_fill_database):
                             json=new_role_info.model_dump(mode='json'))
     assert response.status_code == status.HTTP_403_FORBIDDEN
 
-    response = client.patch(f"/api/users/{database_filler.users[0]['username']}",
+    response = client.patch(f"/api/users/{database_filler.users[0]['username']}/role",
                             headers={"Authorization": f"Basic {admin_credentials}"},
                             json=new_role_info.model_dump(mode='json'))
     assert response.status_code == status.HTTP_200_OK
@@ -100,7 +128,7 @@ def test_get_project(client, create_and_fill_database):
     response = client.get(f"/api/users/{user['username']}/projects",
                           headers={"Authorization": f"Basic {user_credentials[0]}"})
     assert response.status_code == status.HTTP_200_OK
-    projects_actual = response.json()
+    projects_actual = response.json()['items']
     assert len(projects_actual) == len(database_filler.projects[user['username']])
 
     user = database_filler.users[1]
@@ -110,7 +138,7 @@ def test_get_project(client, create_and_fill_database):
                           headers={"Authorization": f"Basic {user_credentials[1]}"},
                           params={'visibility': 'public'})
     assert response.status_code == status.HTTP_200_OK
-    projects_actual = response.json()
+    projects_actual = response.json()['items']
     assert len(projects_actual) == len([p for p in database_filler.projects[user['username']]
                                         if p['visibility'] == rest.schemas.ProjectVisibility.PUBLIC])
     assert projects_actual[0]['visibility'] == rest.schemas.ProjectVisibility.PUBLIC.value
@@ -120,7 +148,7 @@ def test_get_project(client, create_and_fill_database):
                           headers={"Authorization": f"Basic {user_credentials[1]}"},
                           params={'visibility': 'private'})
     assert response.status_code == status.HTTP_200_OK
-    projects_actual = response.json()
+    projects_actual = response.json()['items']
     assert len(projects_actual) == len([p for p in database_filler.projects[user['username']]
                                         if p['visibility'] == rest.schemas.ProjectVisibility.PRIVATE])
     assert projects_actual[0]['visibility'] == rest.schemas.ProjectVisibility.PRIVATE.value
@@ -155,7 +183,7 @@ def test_get_projects(client, create_and_fill_database):
     response = client.get(f"/api/users/{user['username']}/projects",
                           headers={"Authorization": f"Basic {user_credentials[0]}"})
     assert response.status_code == status.HTTP_200_OK
-    projects_actual = response.json()
+    projects_actual = response.json()['items']
     assert len(projects_actual) == len(database_filler.projects[user['username']])
 
     response = client.get(f"/api/users/{user['username']}/projects",
@@ -168,7 +196,7 @@ def test_create_task(client, create_and_fill_database):
     user = database_filler.users[0]
     response = client.get(f"/api/users/{user['username']}/projects",
                           headers={"Authorization": f"Basic {user_credentials[0]}"})
-    project = response.json()[0]
+    project = response.json()['items'][0]
     assert len(project['task_ids']) == len(database_filler.projects[user['username']])
     task = rest.schemas.TaskCreate(description='new task description')
     response = client.post(f"/api/users/{user['username']}/projects/{project['id']}/tasks",
@@ -179,7 +207,7 @@ def test_create_task(client, create_and_fill_database):
     assert actual_task['description'] == task.description
     response = client.get(f"/api/users/{user['username']}/projects",
                           headers={"Authorization": f"Basic {user_credentials[0]}"})
-    project = response.json()[0]
+    project = response.json()['items'][0]
     assert len(project['task_ids']) == len(database_filler.projects[user['username']]) + 1
 
 
@@ -187,11 +215,11 @@ def test_get_tasks(client, create_and_fill_database):
     user = database_filler.users[0]
     response = client.get(f"/api/users/{user['username']}/projects",
                           headers={"Authorization": f"Basic {user_credentials[0]}"})
-    project = response.json()[0]
+    project = response.json()['items'][0]
     response = client.get(f"/api/users/{user['username']}/projects/{project['id']}/tasks",
                           headers={"Authorization": f"Basic {user_credentials[0]}"})
     assert response.status_code == status.HTTP_200_OK
-    tasks = response.json()
+    tasks = response.json()['items']
     assert len(tasks) == sum(len(x) for x in database_filler.tasks.keys()
                              if x[0] == user['username'] and x[1] == project['name'])
     response = client.get(f"/api/users/{user['username']}/projects/{project['id']}/tasks/{tasks[0]['id']}",
@@ -205,11 +233,11 @@ def test_update_task(client, create_and_fill_database):
     user = database_filler.users[0]
     response = client.get(f"/api/users/{user['username']}/projects",
                           headers={"Authorization": f"Basic {user_credentials[0]}"})
-    project = response.json()[0]
+    project = response.json()['items'][0]
     response = client.get(f"/api/users/{user['username']}/projects/{project['id']}/tasks",
                           headers={"Authorization": f"Basic {user_credentials[0]}"})
     assert response.status_code == status.HTTP_200_OK
-    task = response.json()[0]
+    task = response.json()['items'][0]
     new_task_info = rest.schemas.TaskUpdate(description='new task description')
     response = client.patch(f"/api/users/{user['username']}/projects/{project['id']}/tasks/{task['id']}",
                             headers={"Authorization": f"Basic {user_credentials[0]}"},
@@ -222,11 +250,11 @@ def test_delete_task(client, create_and_fill_database):
     user = database_filler.users[0]
     response = client.get(f"/api/users/{user['username']}/projects",
                           headers={"Authorization": f"Basic {user_credentials[0]}"})
-    project = response.json()[0]
+    project = response.json()['items'][0]
     response = client.get(f"/api/users/{user['username']}/projects/{project['id']}/tasks",
                           headers={"Authorization": f"Basic {user_credentials[0]}"})
     assert response.status_code == status.HTTP_200_OK
-    task = response.json()[0]
+    task = response.json()['items'][0]
 
     response = client.delete(f"/api/users/{user['username']}/projects/{project['id']}/tasks/{task['id']}",
                              headers={"Authorization": f"Basic {user_credentials[0]}"})
@@ -241,24 +269,28 @@ def test_start_task(client, create_and_fill_database):
     user = database_filler.users[0]
     response = client.get(f"/api/users/{user['username']}/projects",
                           headers={"Authorization": f"Basic {user_credentials[0]}"})
-    project = response.json()[0]
+    project = response.json()['items'][0]
     response = client.get(f"/api/users/{user['username']}/projects/{project['id']}/tasks",
                           headers={"Authorization": f"Basic {user_credentials[0]}"})
     assert response.status_code == status.HTTP_200_OK
-    task = response.json()[0]
+    task = response.json()['items'][0]
 
     assert task['start_timestamp'] is None
     assert task['end_timestamp'] is None
 
     url = f"/api/users/{user['username']}/projects/{project['id']}/tasks/{task['id']}/start"
-    response = client.post(url,
-                           headers={"Authorization": f"Basic {user_credentials[0]}"})
+    with count_statements() as statements:
+        response = client.post(url,
+                               headers={"Authorization": f"Basic {user_credentials[0]}"})
     assert response.status_code == status.HTTP_200_OK
+    # Access and state are checked by the UPDATE, nothing is read before it
+    assert statements[0].startswith('UPDATE tasks')
+    assert not [statement for statement in statements if statement.startswith('SELECT')]
 
     response = client.get(f"/api/users/{user['username']}/projects/{project['id']}/tasks",
                           headers={"Authorization": f"Basic {user_credentials[0]}"})
     assert response.status_code == status.HTTP_200_OK
-    task = response.json()[0]
+    task = response.json()['items'][0]
     assert task['start_timestamp'] is not None
     assert task['end_timestamp'] is None
 
@@ -270,7 +302,465 @@ def test_start_task(client, create_and_fill_database):
     response = client.get(f"/api/users/{user['username']}/projects/{project['id']}/tasks",
                           headers={"Authorization": f"Basic {user_credentials[0]}"})
     assert response.status_code == status.HTTP_200_OK
-    task = response.json()[0]
+    task = response.json()['items'][0]
 
     assert task['start_timestamp'] is not None
     assert task['end_timestamp'] is not None
+
+
+def test_principal_cache(client, create_and_fill_database):
+    user = database_filler.users[0]
+    headers = {"Authorization": f"Basic {user_credentials[0]}"}
+
+    response = client.get("/api/users/me", headers=headers)
+    assert response.status_code == status.HTTP_200_OK
+    stats = principal_cache.stats()
+    response = client.get("/api/users/me", headers=headers)
+    assert response.status_code == status.HTTP_200_OK
+    assert principal_cache.stats()['hits'] == stats['hits'] + 1
+
+    # Role change must not be served from a stale principal
+    new_role_info = rest.schemas.UserUpdateRole(role=rest.schemas.Role.ADMIN)
+    response = client.patch(f"/api/users/{user['username']}/role",
+                            headers={"Authorization": f"Basic {admin_credentials}"},
+                            json=new_role_info.model_dump(mode='json'))
+    assert response.status_code == status.HTTP_200_OK
+    response = client.get("/api/users", headers=headers)
+    assert response.status_code == status.HTTP_200_OK
+    response = client.patch(f"/api/users/{database_filler.users[1]['username']}/role",
+                            headers=headers,
+                            json=new_role_info.model_dump(mode='json'))
+    assert response.status_code == status.HTTP_200_OK
+
+    wrong_credentials = _get_credentials(dict(username=user['username'], password='wrong_password'))
+    response = client.get("/api/users/me", headers={"Authorization": f"Basic {wrong_credentials}"})
+    assert response.status_code == status.HTTP_401_UNAUTHORIZED
+
+
+def test_task_of_other_project(client, create_and_fill_database):
+    user = database_filler.users[1]
+    headers = {"Authorization": f"Basic {user_credentials[1]}"}
+    response = client.get(f"/api/users/{user['username']}/projects", headers=headers)
+    project1, project2 = response.json()['items'][:2]
+    task_id = project1['task_ids'][0]
+
+    response = client.get(f"/api/users/{user['username']}/projects/{project1['id']}/tasks/{task_id}",
+                          headers=headers)
+    assert response.status_code == status.HTTP_200_OK
+    response = client.get(f"/api/users/{user['username']}/projects/{project2['id']}/tasks/{task_id}",
+                          headers=headers)
+    assert response.status_code == status.HTTP_404_NOT_FOUND
+    response = client.post(f"/api/users/{user['username']}/projects/{project2['id']}/tasks/{task_id}/start",
+                           headers=headers)
+    assert response.status_code == status.HTTP_404_NOT_FOUND
+
+
+def test_pagination(client, create_and_fill_database):
+    headers = {"Authorization": f"Basic {admin_credentials}"}
+    usernames = []
+    cursor = None
+    while True:
+        params = {'limit': 1}
+        if cursor is not None:
+            params['cursor'] = cursor
+        response = client.get("/api/users", headers=headers, params=params)
+        assert response.status_code == status.HTTP_200_OK
+        page = response.json()
+        assert len(page['items']) <= 1
+        usernames.extend(user['username'] for user in page['items'])
+        cursor = page['next_cursor']
+        if cursor is None:
+            break
+    assert usernames == sorted(user['username'] for user in database_filler.users)
+
+    user = database_filler.users[1]
+    headers = {"Authorization": f"Basic {user_credentials[1]}"}
+    response = client.get(f"/api/users/{user['username']}/projects", headers=headers,
+                          params={'limit': 1})
+    page = response.json()
+    assert len(page['items']) == 1
+    response = client.get(f"/api/users/{user['username']}/projects", headers=headers,
+                          params={'limit': 1, 'cursor': page['next_cursor']})
+    assert response.json()['items'][0]['id'] > page['items'][0]['id']
+
+    project = page['items'][0]
+    response = client.get(f"/api/users/{user['username']}/projects/{project['id']}/tasks",
+                          headers=headers, params={'limit': 1})
+    page = response.json()
+    assert len(page['items']) == 1
+    assert page['next_cursor'] is not None
+
+    response = client.get("/api/users", headers=headers, params={'cursor': '!!!'})
+    assert response.status_code == status.HTTP_400_BAD_REQUEST
+
+    # Valid cursors of keys with the wrong type
+    projects_url = f"/api/users/{database_filler.users[1]['username']}/projects"
+    for key in [{'a': 1}, [1, 2], 'user', 1.5, True, None]:
+        for url, params in [("/api/users", {}), (projects_url, {}), (projects_url, {'visibility': 'public'})]:
+            if url == "/api/users" and key == 'user':
+                continue
+            response = client.get(url, headers=headers, params={**params, 'cursor': encode_cursor(key)})
+            assert response.status_code == status.HTTP_400_BAD_REQUEST, (url, params, key)
+
+
+def test_statement_count_constant(client, create_and_fill_database):
+    user = database_filler.users[0]
+    headers = {"Authorization": f"Basic {user_credentials[0]}"}
+    projects_url = f"/api/users/{user['username']}/projects"
+    project_id = client.get(projects_url, headers=headers).json()['items'][0]['id']
+    project_url = f"{projects_url}/{project_id}"
+
+    def statement_counts():
+        counts = []
+        for url in [projects_url, project_url, f"{project_url}/tasks"]:
+            with count_statements() as statements:
+                response = client.get(url, headers=headers)
+            assert response.status_code == status.HTTP_200_OK
+            counts.append(len(statements))
+        return counts
+
+    counts = statement_counts()
+    for i in range(5):
+        project_info = rest.schemas.ProjectCreate(name=f'project{i}',
+                                                  description='description',
+                                                  visibility=rest.schemas.ProjectVisibility.PUBLIC)
+        project = client.post(projects_url, headers=headers,
+                              json=project_info.model_dump(mode='json')).json()
+        for _ in range(3):
+            client.post(f"{projects_url}/{project['id']}/tasks", headers=headers,
+                        json=rest.schemas.TaskCreate(description='task').model_dump(mode='json'))
+            client.post(f"{project_url}/tasks", headers=headers,
+                        json=rest.schemas.TaskCreate(description='task').model_dump(mode='json'))
+    assert statement_counts() == counts
+
+
+def test_create_tasks_bulk(client, create_and_fill_database):
+    user = database_filler.users[0]
+    headers = {"Authorization": f"Basic {user_credentials[0]}"}
+    response = client.get(f"/api/users/{user['username']}/projects", headers=headers)
+    project = response.json()['items'][0]
+    tasks = [rest.schemas.TaskCreate(description=f'bulk task {i}').model_dump(mode='json')
+             for i in range(5)]
+
+    url = f"/api/users/{user['username']}/projects/{project['id']}/tasks:bulk"
+    with count_statements() as statements:
+        response = client.post(url, headers=headers, json=tasks)
+    assert response.status_code == status.HTTP_200_OK
+    task_ids = response.json()
+    assert len(task_ids) == len(tasks)
+    assert len([s for s in statements if s.startswith('INSERT')]) == 1
+
+    for task_id, task in zip(task_ids, tasks):
+        response = client.get(f"/api/users/{user['username']}/projects/{project['id']}/tasks/{task_id}",
+                              headers=headers)
+        assert response.json()['description'] == task['description']
+
+    response = client.post(url, headers=headers, json=tasks + [{}])
+    assert response.status_code == status.HTTP_422_UNPROCESSABLE_ENTITY
+    response = client.post(url, headers={"Authorization": f"Basic {user_credentials[1]}"}, json=tasks)
+    assert response.status_code == status.HTTP_404_NOT_FOUND
+
+
+def test_start_stop_tasks_bulk(client, create_and_fill_database):
+    user = database_filler.users[1]
+    headers = {"Authorization": f"Basic {user_credentials[1]}"}
+    response = client.get(f"/api/users/{user['username']}/projects", headers=headers)
+    public_project, private_project = response.json()['items'][:2]
+    assert private_project['visibility'] == rest.schemas.ProjectVisibility.PRIVATE.value
+    task_ids = public_project['task_ids'] + private_project['task_ids']
+
+    start_url = f"/api/users/{user['username']}/tasks:start"
+    stop_url = f"/api/users/{user['username']}/tasks:stop"
+
+    response = client.post(stop_url, headers=headers, json=task_ids[:1])
+    assert response.json() == [dict(task_id=task_ids[0], result='not_started')]
+
+    response = client.post(start_url, headers=headers, json=task_ids[:1])
+    assert response.json() == [dict(task_id=task_ids[0], result='started')]
+
+    with count_statements() as statements:
+        response = client.post(start_url, headers=headers, json=task_ids + [999])
+    assert response.status_code == status.HTTP_200_OK
+    assert [r['result'] for r in response.json()] == \
+        ['already_started'] + ['started'] * (len(task_ids) - 1) + ['not_found']
+    assert len([s for s in statements if s.startswith('UPDATE tasks')]) == 1
+
+    response = client.post(stop_url, headers=headers, json=task_ids)
+    assert [r['result'] for r in response.json()] == ['stopped'] * len(task_ids)
+    response = client.post(stop_url, headers=headers, json=task_ids[:1])
+    assert response.json() == [dict(task_id=task_ids[0], result='already_stopped')]
+
+    # Other users only see tasks of public projects
+    other_headers = {"Authorization": f"Basic {user_credentials[0]}"}
+    response = client.post(start_url, headers=other_headers, json=task_ids)
+    assert [r['result'] for r in response.json()] == \
+        ['already_started'] * len(public_project['task_ids']) + \
+        ['not_found'] * len(private_project['task_ids'])
+
+
+def test_time_report(client, create_and_fill_database):
+    user = database_filler.users[1]
+    headers = {"Authorization": f"Basic {user_credentials[1]}"}
+    response = client.get(f"/api/users/{user['username']}/projects", headers=headers)
+    project = response.json()['items'][0]
+    task_ids = project['task_ids']
+    client.post(f"/api/users/{user['username']}/tasks:start", headers=headers, json=task_ids)
+    client.post(f"/api/users/{user['username']}/tasks:stop", headers=headers, json=task_ids)
+
+    url = f"/api/users/{user['username']}/reports/time"
+    response = client.get(url, headers=headers)
+    assert response.status_code == status.HTTP_200_OK
+    report = response.json()
+    assert len(report) == 1
+    assert report[0]['tracked_seconds'] >= 0
+
+    response = client.get(url, headers=headers, params={'group_by': 'project', 'from': report[0]['day']})
+    assert response.json() == [dict(day=None, project_id=project['id'],
+                                    tracked_seconds=report[0]['tracked_seconds'])]
+    response = client.get(url, headers=headers, params={'to': '2000-01-01'})
+    assert response.json() == []
+
+    response = client.get(url, headers={"Authorization": f"Basic {user_credentials[0]}"})
+    assert response.status_code == status.HTTP_403_FORBIDDEN
+
+
+def test_export_tasks(client, create_and_fill_database):
+    user = database_filler.users[1]
+    headers = {"Authorization": f"Basic {user_credentials[1]}"}
+    url = f"/api/users/{user['username']}/tasks/export"
+    task_count = sum(len(tasks) for (username, _), tasks in database_filler.tasks.items()
+                     if username == user['username'])
+
+    response = client.get(url, headers=headers)
+    assert response.status_code == status.HTTP_200_OK
+    assert response.headers['content-type'] == 'application/x-ndjson'
+    tasks = [json.loads(line) for line in response.text.splitlines()]
+    assert len(tasks) == task_count
+    assert all(task['owner_username'] == user['username'] for task in tasks)
+
+    response = client.get(url, headers=headers, params={'format': 'csv'})
+    assert response.status_code == status.HTTP_200_OK
+    rows = list(csv.DictReader(io.StringIO(response.text)))
+    assert [int(row['id']) for row in rows] == [task['id'] for task in tasks]
+
+    # Other users export only tasks of public projects
+    response = client.get(url, headers={"Authorization": f"Basic {user_credentials[0]}"})
+    public_tasks = [json.loads(line) for line in response.text.splitlines()]
+    assert 0 < len(public_tasks) < task_count
+
+
+def test_conditional_get(client, create_and_fill_database):
+    user = database_filler.users[0]
+    headers = {"Authorization": f"Basic {user_credentials[0]}"}
+    response = client.get(f"/api/users/{user['username']}/projects", headers=headers)
+    project = response.json()['items'][0]
+    project_url = f"/api/users/{user['username']}/projects/{project['id']}"
+    task_url = f"{project_url}/tasks/{project['task_ids'][0]}"
+
+    etags = {}
+    for url in [project_url, task_url, f"{project_url}/tasks"]:
+        response = client.get(url, headers=headers)
+        assert response.status_code == status.HTTP_200_OK
+        etags[url] = response.headers['ETag']
+
+        with count_statements() as statements:
+            response = client.get(url, headers={**headers, "If-None-Match": etags[url]})
+        assert response.status_code == status.HTTP_304_NOT_MODIFIED
+        assert response.headers['ETag'] == etags[url]
+        assert response.content == b''
+        assert len(statements) == 1
+
+        response = client.get(url, headers={**headers, "If-None-Match": '"other"'})
+        assert response.status_code == status.HTTP_200_OK
+
+    response = client.post(f"{task_url}/start", headers=headers)
+    assert response.status_code == status.HTTP_200_OK
+    for url, etag in etags.items():
+        response = client.get(url, headers={**headers, "If-None-Match": etag})
+        assert response.status_code == status.HTTP_200_OK
+        assert response.headers['ETag'] != etag
+
+    # Access check still applies to conditional requests
+    response = client.get(task_url, headers={"Authorization": f"Basic {user_credentials[1]}",
+                                             "If-None-Match": "*"})
+    assert response.status_code == status.HTTP_404_NOT_FOUND
+
+
+def test_legacy_password_hash_upgrade(client, create_and_fill_database):
+    user = database_filler.users[0]
+    legacy_hash = hashlib.sha256(user['password'].encode()).hexdigest()
+    with db_session() as db:
+        db_user = crud.get_user_by_username(db, user['username'])
+        assert password_hasher.verify_password(user['password'], db_user.hashed_password)
+        assert not password_hasher.needs_rehash(db_user.hashed_password)
+        db_user.hashed_password = legacy_hash
+        db.commit()
+
+    response = client.get("/api/users/me", headers={"Authorization": f"Basic {user_credentials[0]}"})
+    assert response.status_code == status.HTTP_200_OK
+    with db_session() as db:
+        hashed_password = crud.get_user_by_username(db, user['username']).hashed_password
+    assert hashed_password.startswith(f'${settings.password_hash_algorithm}$')
+    assert password_hasher.verify_password(user['password'], hashed_password)
+
+    # The upgraded hash keeps working once the cached principal is gone
+    principal_cache.clear()
+    response = client.get("/api/users/me", headers={"Authorization": f"Basic {user_credentials[0]}"})
+    assert response.status_code == status.HTTP_200_OK
+
+
+def test_bearer_token(client, create_and_fill_database):
+    user = database_filler.users[0]
+    response = client.post("/api/auth/token", headers={"Authorization": f"Basic {user_credentials[0]}"})
+    assert response.status_code == status.HTTP_200_OK
+    token = rest.schemas.Token(**response.json())
+    assert token.token_type == 'bearer'
+    headers = {"Authorization": f"Bearer {token.access_token}"}
+
+    # Tokens are verified without any query
+    with count_statements() as statements:
+        response = client.get(f"/api/users/{user['username']}/projects/1/tasks/1", headers=headers)
+    assert response.status_code == status.HTTP_200_OK
+    assert not [statement for statement in statements if 'FROM users' in statement]
+
+    # Tokens can not be used to issue new tokens
+    response = client.post("/api/auth/token", headers=headers)
+    assert response.status_code == status.HTTP_401_UNAUTHORIZED
+
+    response = client.get("/api/users/me", headers={"Authorization": f"Bearer {token.access_token}x"})
+    assert response.status_code == status.HTTP_401_UNAUTHORIZED
+    assert response.headers['WWW-Authenticate'] == 'Bearer'
+    response = client.get("/api/users/me", headers={"Authorization": "Bearer abc.d\xe9f".encode('latin-1')})
+    assert response.status_code == status.HTTP_401_UNAUTHORIZED
+
+    # Role change revokes issued tokens
+    new_role_info = rest.schemas.UserUpdateRole(role=rest.schemas.Role.ADMIN)
+    response = client.patch(f"/api/users/{user['username']}/role",
+                            headers={"Authorization": f"Basic {admin_credentials}"},
+                            json=new_role_info.model_dump(mode='json'))
+    assert response.status_code == status.HTTP_200_OK
+    response = client.get("/api/users/me", headers=headers)
+    assert response.status_code == status.HTTP_401_UNAUTHORIZED
+
+    response = client.post("/api/auth/token", headers={"Authorization": f"Basic {user_credentials[0]}"})
+    headers = {"Authorization": f"Bearer {response.json()['access_token']}"}
+    response = client.get("/api/users", headers=headers)
+    assert response.status_code == status.HTTP_200_OK
+
+
+def test_metrics(client, create_and_fill_database):
+    instrument_engine(engine)
+    metrics.clear()
+    user = database_filler.users[1]
+    headers = {"Authorization": f"Basic {user_credentials[1]}"}
+    for project_id in [3, 4, 5]:
+        client.get(f"/api/users/{user['username']}/projects/{project_id}/tasks", headers=headers)
+
+    response = client.get("/api/metrics")
+    assert response.status_code == status.HTTP_200_OK
+    assert response.headers['content-type'].startswith('text/plain')
+    samples = dict(line.rsplit(' ', 1) for line in response.text.splitlines() if not line.startswith('#'))
+
+    labels = 'method="GET",route="/api/users/{username}/projects/{project_id}/tasks"'
+    assert samples[f'tasker_http_requests_total{{{labels},status="200"}}'] == '2'
+    assert samples[f'tasker_http_requests_total{{{labels},status="404"}}'] == '1'
+    assert samples[f'tasker_http_request_duration_seconds_count{{{labels}}}'] == '3'
+    assert samples[f'tasker_http_request_duration_seconds_bucket{{{labels},le="+Inf"}}'] == '3'
+    assert int(float(samples[f'tasker_http_request_sql_statements_sum{{{labels}}}'])) >= 3
+    assert samples[f'tasker_http_request_sql_statements_bucket{{{labels},le="0"}}'] == '0'
+    assert float(samples[f'tasker_http_request_db_seconds_total{{{labels}}}']) > 0
+    assert 'tasker_principal_cache_hits' in samples
+    assert 'tasker_db_read_pool_utilization' in samples
+    assert 'tasker_db_write_pool_checked_out' in samples
+
+
+def test_slow_queries_admin_only(client, create_and_fill_database):
+    response = client.get("/api/admin/slow-queries", headers={"Authorization": f"Basic {user_credentials[0]}"})
+    assert response.status_code == status.HTTP_403_FORBIDDEN
+    response = client.get("/api/admin/slow-queries", headers={"Authorization": f"Basic {admin_credentials}"})
+    assert response.status_code == status.HTTP_200_OK
+    assert isinstance(response.json(), list)
+
+
+def test_public_project_list_cache(client, create_and_fill_database):
+    owner = database_filler.users[1]
+    owner_headers = {"Authorization": f"Basic {user_credentials[1]}"}
+    headers = {"Authorization": f"Basic {user_credentials[0]}"}
+    url = f"/api/users/{owner['username']}/projects"
+
+    response = client.get(url, headers=headers)
+    assert response.status_code == status.HTTP_200_OK
+    listing = response.json()
+    assert [project['id'] for project in listing['items']] == [3]
+    stats = project_list_cache.stats()
+    with count_statements() as statements:
+        response = client.get(url, headers=headers)
+    assert response.json() == listing
+    assert project_list_cache.stats()['hits'] == stats['hits'] + 1
+    assert not [statement for statement in statements if 'FROM projects' in statement]
+
+    # Owner sees private projects too, not through the cache
+    response = client.get(url, headers=owner_headers)
+    assert [project['id'] for project in response.json()['items']] == [3, 4]
+
+    response = client.post(f"{url}/3/tasks", headers=owner_headers,
+                           json=rest.schemas.TaskCreate(description='New task').model_dump())
+    task_id = response.json()['id']
+    response = client.get(url, headers=headers)
+    assert task_id in response.json()['items'][0]['task_ids']
+
+    new_project = rest.schemas.ProjectCreate(name='new', description='new',
+                                             visibility=rest.schemas.ProjectVisibility.PUBLIC)
+    response = client.post(url, headers=owner_headers, json=new_project.model_dump(mode='json'))
+    project_id = response.json()['id']
+    response = client.get(url, headers=headers)
+    assert [project['id'] for project in response.json()['items']] == [3, project_id]
+
+
+def test_conditional_update(client, create_and_fill_database):
+    user = database_filler.users[0]
+    headers = {"Authorization": f"Basic {user_credentials[0]}"}
+    response = client.get(f"/api/users/{user['username']}/projects", headers=headers)
+    project = response.json()['items'][0]
+    task_url = f"/api/users/{user['username']}/projects/{project['id']}/tasks/{project['task_ids'][0]}"
+    etag = client.get(task_url, headers=headers).headers['ETag']
+
+    with count_statements() as statements:
+        response = client.patch(task_url, headers={**headers, "If-Match": etag},
+                                json={'description': 'first'})
+    assert response.status_code == status.HTTP_200_OK
+    assert response.json()['description'] == 'first'
+    new_etag = response.headers['ETag']
+    assert new_etag != etag
+    # Nothing is read back after the UPDATE ... RETURNING
+    update = next(index for index, statement in enumerate(statements) if statement.startswith('UPDATE tasks'))
+    assert not [statement for statement in statements[update + 1:] if statement.startswith('SELECT')]
+
+    response = client.patch(task_url, headers={**headers, "If-Match": etag}, json={'description': 'second'})
+    assert response.status_code == status.HTTP_412_PRECONDITION_FAILED
+    assert client.get(task_url, headers=headers).json()['description'] == 'first'
+    response = client.patch(task_url, headers={**headers, "If-Match": "*"}, json={'description': 'second'})
+    assert response.status_code == status.HTTP_200_OK
+
+    user_url = f"/api/users/{user['username']}"
+    etag = client.get(user_url, headers=headers).headers['ETag']
+    with count_statements() as statements:
+        response = client.patch(user_url, headers={**headers, "If-Match": etag}, json={'bio': 'new bio'})
+    assert response.status_code == status.HTTP_200_OK
+    assert response.json()['bio'] == 'new bio'
+    assert response.json()['project_ids'] == [project['id'] for project in
+                                              client.get(f"{user_url}/projects", headers=headers).json()['items']]
+    # Version is taken from the ETag and ids are returned by the UPDATE, nothing else is read
+    assert [statement.split()[0] for statement in statements] == ['UPDATE']
+    response = client.patch(user_url, headers={**headers, "If-Match": etag}, json={'bio': 'other bio'})
+    assert response.status_code == status.HTTP_412_PRECONDITION_FAILED
+
+    admin_headers = {"Authorization": f"Basic {admin_credentials}"}
+    response = client.patch(f"{user_url}/role", headers={**admin_headers, "If-Match": etag},
+                            json={'role': 'admin'})
+    assert response.status_code == status.HTTP_412_PRECONDITION_FAILED
+    etag = client.get(user_url, headers=headers).headers['ETag']
+    response = client.patch(f"{user_url}/role", headers={**admin_headers, "If-Match": etag},
+                            json={'role': 'admin'})
+    assert response.status_code == status.HTTP_200_OK
+    assert response.json()['role'] == 'admin'
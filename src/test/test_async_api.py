@@ -0,0 +1,99 @@
+import csv
+import io
+
+import pytest
+
+from fastapi import status
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine, NullPool
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+from sqlalchemy.orm import sessionmaker
+
+from rest.main import app, get_read_db, get_write_db
+from database.db_init import Base
+from database import database_filler
+from utils.principal_cache import principal_cache
+
+from db import get_test_db
+
+import rest.schemas
+
+from test_api import user_credentials
+
+
+@pytest.fixture()
+def async_client(tmp_path):
+    db_url = f"sqlite:///{tmp_path / 'database.db'}"
+    engine = create_engine(db_url)
+    Base.metadata.create_all(bind=engine)
+    db = sessionmaker(bind=engine)()
+    database_filler.run(db)
+    db.close()
+    engine.dispose()
+
+    async_engine = create_async_engine(db_url.replace('sqlite://', 'sqlite+aiosqlite://'),
+                                       poolclass=NullPool)
+    AsyncTestSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
+
+    async def get_async_test_db():
+        async with AsyncTestSessionLocal() as async_db:
+            yield async_db
+
+    principal_cache.clear()
+    app.dependency_overrides[get_read_db] = get_async_test_db
+    app.dependency_overrides[get_write_db] = get_async_test_db
+    try:
+        with TestClient(app) as test_client:
+            yield test_client
+    finally:
+        app.dependency_overrides[get_read_db] = get_test_db
+        app.dependency_overrides[get_write_db] = get_test_db
+        principal_cache.clear()
+
+
+def test_async_session_api(async_client):
+    user = database_filler.users[0]
+    headers = {"Authorization": f"Basic {user_credentials[0]}"}
+
+    response = async_client.get("/api/users/me", headers=headers)
+    assert response.status_code == status.HTTP_200_OK
+    assert response.json()['username'] == user['username']
+
+    response = async_client.get(f"/api/users/{user['username']}/projects", headers=headers)
+    assert response.status_code == status.HTTP_200_OK
+    project = response.json()['items'][0]
+
+    response = async_client.get(f"/api/users/{user['username']}/projects/{project['id']}",
+                                headers=headers)
+    assert response.status_code == status.HTTP_200_OK
+    assert response.json()['id'] == project['id']
+
+    task_info = rest.schemas.TaskCreate(description='new task description')
+    response = async_client.post(f"/api/users/{user['username']}/projects/{project['id']}/tasks",
+                                 headers=headers,
+                                 json=task_info.model_dump(mode='json'))
+    assert response.status_code == status.HTTP_200_OK
+    task_id = response.json()['id']
+    task_url = f"/api/users/{user['username']}/projects/{project['id']}/tasks/{task_id}"
+
+    assert async_client.post(f"{task_url}/start", headers=headers).status_code == status.HTTP_200_OK
+    assert async_client.post(f"{task_url}/stop", headers=headers).status_code == status.HTTP_200_OK
+    response = async_client.get(task_url, headers=headers)
+    assert response.json()['end_timestamp'] is not None
+
+    update_info = rest.schemas.UserUpdateInfo(bio='new bio')
+    response = async_client.patch(f"/api/users/{user['username']}", headers=headers,
+                                  json=update_info.model_dump())
+    assert response.status_code == status.HTTP_200_OK
+    assert response.json()['bio'] == 'new bio'
+    assert task_id in response.json()['task_ids']
+
+
+def test_async_session_export(async_client):
+    user = database_filler.users[1]
+    headers = {"Authorization": f"Basic {user_credentials[1]}"}
+    response = async_client.get(f"/api/users/{user['username']}/tasks/export",
+                                headers=headers, params={'format': 'csv'})
+    assert response.status_code == status.HTTP_200_OK
+    assert len(list(csv.reader(io.StringIO(response.text)))) == 1 + sum(
+        len(tasks) for (username, _), tasks in database_filler.tasks.items() if username == user['username'])
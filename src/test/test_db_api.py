@@ -1,7 +1,11 @@
 from rest.schemas import (UserCreate, UserUpdateInfo, UserUpdateRole, ProjectCreate,
                           TaskCreate, Role, ProjectVisibility)
 
-from database import crud
+from database import crud, dataset_generator, models
+from utils import password_hasher
+import rest.schemas
+
+import datetime
 
 
 def test_create_user(db_session):
@@ -256,3 +260,102 @@ def test_start_stop_task(db_session):
     task = crud.get_task_by_id(db_session, tasks[0].id)
     assert task.start_timestamp is not None
     assert task.end_timestamp is not None
+
+
+def test_get_project_and_task(db_session):
+    user = UserCreate(
+        username="user1",
+        email="user1@example.com",
+        password="password",
+        bio="Existing bio",
+        role=Role.BASIC,
+    )
+    db_user = crud.create_user(db_session, user)
+
+    project_create = ProjectCreate(name="user1 project",
+                                   description="Test description",
+                                   visibility=ProjectVisibility.PRIVATE)
+    project1 = crud.create_project(db_session, db_user.username, project_create)
+    project2 = crud.create_project(db_session, db_user.username, project_create)
+    task = crud.create_task(db_session, db_user.username, project1.id,
+                            TaskCreate(description="Test Task"))
+
+    project, db_task = crud.get_project_and_task(db_session, project1.id, db_user.username, task.id)
+    assert project.id == project1.id
+    assert db_task.id == task.id
+
+    # Task of another project must not be resolved
+    project, db_task = crud.get_project_and_task(db_session, project2.id, db_user.username, task.id)
+    assert project.id == project2.id
+    assert db_task is None
+
+    project, db_task = crud.get_project_and_task(db_session, project1.id, "user2", task.id)
+    assert project is None
+    assert db_task is None
+
+
+def test_time_rollups(db_session):
+    db_user = crud.create_user(db_session, UserCreate(username="user1",
+                                                     email="user1@example.com",
+                                                     password="password",
+                                                     bio="Existing bio",
+                                                     role=Role.BASIC))
+    project_create = ProjectCreate(name="user1 project",
+                                   description="Test description",
+                                   visibility=ProjectVisibility.PRIVATE)
+    project = crud.create_project(db_session, db_user.username, project_create)
+    tasks = [crud.create_task(db_session, db_user.username, project.id, TaskCreate(description="Task"))
+             for _ in range(3)]
+
+    # Crosses midnight: 1h on the first day and 2h on the second one
+    tasks[0].start_timestamp = datetime.datetime(2024, 1, 1, 23)
+    tasks[0].end_timestamp = datetime.datetime(2024, 1, 2, 2)
+    tasks[1].start_timestamp = datetime.datetime(2024, 1, 2, 10)
+    tasks[1].end_timestamp = datetime.datetime(2024, 1, 2, 10, 30)
+    db_session.commit()
+    crud.rebuild_time_rollups(db_session)
+
+    report = crud.get_time_report(db_session, db_user.username)
+    assert report == [(datetime.date(2024, 1, 1), 3600), (datetime.date(2024, 1, 2), 9000)]
+    report = crud.get_time_report(db_session, db_user.username, from_day=datetime.date(2024, 1, 2),
+                                  group_by=rest.schemas.TimeReportGrouping.PROJECT)
+    assert report == [(project.id, 9000)]
+
+    # Incremental update on stop matches a rebuild
+    crud.start_task(db_session, tasks[2].id)
+    crud.stop_task(db_session, tasks[2].id)
+    rollups = {(r.username, r.project_id, r.day): r.tracked_seconds
+               for r in db_session.query(models.TimeRollup).all()}
+    crud.rebuild_time_rollups(db_session)
+    assert rollups == {(r.username, r.project_id, r.day): r.tracked_seconds
+                       for r in db_session.query(models.TimeRollup).all()}
+
+    assert crud.delete_task(db_session, tasks[1].id)
+    assert crud.delete_task(db_session, tasks[1].id) is None
+    report = crud.get_time_report(db_session, db_user.username, to_day=datetime.date(2024, 1, 2))
+    assert report == [(datetime.date(2024, 1, 1), 3600), (datetime.date(2024, 1, 2), 7200)]
+
+
+def test_dataset_generator(db_session):
+    counts = dataset_generator.generate(db_session, 5, 4, 10, running_ratio=0.2, public_ratio=0.5,
+                                        seed=1, batch_size=7)
+    assert (counts['users'], counts['projects'], counts['tasks']) == (5, 20, 200)
+
+    tasks = db_session.query(models.Task).all()
+    assert len(tasks) == 200
+    running = [task for task in tasks if task.start_timestamp is not None and task.end_timestamp is None]
+    finished = [task for task in tasks if task.end_timestamp is not None]
+    assert 0 < len(running) < len(finished) < len(tasks)
+    assert all(task.start_timestamp <= task.end_timestamp for task in finished)
+    assert db_session.query(models.TimeRollup).count() == counts['time_rollups'] > 0
+
+    visibilities = [project.visibility for project in crud.get_projects(db_session, 'user0000000')]
+    assert set(visibilities) == {ProjectVisibility.PUBLIC, ProjectVisibility.PRIVATE}
+    user = crud.get_user_by_username(db_session, 'user0000000')
+    assert password_hasher.verify_password(dataset_generator.password, user.hashed_password)
+
+    # Same seed generates the same data after the existing rows
+    dataset_generator.generate(db_session, 5, 4, 10, running_ratio=0.2, public_ratio=0.5,
+                               seed=1, username_prefix='other')
+    other_projects = crud.get_projects(db_session, 'other0000000')
+    assert [project.visibility for project in other_projects] == visibilities
@@ -0,0 +1,82 @@
+import threading
+
+import pytest
+import sqlalchemy.exc
+
+from database.db_init import create_sqlite_engine, get_effective_settings, get_engine_options, get_pool_stats
+from utils.settings import Settings
+
+
+def test_default_profile():
+    assert get_engine_options(Settings(db_profile='default')) == {}
+
+
+def test_production_profile(tmp_path):
+    engine_settings = Settings(db_profile='production', db_busy_timeout=1234)
+    engine = create_sqlite_engine(f"sqlite:///{tmp_path / 'database.db'}", engine_settings)
+
+    effective = get_effective_settings(engine)
+    assert effective['journal_mode'] == 'wal'
+    assert effective['synchronous'] == 1  # NORMAL
+    assert effective['busy_timeout'] == 1234
+    assert effective['cache_size'] == -64 * 1024
+    assert effective['mmap_size'] == 256 * 1024 * 1024
+    assert engine.pool.size() == 10
+    engine.dispose()
+
+
+def test_concurrent_writers(tmp_path):
+    engine = create_sqlite_engine(f"sqlite:///{tmp_path / 'database.db'}",
+                                  Settings(db_profile='production'))
+    with engine.begin() as conn:
+        conn.exec_driver_sql('CREATE TABLE counter (value INTEGER)')
+    errors = []
+
+    def write():
+        try:
+            for _ in range(20):
+                with engine.begin() as conn:
+                    conn.exec_driver_sql('INSERT INTO counter VALUES (1)')
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=write) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert errors == []
+    with engine.connect() as conn:
+        assert conn.exec_driver_sql('SELECT count(*) FROM counter').scalar() == 8 * 20
+    engine.dispose()
+
+
+def test_read_only_engine(tmp_path):
+    url = f"sqlite:///{tmp_path / 'database.db'}"
+    engine_settings = Settings(db_profile='production', db_read_pool_size=3)
+    engine = create_sqlite_engine(url, engine_settings)
+    read_engine = create_sqlite_engine(url, engine_settings, read_only=True)
+    with engine.begin() as conn:
+        conn.exec_driver_sql('CREATE TABLE counter (value INTEGER)')
+        conn.exec_driver_sql('INSERT INTO counter VALUES (1)')
+
+    with read_engine.connect() as read_conn:
+        assert read_conn.exec_driver_sql('PRAGMA query_only').scalar() == 1
+        with pytest.raises(sqlalchemy.exc.OperationalError):
+            read_conn.exec_driver_sql('INSERT INTO counter VALUES (2)')
+
+    with read_engine.connect() as read_conn:
+        assert get_pool_stats(read_engine) == dict(size=3, checked_out=1, checked_in=0, overflow=0,
+                                                   utilization=1 / 3)
+
+        # Readers see the last commit while a writer holds the write lock
+        with engine.begin() as conn:
+            conn.exec_driver_sql('INSERT INTO counter VALUES (3)')
+            assert read_conn.exec_driver_sql('SELECT count(*) FROM counter').scalar() == 1
+        assert read_conn.exec_driver_sql('SELECT count(*) FROM counter').scalar() == 2
+
+    assert get_pool_stats(engine)['size'] == 10
+    assert get_pool_stats(read_engine)['checked_out'] == 0
+    read_engine.dispose()
+    engine.dispose()
@@ -0,0 +1,160 @@
+import importlib
+import importlib.util
+import json
+import os
+import signal
+import subprocess
+import sys
+import time
+
+import httpx
+import pytest
+
+from database import db_init
+from rest import launcher
+from utils.settings import settings
+
+
+def _wait_for_status(status_path, condition, timeout=20):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if os.path.exists(status_path):
+            with open(status_path) as status_file:
+                status = json.load(status_file)
+            if condition(status):
+                return status
+        time.sleep(0.1)
+    raise AssertionError(f'Launcher status did not reach the expected state in {timeout} s')
+
+
+def _all_healthy(generation):
+    def condition(status):
+        workers = status['workers']
+        return (status['generation'] == generation and not status['restarting'] and len(workers) == 2 and
+                all(worker['healthy'] and worker['generation'] == generation for worker in workers))
+    return condition
+
+
+def test_check_implementations():
+    launcher.check_implementations('asyncio', 'h11')
+    launcher.check_implementations('auto', 'auto')
+    if importlib.util.find_spec('uvloop') is None:
+        with pytest.raises(ValueError):
+            launcher.check_implementations('uvloop', 'auto')
+
+
+def test_engines_disposed_after_fork():
+    engines = [db_init.engine, db_init.read_engine] + [
+        async_engine.sync_engine for async_engine in [db_init.async_engine, db_init.async_read_engine]
+        if async_engine is not None
+    ]
+    pools = [engine.pool for engine in engines]
+    read_fd, write_fd = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        os.write(write_fd, json.dumps([engine.pool is pool for engine, pool in zip(engines, pools)]).encode())
+        os._exit(0)
+    os.close(write_fd)
+    os.waitpid(pid, 0)
+    with os.fdopen(read_fd, 'rb') as pipe:
+        assert json.loads(pipe.read()) == [False] * len(engines)
+
+
+def test_share_token_secret(monkeypatch):
+    monkeypatch.setattr(settings, 'token_secret', None)
+    launcher.share_token_secret()
+    secret = settings.token_secret
+    assert secret
+    launcher.share_token_secret()
+    assert settings.token_secret == secret
+    monkeypatch.setattr(settings, 'token_secret', 'configured')
+    launcher.share_token_secret()
+    assert settings.token_secret == 'configured'
+
+
+def test_limit_cache_ttls(monkeypatch):
+    for setting, module_name, cache_name in launcher._process_caches:
+        monkeypatch.setattr(settings, setting, 60.0)
+        monkeypatch.setattr(getattr(importlib.import_module(module_name), cache_name), 'ttl', 60.0)
+    monkeypatch.setattr(settings, 'server_worker_cache_ttl', 2.0)
+
+    launcher.limit_cache_ttls(1)
+    assert settings.principal_cache_ttl == 60.0
+    launcher.limit_cache_ttls(4)
+    for setting, module_name, cache_name in launcher._process_caches:
+        assert getattr(settings, setting) == 2.0
+        assert getattr(importlib.import_module(module_name), cache_name).ttl == 2.0
+
+
+def test_worker_crash_during_rolling_restart(monkeypatch):
+    process = launcher.Launcher(2, '127.0.0.1', 0)
+    pids = iter(range(101, 200))
+    killed = []
+    exited = []
+
+    def spawn(slot):
+        read_fd, write_fd = os.pipe()
+        os.close(write_fd)
+        worker = launcher.Worker(next(pids), slot, process.generation, read_fd)
+        process.workers[worker.pid] = worker
+        return worker
+
+    def waitpid(pid, options):
+        # Exit code 1 for a crash
+        return (exited.pop(0), 1 << 8) if exited else (0, 0)
+
+    monkeypatch.setattr(process, 'spawn', spawn)
+    monkeypatch.setattr(process, '_kill', lambda pid, signum: killed.append((pid, signum)))
+    monkeypatch.setattr(launcher.os, 'waitpid', waitpid)
+    for slot in range(2):
+        spawn(slot).last_report = time.monotonic()
+
+    process._restart_requested = True
+    process._rolling_restart()
+    assert process._replacement.pid == 103
+    # Old worker of the slot being replaced crashes before its replacement reported
+    exited.append(101)
+    process._reap()
+    assert killed == [(103, signal.SIGTERM)]
+    assert process._replacement is None
+    assert [worker.pid for worker in process._restarting] == [102]
+    exited.append(103)
+    process._reap()
+
+    process._rolling_restart()
+    process._replacement.last_report = time.monotonic()
+    process._rolling_restart()
+    assert killed[-1] == (102, signal.SIGTERM)
+    exited.append(102)
+    process._reap()
+    assert not process._restarting
+    assert sorted((worker.slot, worker.generation) for worker in process.workers.values()) == [(0, 1), (1, 1)]
+    for worker in process.workers.values():
+        os.close(worker.health_fd)
+
+
+def test_rolling_restart(tmp_path):
+    status_path = str(tmp_path / 'status.json')
+    source_path = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    process = subprocess.Popen([sys.executable, '-m', 'rest.launcher', '--workers', '2', '--port', '0',
+                                '--host', '127.0.0.1', '--health-interval', '0.2', '--loop', 'asyncio',
+                                '--http', 'h11', '--status-path', status_path],
+                               cwd=source_path, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        status = _wait_for_status(status_path, _all_healthy(0))
+        old_pids = {worker['pid'] for worker in status['workers']}
+        assert httpx.get(f"http://127.0.0.1:{status['port']}/").status_code == 200
+
+        process.send_signal(signal.SIGHUP)
+        status = _wait_for_status(status_path, _all_healthy(1))
+        assert not old_pids & {worker['pid'] for worker in status['workers']}
+        assert httpx.get(f"http://127.0.0.1:{status['port']}/").status_code == 200
+
+        process.send_signal(signal.SIGTERM)
+        assert process.wait(timeout=30) == 0
+        with open(status_path) as status_file:
+            assert json.load(status_file)['workers'] == []
+    finally:
+        if process.poll() is None:
+            process.kill()
+            process.wait()
@@ -0,0 +1,29 @@
+import copy
+
+from benchmarks import load_test
+
+
+def test_load_test(tmp_path):
+    results = load_test.run(str(tmp_path / 'load_test.db'), user_count=3, projects_per_user=2,
+                            tasks_per_project=3, concurrency_levels=[1, 4], request_count=60)
+
+    assert set(results['levels']) == {'1', '4'}
+    for level in results['levels'].values():
+        assert level['requests'] >= 60
+        for route, stats in level['routes'].items():
+            assert stats['p50'] <= stats['p95'] <= stats['p99']
+            assert set(stats['statuses']) == {'200'}, route
+
+    assert load_test.compare(results, results, tolerance=0.1) == []
+    regressed = copy.deepcopy(results)
+    route, stats = next(iter(regressed['levels']['4']['routes'].items()))
+    stats['p95'] *= 2
+    assert load_test.compare(results, regressed, tolerance=0.1) == \
+        [f"concurrency 4, {route}: p95 {stats['p95'] / 2:.2f} ms -> {stats['p95']:.2f} ms"]
+
+
+def test_percentile():
+    values = list(range(1, 101))
+    assert load_test.percentile(values, 0.5) == 50
+    assert load_test.percentile(values, 0.99) == 99
+    assert load_test.percentile([7], 0.95) == 7
@@ -0,0 +1,101 @@
+import datetime
+
+import pytest
+from sqlalchemy import create_engine, inspect
+from sqlalchemy.orm import Session
+
+from database import crud, migrations, models
+
+
+# Schema as created before migrations existed
+_baseline_schema = [
+    '''CREATE TABLE users (
+        username VARCHAR NOT NULL PRIMARY KEY,
+        email VARCHAR UNIQUE,
+        bio VARCHAR NOT NULL,
+        hashed_password VARCHAR,
+        role VARCHAR(5) NOT NULL
+    )''',
+    '''CREATE TABLE projects (
+        id INTEGER NOT NULL PRIMARY KEY,
+        name VARCHAR NOT NULL,
+        description VARCHAR NOT NULL,
+        visibility VARCHAR(7) NOT NULL,
+        owner_username INTEGER REFERENCES users (username)
+    )''',
+    '''CREATE TABLE tasks (
+        id INTEGER NOT NULL PRIMARY KEY,
+        description VARCHAR NOT NULL,
+        start_timestamp DATETIME,
+        end_timestamp DATETIME,
+        project_id INTEGER REFERENCES projects (id),
+        owner_username INTEGER REFERENCES users (username)
+    )''',
+]
+
+_indexes = ['ix_projects_owner_username_visibility', 'ix_projects_owner_username_name',
+            'ix_tasks_project_id', 'ix_tasks_owner_username']
+
+
+def _index_names(engine):
+    inspector = inspect(engine)
+    return {index['name']
+            for table in inspector.get_table_names()
+            for index in inspector.get_indexes(table)}
+
+
+def test_upgrade_fresh_database(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'database.db'}")
+
+    assert migrations.upgrade(engine) == []
+    assert set(_indexes) <= _index_names(engine)
+    with engine.connect() as conn:
+        assert migrations.get_version(conn) == migrations.latest_version
+
+
+def test_upgrade_existing_database(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'database.db'}")
+    with engine.begin() as conn:
+        for statement in _baseline_schema:
+            conn.exec_driver_sql(statement)
+        conn.exec_driver_sql("INSERT INTO users (username, bio, role) VALUES ('user', 'bio', 'BASIC')")
+        conn.exec_driver_sql("INSERT INTO projects (name, description, visibility, owner_username) "
+                             "VALUES ('project', 'description', 'PUBLIC', 'user')")
+        conn.exec_driver_sql("INSERT INTO tasks (description, start_timestamp, end_timestamp, project_id, "
+                             "owner_username) VALUES ('task', '2024-01-01 22:30:00.250000', "
+                             "'2024-01-03 01:00:00.000000', 1, 'user'), "
+                             "('running', '2024-01-01 10:00:00.000000', NULL, 1, 'user')")
+    assert not set(_indexes) & _index_names(engine)
+
+    applied = migrations.upgrade(engine)
+    assert len(applied) == migrations.latest_version
+    assert set(_indexes) <= _index_names(engine)
+    with engine.connect() as conn:
+        assert migrations.get_version(conn) == migrations.latest_version
+        assert conn.exec_driver_sql('SELECT count(*) FROM users').scalar() == 1
+    columns = {table: {column['name'] for column in inspect(engine).get_columns(table)}
+               for table in ['users', 'projects', 'tasks']}
+    assert {'token_epoch', 'version'} <= columns['users']
+    assert 'version' in columns['projects'] and 'version' in columns['tasks']
+
+    with Session(bind=engine) as db:
+        rollups = {(rollup.username, rollup.project_id, rollup.day): rollup.tracked_seconds
+                   for rollup in db.query(models.TimeRollup)}
+        assert rollups == pytest.approx({('user', 1, datetime.date(2024, 1, 1)): 5399.75,
+                                         ('user', 1, datetime.date(2024, 1, 2)): 86400.0,
+                                         ('user', 1, datetime.date(2024, 1, 3)): 3600.0})
+        # Same as the rollups maintained by crud
+        crud.rebuild_time_rollups(db)
+        assert rollups == pytest.approx({(rollup.username, rollup.project_id, rollup.day): rollup.tracked_seconds
+                                         for rollup in db.query(models.TimeRollup)})
+
+    assert migrations.upgrade(engine) == []
+
+
+def test_add_column_is_idempotent(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'database.db'}")
+    migrations.upgrade(engine)
+    with engine.begin() as conn:
+        migrations.add_column(conn, 'tasks', 'note', 'VARCHAR')
+        migrations.add_column(conn, 'tasks', 'note', 'VARCHAR')
+    assert 'note' in [column['name'] for column in inspect(engine).get_columns('tasks')]
@@ -0,0 +1,52 @@
+import asyncio
+import hashlib
+
+from utils import password_hasher
+from utils.password_hasher import HashingPool, Pbkdf2Sha256, Scrypt
+
+
+def test_hash_and_verify():
+    for hasher in [Scrypt(ln=10), Pbkdf2Sha256(i=1000)]:
+        encoded = hasher.hash('password')
+        assert encoded.startswith(f'${hasher.id}$')
+        assert encoded != hasher.hash('password')
+        assert hasher.verify('password', encoded)
+        assert not hasher.verify('wrong_password', encoded)
+        assert password_hasher.identify(encoded).id == hasher.id
+
+
+def test_verify_password():
+    encoded = password_hasher.hash_password('password')
+    assert password_hasher.verify_password('password', encoded)
+    assert not password_hasher.verify_password('wrong_password', encoded)
+
+    legacy_hash = hashlib.sha256('password'.encode()).hexdigest()
+    assert password_hasher.verify_password('password', legacy_hash)
+    assert not password_hasher.verify_password('wrong_password', legacy_hash)
+    assert not password_hasher.verify_password('password', '$unknown$$salt$hash')
+    assert not password_hasher.verify_password('password', encoded[:encoded.rindex('$')])
+    assert not password_hasher.verify_password('password', encoded[:-3])
+    assert not password_hasher.verify_password('password', '$scrypt$ln=x$salt$hash')
+    assert not password_hasher.verify_password('password', None)
+
+
+def test_needs_rehash():
+    assert not password_hasher.needs_rehash(password_hasher.hash_password('password'))
+    assert password_hasher.needs_rehash(hashlib.sha256('password'.encode()).hexdigest())
+    assert password_hasher.needs_rehash(Pbkdf2Sha256(i=1000).hash('password'))
+    assert password_hasher.needs_rehash(Scrypt(ln=10).hash('password'))
+
+
+def test_hashing_pool():
+    pool = HashingPool(max_workers=2)
+    hasher = Scrypt(ln=10)
+
+    async def verify_all():
+        encoded = hasher.hash('password')
+        return await asyncio.gather(*[pool.run(hasher.verify, 'password', encoded) for _ in range(8)])
+
+    assert asyncio.run(verify_all()) == [True] * 8
+    stats = pool.stats()
+    assert stats['completed'] == 8
+    assert stats['queued'] == 0 and stats['active'] == 0
+    assert stats['max_queued'] > 2
@@ -0,0 +1,57 @@
+import time
+
+from utils.principal_cache import PrincipalCache, credential_digest
+
+
+def test_get_put():
+    cache = PrincipalCache(maxsize=4, ttl=60)
+    digest = credential_digest('password')
+
+    assert cache.get('user', digest) is None
+    cache.put('user', digest, 'principal')
+    assert cache.get('user', digest) == 'principal'
+    assert cache.get('user', credential_digest('wrong_password')) is None
+    assert cache.stats() == dict(hits=1, misses=2, size=1)
+
+
+def test_stale_put_ignored():
+    cache = PrincipalCache(maxsize=4, ttl=60)
+    generation = cache.generation('user')
+    # User changed while its principal was being loaded
+    cache.invalidate('user')
+    cache.put('user', 'digest', 'stale principal', generation)
+    assert cache.get('user', 'digest') is None
+    cache.put('user', 'digest', 'principal', cache.generation('user'))
+    assert cache.get('user', 'digest') == 'principal'
+
+
+def test_lru_eviction():
+    cache = PrincipalCache(maxsize=2, ttl=60)
+    cache.put('user1', 'digest', 'principal1')
+    cache.put('user2', 'digest', 'principal2')
+    assert cache.get('user1', 'digest') == 'principal1'
+
+    cache.put('user3', 'digest', 'principal3')
+    assert cache.get('user2', 'digest') is None
+    assert cache.get('user1', 'digest') == 'principal1'
+    assert cache.get('user3', 'digest') == 'principal3'
+
+
+def test_ttl_expiry():
+    cache = PrincipalCache(maxsize=2, ttl=0.01)
+    cache.put('user', 'digest', 'principal')
+    time.sleep(0.02)
+    assert cache.get('user', 'digest') is None
+    assert cache.stats()['size'] == 0
+
+
+def test_invalidate():
+    cache = PrincipalCache(maxsize=4, ttl=60)
+    cache.put('user1', 'digest1', 'principal1')
+    cache.put('user1', 'digest2', 'principal1')
+    cache.put('user2', 'digest1', 'principal2')
+
+    cache.invalidate('user1')
+    assert cache.get('user1', 'digest1') is None
+    assert cache.get('user1', 'digest2') is None
+    assert cache.get('user2', 'digest1') == 'principal2'
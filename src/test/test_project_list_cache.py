@@ -0,0 +1,92 @@
+import asyncio
+import time
+
+from utils.project_list_cache import ProjectListCache, mark_changed, project_list_cache
+
+
+def _builder(body: bytes, calls: list, delay: float = 0):
+    async def build():
+        calls.append(body)
+        await asyncio.sleep(delay)
+        return body
+    return build
+
+
+def test_read_through():
+    cache = ProjectListCache(maxsize=2, ttl=60)
+    calls = []
+
+    async def run():
+        assert await cache.get_or_build('owner1', 1, _builder(b'page1', calls)) == b'page1'
+        assert await cache.get_or_build('owner1', 1, _builder(b'other', calls)) == b'page1'
+        await cache.get_or_build('owner2', 1, _builder(b'page2', calls))
+        await cache.get_or_build('owner1', 1, _builder(b'other', calls))
+        # owner2 is least recently used and gets evicted
+        await cache.get_or_build('owner3', 1, _builder(b'page3', calls))
+        assert await cache.get_or_build('owner2', 1, _builder(b'page2 rebuilt', calls)) == b'page2 rebuilt'
+
+    asyncio.run(run())
+    assert calls == [b'page1', b'page2', b'page3', b'page2 rebuilt']
+    assert cache.stats() == dict(hits=2, misses=4, size=2)
+
+
+def test_ttl_expiry():
+    cache = ProjectListCache(maxsize=2, ttl=0.01)
+    calls = []
+
+    async def run():
+        await cache.get_or_build('owner', 1, _builder(b'page', calls))
+        time.sleep(0.02)
+        await cache.get_or_build('owner', 1, _builder(b'page', calls))
+
+    asyncio.run(run())
+    assert len(calls) == 2
+
+
+def test_single_build_for_concurrent_misses():
+    cache = ProjectListCache(maxsize=2, ttl=60)
+    calls = []
+
+    async def run():
+        return await asyncio.gather(*[cache.get_or_build('owner', 1, _builder(b'page', calls, delay=0.01))
+                                      for _ in range(10)])
+
+    assert asyncio.run(run()) == [b'page'] * 10
+    assert len(calls) == 1
+
+
+def test_invalidation():
+    cache = ProjectListCache(maxsize=4, ttl=60)
+    calls = []
+
+    async def run():
+        await cache.get_or_build('owner1', 1, _builder(b'page1', calls))
+        await cache.get_or_build('owner1', 2, _builder(b'page2', calls))
+        await cache.get_or_build('owner2', 1, _builder(b'page3', calls))
+        cache.invalidate(['owner1'])
+        assert cache.stats()['size'] == 1
+
+        # Listing built while the owner was invalidated is not stored
+        async def build_during_invalidation():
+            cache.invalidate(['owner1'])
+            return b'stale'
+        assert await cache.get_or_build('owner1', 1, build_during_invalidation) == b'stale'
+        assert await cache.get_or_build('owner1', 1, _builder(b'fresh', calls)) == b'fresh'
+
+    asyncio.run(run())
+    assert calls == [b'page1', b'page2', b'page3', b'fresh']
+
+
+def test_invalidation_on_commit(db_session):
+    async def fill():
+        await project_list_cache.get_or_build('owner', 1, _builder(b'page', []))
+
+    asyncio.run(fill())
+    mark_changed(db_session, ['owner'])
+    db_session.rollback()
+    assert project_list_cache.stats()['size'] == 1
+
+    mark_changed(db_session, ['owner'])
+    assert project_list_cache.stats()['size'] == 1
+    db_session.commit()
+    assert project_list_cache.stats()['size'] == 0
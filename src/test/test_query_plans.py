@@ -0,0 +1,67 @@
+import contextlib
+
+from sqlalchemy import event
+
+from database import crud, database_filler
+from rest.schemas import ProjectVisibility, TaskUpdate, TimeReportGrouping
+
+from db import engine, TestSessionLocal
+
+
+@contextlib.contextmanager
+def _capture_statements():
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        if not executemany and statement.lstrip().upper().startswith(('SELECT', 'UPDATE', 'DELETE')):
+            statements.append((statement, parameters))
+
+    event.listen(engine, 'before_cursor_execute', before_cursor_execute)
+    try:
+        yield statements
+    finally:
+        event.remove(engine, 'before_cursor_execute', before_cursor_execute)
+
+
+def _full_scans(statement, parameters):
+    with engine.connect() as conn:
+        plan = conn.exec_driver_sql(f'EXPLAIN QUERY PLAN {statement}', parameters).fetchall()
+    details = [row[-1] for row in plan]
+    # "SCAN <table>" without an index is a full table scan, "SEARCH" and index scans are fine
+    return [detail for detail in details if detail.startswith('SCAN') and 'USING' not in detail]
+
+
+def test_crud_queries_use_indexes(create_and_fill_database):
+    db = TestSessionLocal()
+    username, project_name = next(iter(database_filler.tasks))
+    with _capture_statements() as statements:
+        crud.get_user_by_username(db, username)
+        crud.get_user_by_email(db, f'{username}@gmail.com')
+        crud.get_users(db)
+        crud.get_users(db, after_username=username)
+        crud.get_projects(db, username)
+        crud.get_projects(db, username, ProjectVisibility.PUBLIC, limit=10, after_id=1)
+        project = crud.get_projects_by_owner_username_and_name(db, username, project_name)[0]
+        crud.get_project_by_id(db, project.id)
+        crud.get_project_by_id_and_owner_username(db, project.id, username, load_task_ids=True)
+        crud.get_tasks_by_owner_username(db, username)
+        crud.get_tasks_by_owner_username(db, username, ProjectVisibility.PRIVATE)
+        tasks = crud.get_tasks_by_project_id(db, project.id)
+        crud.get_tasks_by_project_id(db, project.id, ProjectVisibility.PRIVATE, limit=10, after_id=1)
+        crud.get_tasks_by_owner_username_and_project_id(db, username, project.id)
+        crud.get_tasks_by_owner_username_and_project_id(db, username, project.id,
+                                                        ProjectVisibility.PRIVATE)
+        crud.get_project_and_task(db, project.id, username, tasks[0].id)
+        crud.get_project_version(db, project.id, username)
+        crud.get_task_version(db, project.id, username, tasks[0].id)
+        crud.update_task_info(db, tasks[0].id, TaskUpdate(description='new description'))
+        crud.start_task(db, tasks[0].id)
+        crud.stop_task(db, tasks[0].id)
+        crud.delete_task(db, tasks[1].id)
+        crud.get_time_report(db, username)
+        crud.get_time_report(db, username, group_by=TimeReportGrouping.PROJECT)
+    db.close()
+
+    assert statements
+    for statement, parameters in statements:
+        assert _full_scans(statement, parameters) == [], statement
@@ -0,0 +1,51 @@
+import json
+import os
+
+from database import crud
+from rest.schemas import ProjectVisibility
+from utils.slow_queries import SlowQueryRecorder, parameter_shape
+
+from db import engine
+
+
+def test_slow_query_recorder(create_and_fill_database, db_session, tmp_path):
+    log_path = tmp_path / 'slow_queries.jsonl'
+    recorder = SlowQueryRecorder(threshold=0, log_path=str(log_path))
+    recorder.instrument(engine)
+    try:
+        crud.get_projects(db_session, 'username02', ProjectVisibility.PUBLIC)
+        crud.get_projects(db_session, 'username01', ProjectVisibility.PUBLIC)
+    finally:
+        recorder.remove(engine)
+    crud.get_projects(db_session, 'username01')
+
+    top = recorder.top()
+    projects_query = next(query for query in top if 'FROM projects' in query['statement'])
+    assert projects_query['crud_function'] == 'get_projects'
+    assert projects_query['count'] == 2
+    assert projects_query['parameters'] == ['str', 'str']
+    assert any('USING INDEX' in step for step in projects_query['plan'])
+    assert top == sorted(top, key=lambda query: query['total_ms'], reverse=True)
+
+    log_file = tmp_path / f'slow_queries.{os.getpid()}.jsonl'
+    assert recorder.log_file == str(log_file)
+    entries = [json.loads(line) for line in log_file.read_text().splitlines()]
+    assert len(entries) == sum(query['count'] for query in top)
+    assert {'duration_ms', 'statement', 'parameters', 'crud_function', 'plan'} <= set(entries[0])
+    assert 'username01' not in log_file.read_text()
+
+    # A forked worker writes its own file
+    pid = os.fork()
+    if pid == 0:
+        recorder.record(None, 'PRAGMA user_version', (), False, 1.0)
+        os._exit(0)
+    os.waitpid(pid, 0)
+    child_entries = (tmp_path / f'slow_queries.{pid}.jsonl').read_text().splitlines()
+    assert [json.loads(line)['statement'] for line in child_entries] == ['PRAGMA user_version']
+    assert len(log_file.read_text().splitlines()) == len(entries)
+
+
+def test_parameter_shape():
+    assert parameter_shape(('name', 1, None)) == ['str', 'int', 'NoneType']
+    assert parameter_shape(dict(name='name')) == dict(name='str')
+    assert parameter_shape([('name', 1), ('other', 2)], executemany=True) == dict(rows=2, row=['str', 'int'])
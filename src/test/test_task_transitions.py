@@ -0,0 +1,91 @@
+import threading
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from database import crud, models
+from database.db_init import Base
+from rest.schemas import ProjectCreate, ProjectVisibility, Role, TaskCreate, TaskTransitionResult, UserCreate
+
+
+def _run_concurrently(SessionLocal, fn, task_id, thread_count):
+    barrier = threading.Barrier(thread_count)
+    results = []
+
+    def worker():
+        with SessionLocal() as db:
+            barrier.wait()
+            results.append(fn(db, task_id))
+
+    threads = [threading.Thread(target=worker) for _ in range(thread_count)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+
+def test_concurrent_start_stop(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'database.db'}", connect_args={'timeout': 30})
+    Base.metadata.create_all(bind=engine)
+    SessionLocal = sessionmaker(bind=engine)
+    with SessionLocal() as db:
+        crud.create_user(db, UserCreate(username='user', email='user@example.com', bio='bio',
+                                        role=Role.BASIC, password='password'))
+        project = crud.create_project(db, 'user', ProjectCreate(name='project', description='description',
+                                                                visibility=ProjectVisibility.PUBLIC))
+        task_ids = crud.create_tasks(db, 'user', project.id, [TaskCreate(description='task')] * 20)
+
+    for task_id in task_ids:
+        results = _run_concurrently(SessionLocal, crud.start_task, task_id, 8)
+        assert sorted(results, key=lambda result: result.value) == \
+            [TaskTransitionResult.ALREADY_STARTED] * 7 + [TaskTransitionResult.STARTED]
+
+        results = _run_concurrently(SessionLocal, crud.stop_task, task_id, 8)
+        assert sorted(results, key=lambda result: result.value) == \
+            [TaskTransitionResult.ALREADY_STOPPED] * 7 + [TaskTransitionResult.STOPPED]
+
+    with SessionLocal() as db:
+        tasks = db.query(models.Task).all()
+        # Every task was started and stopped exactly once
+        assert {task.version for task in tasks} == {3}
+        tracked_seconds = sum(rollup.tracked_seconds for rollup in db.query(models.TimeRollup))
+        expected_seconds = sum((task.end_timestamp - task.start_timestamp).total_seconds() for task in tasks)
+        assert abs(tracked_seconds - expected_seconds) < 1e-3
+
+        assert crud.start_task(db, task_ids[0]) == TaskTransitionResult.ALREADY_STARTED
+        assert crud.stop_task(db, task_ids[0]) == TaskTransitionResult.ALREADY_STOPPED
+        assert crud.start_task(db, -1) == TaskTransitionResult.NOT_FOUND
+    engine.dispose()
+
+
+def test_stop_not_started(db_session):
+    crud.create_user(db_session, UserCreate(username='user', email='user@example.com', bio='bio',
+                                            role=Role.BASIC, password='password'))
+    project = crud.create_project(db_session, 'user', ProjectCreate(name='project', description='description',
+                                                                    visibility=ProjectVisibility.PUBLIC))
+    task = crud.create_task(db_session, 'user', project.id, TaskCreate(description='task'))
+    assert crud.stop_task(db_session, task.id) == TaskTransitionResult.NOT_STARTED
+    assert crud.start_task(db_session, task.id) == TaskTransitionResult.STARTED
+    assert crud.stop_task(db_session, task.id) == TaskTransitionResult.STOPPED
+
+
+def test_transition_access(db_session):
+    crud.create_user(db_session, UserCreate(username='user', email='user@example.com', bio='bio',
+                                            role=Role.BASIC, password='password'))
+    project = crud.create_project(db_session, 'user', ProjectCreate(name='project', description='description',
+                                                                    visibility=ProjectVisibility.PRIVATE))
+    other_project = crud.create_project(db_session, 'user', ProjectCreate(name='other', description='description',
+                                                                          visibility=ProjectVisibility.PUBLIC))
+    task = crud.create_task(db_session, 'user', project.id, TaskCreate(description='task'))
+
+    NOT_FOUND = TaskTransitionResult.NOT_FOUND
+    assert crud.start_task(db_session, task.id, other_project.id, 'user') == NOT_FOUND
+    assert crud.start_task(db_session, task.id, project.id, 'other_user') == NOT_FOUND
+    assert crud.start_task(db_session, task.id, project.id, 'user', include_private=False) == NOT_FOUND
+    assert crud.stop_task(db_session, task.id, project.id, 'user', include_private=False) == NOT_FOUND
+    assert db_session.get(models.Task, task.id).start_timestamp is None
+
+    assert crud.start_task(db_session, task.id, project.id, 'user') == TaskTransitionResult.STARTED
+    assert crud.start_task(db_session, task.id, project.id, 'user') == TaskTransitionResult.ALREADY_STARTED
+    assert crud.stop_task(db_session, task.id, project.id, 'user') == TaskTransitionResult.STOPPED
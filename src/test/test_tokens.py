@@ -0,0 +1,35 @@
+import time
+
+from utils.tokens import TokenEpochs, decode_token, issue_token
+
+
+def test_issue_and_decode():
+    token = issue_token('user', 'basic', 3)
+    claims = decode_token(token)
+    assert (claims.username, claims.role, claims.epoch) == ('user', 'basic', 3)
+    assert claims.expires_at > time.time()
+
+
+def test_invalid_tokens():
+    token = issue_token('user', 'basic', 0)
+    payload, signature = token.split('.')
+    other_payload = issue_token('admin', 'admin', 0).split('.')[0]
+
+    assert decode_token(f'{other_payload}.{signature}') is None
+    assert decode_token(payload) is None
+    assert decode_token('') is None
+    assert decode_token(f'{payload}.{signature[:-1]}\xe9') is None
+    assert decode_token('abc.d\xe9f') is None
+    assert decode_token(issue_token('user', 'basic', 0, ttl=-1)) is None
+
+
+def test_token_epochs():
+    epochs = TokenEpochs(ttl=0.01)
+    assert epochs.get('user') is None
+    epochs.set('user', 1)
+    assert epochs.get('user') == 1
+    # Epoch read before a bump doesn't replace the bumped one
+    epochs.set('user', 0)
+    assert epochs.get('user') == 1
+    time.sleep(0.02)
+    assert epochs.get('user') is None
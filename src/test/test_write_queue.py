@@ -0,0 +1,131 @@
+import asyncio
+
+import pytest
+import sqlalchemy.exc
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from benchmarks import group_commit
+from database import async_crud, crud, models
+from database.db_init import Base
+from database.write_queue import WriteQueue, write_queue
+from rest.schemas import (ProjectCreate, ProjectVisibility, Role, TaskCreate, TaskTransitionResult, UserCreate,
+                          UserUpdateRole)
+from utils.principal_cache import principal_cache
+from utils.tokens import token_epochs
+
+
+def _user(username):
+    return UserCreate(username=username, email=f'{username}@example.com', bio='bio',
+                      role=Role.BASIC, password='password')
+
+
+@pytest.fixture()
+def file_engine(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'database.db'}", connect_args={'timeout': 30})
+    Base.metadata.create_all(bind=engine)
+    with sessionmaker(bind=engine)() as db:
+        crud.create_user(db, _user('user'))
+        crud.create_project(db, 'user', ProjectCreate(name='project', description='description',
+                                                      visibility=ProjectVisibility.PUBLIC))
+    yield engine
+    engine.dispose()
+
+
+def test_group_commit(file_engine):
+    queue = WriteQueue(max_batch=16, max_delay=0.05)
+    queue.bind(file_engine)
+    futures = [queue.submit(crud.create_task, 'user', 1, TaskCreate(description=f'task {index}'))
+               for index in range(40)]
+    tasks = [future.result() for future in futures]
+    queue.stop()
+
+    assert [task.description for task in tasks] == [f'task {index}' for index in range(40)]
+    assert len({task.id for task in tasks}) == 40
+    stats = queue.stats()
+    assert stats['operations'] == 40
+    assert 3 <= stats['batches'] < 40
+    assert stats['largest_batch'] == 16
+    with sessionmaker(bind=file_engine)() as db:
+        assert db.query(models.Task).count() == 40
+        assert db.get(models.Project, 1).version == 41
+
+
+def test_failed_operation_is_isolated(file_engine):
+    def fail_after_write(db):
+        db.add(models.Task(description='rolled back', owner_username='user', project_id=1))
+        db.flush()
+        raise ValueError('failed')
+
+    queue = WriteQueue(max_batch=16, max_delay=0.05)
+    queue.bind(file_engine)
+    futures = [queue.submit(crud.create_task, 'user', 1, TaskCreate(description='first')),
+               queue.submit(fail_after_write),
+               queue.submit(crud.create_user, _user('user')),
+               queue.submit(crud.start_task, 1),
+               queue.submit(crud.create_task, 'user', 1, TaskCreate(description='last'))]
+
+    assert futures[0].result().description == 'first'
+    with pytest.raises(ValueError):
+        futures[1].result()
+    with pytest.raises(sqlalchemy.exc.IntegrityError):
+        futures[2].result()
+    assert futures[3].result() == TaskTransitionResult.STARTED
+    assert futures[4].result().description == 'last'
+    queue.stop()
+    assert queue.stats()['batches'] == 1
+
+    with sessionmaker(bind=file_engine)() as db:
+        # Task of the failed operation was flushed but rolled back with its savepoint
+        assert [task.description for task in db.query(models.Task).order_by(models.Task.id)] == ['first', 'last']
+        assert db.get(models.Task, 1).start_timestamp is not None
+
+
+def test_async_crud_uses_write_queue(file_engine):
+    async def start_and_stop(task_id):
+        return await asyncio.gather(async_crud.start_task(None, task_id), async_crud.stop_task(None, task_id))
+
+    write_queue.bind(file_engine)
+    try:
+        with sessionmaker(bind=file_engine)() as db:
+            task_id = crud.create_task(db, 'user', 1, TaskCreate(description='task')).id
+        assert asyncio.run(start_and_stop(task_id)) == [TaskTransitionResult.STARTED, TaskTransitionResult.STOPPED]
+        assert asyncio.run(async_crud.delete_task(None, task_id))
+    finally:
+        write_queue.bind(None)
+
+    with sessionmaker(bind=file_engine)() as db:
+        assert db.query(models.Task).count() == 0
+
+
+def test_caches_invalidated_after_batch_commit(file_engine):
+    def cached_during_batch(db):
+        return principal_cache.get('user', 'digest'), token_epochs.get('user')
+
+    principal_cache.put('user', 'digest', 'principal')
+    token_epochs.set('user', 0)
+    queue = WriteQueue(max_batch=16, max_delay=0.05)
+    queue.bind(file_engine)
+    try:
+        futures = [queue.submit(crud.update_user_role, 'user', UserUpdateRole(role=Role.ADMIN)),
+                   queue.submit(cached_during_batch)]
+        assert futures[0].result().token_epoch == 1
+        # db.commit() of the role update only released its savepoint, caches wait for the real COMMIT
+        assert futures[1].result() == ('principal', 0)
+        assert queue.stats()['batches'] == 1
+    finally:
+        queue.stop()
+    assert principal_cache.get('user', 'digest') is None
+    assert token_epochs.get('user') == 1
+    token_epochs.clear()
+
+
+def test_group_commit_benchmark(tmp_path):
+    results = group_commit.run(str(tmp_path / 'group_commit.db'), [4], operation_count=60)
+    for mode in group_commit.modes:
+        result = results['levels']['4'][mode]
+        assert result['operations'] == 60
+        assert result['errors'] == {}
+    assert results['levels']['4']['group-commit']['batches'] <= 60
+    assert not write_queue.enabled
@@ -1,5 +1,5 @@
-from database import database_filler
-from database.db_init import SessionLocal, Base, engine, get_db_path
+from database import database_filler, migrations
+from database.db_init import SessionLocal, engine, get_db_path
 
 import os
 
@@ -11,7 +11,7 @@ if os.path.exists(db_path):
 
 session = SessionLocal()
 
-Base.metadata.create_all(bind=engine)
+migrations.upgrade(engine)
 
 database_filler.run(session)
 
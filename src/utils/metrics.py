@@ -0,0 +1,176 @@
+""" Per-route request metrics in Prometheus text format.
+
+`MetricsMiddleware` times every HTTP request and attributes it to the route template matched by
+the router. SQLAlchemy cursor events of instrumented engines count statements and time spent in
+the database for the request running in the current context, sync endpoints see the same
+context in their worker thread.
+
+Collection is a few perf_counter calls and one locked update per request, it is meant to stay
+enabled in production.
+"""
+
+import bisect
+import contextvars
+import threading
+import time
+
+from collections import defaultdict
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+
+latency_buckets = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+statement_buckets = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+
+
+class RequestStats:
+    __slots__ = ('statements', 'db_time')
+
+    def __init__(self):
+        self.statements = 0
+        self.db_time = 0.0
+
+
+_current_request: contextvars.ContextVar[Optional[RequestStats]] = \
+    contextvars.ContextVar('current_request', default=None)
+
+
+class Histogram:
+    __slots__ = ('bounds', 'counts', 'sum')
+
+    def __init__(self, bounds: Sequence[float]):
+        self.bounds = bounds
+        # Last count is for observations above the largest bound
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.sum += value
+
+
+class RouteMetrics:
+    __slots__ = ('statuses', 'latency', 'statements', 'db_time')
+
+    def __init__(self):
+        self.statuses: Dict[int, int] = defaultdict(int)
+        self.latency = Histogram(latency_buckets)
+        self.statements = Histogram(statement_buckets)
+        self.db_time = 0.0
+
+
+class Metrics:
+    def __init__(self):
+        self._routes: Dict[Tuple[str, str], RouteMetrics] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, method: str, route: str, status_code: int, duration: float, stats: RequestStats):
+        with self._lock:
+            metrics = self._routes.get((method, route))
+            if metrics is None:
+                metrics = self._routes[(method, route)] = RouteMetrics()
+            metrics.statuses[status_code] += 1
+            metrics.latency.observe(duration)
+            metrics.statements.observe(stats.statements)
+            metrics.db_time += stats.db_time
+
+    def clear(self):
+        with self._lock:
+            self._routes.clear()
+
+    def render(self, gauges: Optional[Dict[str, float]] = None) -> str:
+        """ Renders all metrics and the given extra gauges in Prometheus text format. """
+        with self._lock:
+            routes = sorted(self._routes.items())
+            lines = ['# HELP tasker_http_requests_total HTTP requests by route template and status code.',
+                     '# TYPE tasker_http_requests_total counter']
+            for (method, route), metrics in routes:
+                for status_code, count in sorted(metrics.statuses.items()):
+                    lines.append(f'tasker_http_requests_total{{method="{method}",route="{route}",'
+                                 f'status="{status_code}"}} {count}')
+            _render_histogram(lines, 'tasker_http_request_duration_seconds',
+                              'HTTP request latency by route template.',
+                              [(key, metrics.latency) for key, metrics in routes])
+            _render_histogram(lines, 'tasker_http_request_sql_statements',
+                              'SQL statements executed per HTTP request by route template.',
+                              [(key, metrics.statements) for key, metrics in routes])
+            lines += ['# HELP tasker_http_request_db_seconds_total Time spent executing SQL by route template.',
+                      '# TYPE tasker_http_request_db_seconds_total counter']
+            for (method, route), metrics in routes:
+                lines.append(f'tasker_http_request_db_seconds_total{{method="{method}",route="{route}"}} '
+                             f'{metrics.db_time}')
+        for name, value in (gauges or {}).items():
+            lines += [f'# TYPE {name} gauge', f'{name} {value}']
+        return '\n'.join(lines) + '\n'
+
+
+def _render_histogram(lines: List[str], name: str, description: str,
+                      histograms: List[Tuple[Tuple[str, str], Histogram]]):
+    lines += [f'# HELP {name} {description}', f'# TYPE {name} histogram']
+    for (method, route), histogram in histograms:
+        labels = f'method="{method}",route="{route}"'
+        cumulative = 0
+        for bound, count in zip(histogram.bounds, histogram.counts):
+            cumulative += count
+            lines.append(f'{name}_bucket{{{labels},le="{bound}"}} {cumulative}')
+        cumulative += histogram.counts[-1]
+        lines.append(f'{name}_bucket{{{labels},le="+Inf"}} {cumulative}')
+        lines.append(f'{name}_sum{{{labels}}} {histogram.sum}')
+        lines.append(f'{name}_count{{{labels}}} {cumulative}')
+
+
+metrics = Metrics()
+
+
+class MetricsMiddleware:
+    """ ASGI middleware recording `metrics` of every HTTP request. """
+
+    def __init__(self, app, registry: Metrics = metrics):
+        self.app = app
+        self.registry = registry
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            return await self.app(scope, receive, send)
+
+        stats = RequestStats()
+        token = _current_request.set(stats)
+        status_code = 500
+        start = time.perf_counter()
+
+        async def send_with_status(message):
+            nonlocal status_code
+            if message['type'] == 'http.response.start':
+                status_code = message['status']
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            duration = time.perf_counter() - start
+            _current_request.reset(token)
+            # The router stores the matched route in the scope
+            route = scope.get('route')
+            self.registry.observe(scope['method'], route.path if route is not None else 'unmatched',
+                                  status_code, duration, stats)
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if _current_request.get() is not None:
+        conn.info['query_start'] = time.perf_counter()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    stats = _current_request.get()
+    if stats is not None:
+        stats.statements += 1
+        stats.db_time += time.perf_counter() - conn.info['query_start']
+
+
+def instrument_engine(engine: Engine):
+    """ Attributes statements executed on `engine` to the current request. """
+    if not event.contains(engine, 'before_cursor_execute', _before_cursor_execute):
+        event.listen(engine, 'before_cursor_execute', _before_cursor_execute)
+        event.listen(engine, 'after_cursor_execute', _after_cursor_execute)
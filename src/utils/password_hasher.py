@@ -1,5 +1,188 @@
+""" Password hashing with PHC-style encoded hashes.
+
+Hashes are stored as `$<id>$<params>$<salt>$<hash>` (salt and hash in unpadded base64) so
+hashes of several algorithms and cost settings can coexist. New hashes use the configured
+algorithm, hashes of any registered algorithm verify, and `needs_rehash` tells whether a
+stored hash should be replaced after the next successful verification.
+
+Hashes created before the PHC format are bare hex SHA-256 digests without salt and are only
+accepted for verification.
+"""
+
+import asyncio
+import base64
 import hashlib
+import hmac
+import os
+import threading
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from utils.settings import settings
+
+
+def _b64encode(data: bytes) -> str:
+    return base64.b64encode(data).decode().rstrip('=')
+
+
+def _b64decode(data: str) -> bytes:
+    return base64.b64decode(data + '=' * (-len(data) % 4))
+
+
+def _encode(hasher_id: str, params: Dict[str, int], salt: bytes, digest: bytes) -> str:
+    encoded_params = ','.join(f'{name}={value}' for name, value in params.items())
+    return f'${hasher_id}${encoded_params}${_b64encode(salt)}${_b64encode(digest)}'
+
+
+def _decode(encoded: str) -> Tuple[str, Dict[str, int], bytes, bytes]:
+    _, hasher_id, encoded_params, salt, digest = encoded.split('$')
+    params = {name: int(value) for name, value in
+              (param.split('=') for param in encoded_params.split(',') if param)}
+    return hasher_id, params, _b64decode(salt), _b64decode(digest)
+
+
+class Hasher:
+    id: str
+
+    def params(self) -> Dict[str, int]:
+        raise NotImplementedError
+
+    def derive(self, password: str, salt: bytes, params: Dict[str, int]) -> bytes:
+        raise NotImplementedError
+
+    def hash(self, password: str) -> str:
+        params = self.params()
+        salt = os.urandom(16)
+        return _encode(self.id, params, salt, self.derive(password, salt, params))
+
+    def verify(self, password: str, encoded: str) -> bool:
+        _, params, salt, digest = _decode(encoded)
+        return hmac.compare_digest(self.derive(password, salt, params), digest)
+
+
+class Scrypt(Hasher):
+    id = 'scrypt'
+
+    def __init__(self, ln: int = 14, r: int = 8, p: int = 1):
+        self.ln = ln
+        self.r = r
+        self.p = p
+
+    def params(self) -> Dict[str, int]:
+        return dict(ln=self.ln, r=self.r, p=self.p)
+
+    def derive(self, password: str, salt: bytes, params: Dict[str, int]) -> bytes:
+        n = 1 << params['ln']
+        return hashlib.scrypt(password.encode(), salt=salt, n=n, r=params['r'], p=params['p'],
+                              maxmem=256 * n * params['r'], dklen=32)
+
+
+class Pbkdf2Sha256(Hasher):
+    id = 'pbkdf2-sha256'
+
+    def __init__(self, i: int = 600000):
+        self.i = i
+
+    def params(self) -> Dict[str, int]:
+        return dict(i=self.i)
+
+    def derive(self, password: str, salt: bytes, params: Dict[str, int]) -> bytes:
+        return hashlib.pbkdf2_hmac('sha256', password.encode(), salt, params['i'])
+
+
+class LegacySha256(Hasher):
+    """ Unsalted hex SHA-256 digests of the first releases, verification only. """
+    id = 'sha256'
+
+    def hash(self, password: str) -> str:
+        raise ValueError('Legacy SHA-256 hashes can no longer be created')
+
+    def verify(self, password: str, encoded: str) -> bool:
+        return hmac.compare_digest(hashlib.sha256(password.encode()).hexdigest(), encoded)
+
+
+hashers: Dict[str, Hasher] = {
+    Scrypt.id: Scrypt(ln=settings.password_scrypt_ln),
+    Pbkdf2Sha256.id: Pbkdf2Sha256(i=settings.password_pbkdf2_iterations),
+    LegacySha256.id: LegacySha256(),
+}
+
+
+def identify(encoded: str) -> Hasher:
+    if not encoded.startswith('$'):
+        return hashers[LegacySha256.id]
+    return hashers[encoded.split('$')[1]]
+
+
+def hash_password(password: str) -> str:
+    return hashers[settings.password_hash_algorithm].hash(password)
+
+
+def verify_password(password: str, encoded: Optional[str]) -> bool:
+    """ False also for users without a password hash and for hashes that can't be parsed. """
+    if encoded is None:
+        return False
+    try:
+        return identify(encoded).verify(password, encoded)
+    except (KeyError, ValueError, TypeError):
+        return False
+
+
+def needs_rehash(encoded: str) -> bool:
+    """ Whether a verified hash differs from what `hash_password` would create now. """
+    hasher = hashers[settings.password_hash_algorithm]
+    if not encoded.startswith(f'${hasher.id}$'):
+        return True
+    return _decode(encoded)[1] != hasher.params()
+
+
+class HashingPool:
+    """ Bounded thread pool for password hashing off the event loop.
+
+    At most `max_workers` hashes are computed at once, hashlib releases the GIL while deriving
+    keys so they run in parallel. Further calls queue up in the pool, `stats` reports the queue
+    length and how long calls waited for a worker.
+    """
+
+    def __init__(self, max_workers: int):
+        self.max_workers = max_workers
+        self.queued = 0
+        self.max_queued = 0
+        self.active = 0
+        self.completed = 0
+        self.total_wait = 0.0
+        self._executor = ThreadPoolExecutor(max_workers, thread_name_prefix='password-hasher')
+        self._lock = threading.Lock()
+
+    async def run(self, fn: Callable[..., Any], *args) -> Any:
+        with self._lock:
+            self.queued += 1
+            self.max_queued = max(self.max_queued, self.queued)
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, self._call, time.monotonic(), fn, args)
+
+    def _call(self, submitted_at: float, fn: Callable[..., Any], args) -> Any:
+        with self._lock:
+            self.queued -= 1
+            self.active += 1
+            self.total_wait += time.monotonic() - submitted_at
+        try:
+            return fn(*args)
+        finally:
+            with self._lock:
+                self.active -= 1
+                self.completed += 1
+
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            return dict(max_workers=self.max_workers,
+                        queued=self.queued,
+                        max_queued=self.max_queued,
+                        active=self.active,
+                        completed=self.completed,
+                        total_wait=self.total_wait)
 
 
-def hash_password(password: str):
-    return hashlib.sha256(password.encode()).hexdigest()
+hashing_pool = HashingPool(settings.password_hash_workers)
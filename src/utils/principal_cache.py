@@ -0,0 +1,124 @@
+import hashlib
+import hmac
+import os
+import threading
+import time
+
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, Optional, Set, Tuple
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from utils.settings import settings
+
+
+# Per-process key so cached credential digests are useless outside this process.
+_digest_key = os.urandom(32)
+
+
+def credential_digest(password: str) -> str:
+    return hmac.new(_digest_key, password.encode(), hashlib.sha256).hexdigest()
+
+
+class PrincipalCache:
+    """ Bounded TTL/LRU cache of authenticated principals.
+
+    Entries are keyed by (username, credential digest) so a changed or wrong password never
+    hits an entry created for another one. Entries of a user can be dropped explicitly with
+    `invalidate` whenever their data changes, crud functions do it through `invalidate_on_commit`.
+    A principal loaded before an invalidation is not stored after it, see `generation`.
+    """
+
+    def __init__(self, maxsize: int = 1024, ttl: float = 60.0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries: OrderedDict[Tuple[str, str], Tuple[float, Any]] = OrderedDict()
+        self._keys_by_username: Dict[str, Set[Tuple[str, str]]] = {}
+        self._generations: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def generation(self, username: str) -> int:
+        """ Taken before loading the user, `put` ignores principals of an older generation. """
+        with self._lock:
+            return self._generations.get(username, 0)
+
+    def get(self, username: str, digest: str) -> Optional[Any]:
+        key = (username, digest)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            expires_at, principal = entry
+            if expires_at < time.monotonic():
+                self._remove(key)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return principal
+
+    def put(self, username: str, digest: str, principal: Any, generation: Optional[int] = None):
+        key = (username, digest)
+        with self._lock:
+            if generation is not None and self._generations.get(username, 0) != generation:
+                return
+            self._entries[key] = (time.monotonic() + self.ttl, principal)
+            self._entries.move_to_end(key)
+            self._keys_by_username.setdefault(username, set()).add(key)
+            while len(self._entries) > self.maxsize:
+                oldest_key = next(iter(self._entries))
+                self._remove(oldest_key)
+
+    def invalidate(self, username: str):
+        with self._lock:
+            self._generations[username] = self._generations.get(username, 0) + 1
+            for key in self._keys_by_username.pop(username, set()):
+                self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._keys_by_username.clear()
+            self._generations.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return dict(hits=self.hits, misses=self.misses, size=len(self._entries))
+
+    def _remove(self, key: Hashable):
+        self._entries.pop(key, None)
+        username = key[0]
+        keys = self._keys_by_username.get(username)
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self._keys_by_username[username]
+
+
+principal_cache = PrincipalCache(settings.principal_cache_size, settings.principal_cache_ttl)
+
+
+def invalidate_on_commit(db: Session, username: str):
+    """ Invalidates cached principals of `username` once `db` commits. """
+    db.info.setdefault('changed_principals', set()).add(username)
+
+
+@event.listens_for(Session, 'after_commit')
+def _after_commit(db: Session):
+    # Also fired when a savepoint is released, e.g. by an operation of the write queue
+    if db.in_nested_transaction():
+        return
+    for username in db.info.pop('changed_principals', ()):
+        principal_cache.invalidate(username)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _after_rollback(db: Session):
+    if not db.in_nested_transaction():
+        db.info.pop('changed_principals', None)
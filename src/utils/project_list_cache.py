@@ -0,0 +1,128 @@
+""" Read-through cache of serialized public project listings per owner.
+
+Entries are keyed by (owner username, page key) and hold the encoded response body. Crud
+functions mark owners of changed projects on the session, their entries are dropped once that
+session commits, so a listing read before the commit can not be cached after it either: every
+owner has a generation which is bumped on invalidation and a listing built under an older
+generation is returned but not stored.
+
+Concurrent misses of one key wait for a single build instead of all querying the database.
+"""
+
+import asyncio
+import threading
+import time
+
+from collections import OrderedDict
+from typing import Awaitable, Callable, Dict, Hashable, Iterable, Set, Tuple
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from utils.settings import settings
+
+
+class ProjectListCache:
+    def __init__(self, maxsize: int = 1024, ttl: float = 30.0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries: OrderedDict[Tuple[str, Hashable], Tuple[float, bytes]] = OrderedDict()
+        self._keys_by_owner: Dict[str, Set[Tuple[str, Hashable]]] = {}
+        self._generations: Dict[str, int] = {}
+        self._builds: Dict[Tuple[str, Hashable], asyncio.Future] = {}
+        self._lock = threading.Lock()
+
+    async def get_or_build(self, owner: str, key: Hashable,
+                           build: Callable[[], Awaitable[bytes]]) -> bytes:
+        cache_key = (owner, key)
+        with self._lock:
+            entry = self._entries.get(cache_key)
+            if entry is not None and entry[0] >= time.monotonic():
+                self._entries.move_to_end(cache_key)
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+            pending = self._builds.get(cache_key)
+            if pending is None or pending.get_loop() is not asyncio.get_running_loop():
+                pending = None
+                self._builds[cache_key] = asyncio.get_running_loop().create_future()
+            generation = self._generations.get(owner, 0)
+
+        if pending is not None:
+            return await asyncio.shield(pending)
+
+        future = self._builds[cache_key]
+        try:
+            body = await build()
+        except BaseException as e:
+            with self._lock:
+                self._builds.pop(cache_key, None)
+            future.set_exception(e)
+            # Nobody else may be waiting for the future
+            future.exception()
+            raise
+        with self._lock:
+            self._builds.pop(cache_key, None)
+            if self._generations.get(owner, 0) == generation:
+                self._put(cache_key, body)
+        future.set_result(body)
+        return body
+
+    def _put(self, cache_key: Tuple[str, Hashable], body: bytes):
+        self._entries[cache_key] = (time.monotonic() + self.ttl, body)
+        self._entries.move_to_end(cache_key)
+        self._keys_by_owner.setdefault(cache_key[0], set()).add(cache_key)
+        while len(self._entries) > self.maxsize:
+            self._remove(next(iter(self._entries)))
+
+    def _remove(self, cache_key: Tuple[str, Hashable]):
+        self._entries.pop(cache_key, None)
+        keys = self._keys_by_owner.get(cache_key[0])
+        if keys is not None:
+            keys.discard(cache_key)
+            if not keys:
+                del self._keys_by_owner[cache_key[0]]
+
+    def invalidate(self, owners: Iterable[str]):
+        with self._lock:
+            for owner in owners:
+                self._generations[owner] = self._generations.get(owner, 0) + 1
+                for cache_key in self._keys_by_owner.pop(owner, set()):
+                    self._entries.pop(cache_key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._keys_by_owner.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return dict(hits=self.hits, misses=self.misses, size=len(self._entries))
+
+
+project_list_cache = ProjectListCache(settings.project_list_cache_size, settings.project_list_cache_ttl)
+
+
+def mark_changed(db: Session, owners: Iterable[str]):
+    """ Invalidates listings of the owners once `db` commits. """
+    db.info.setdefault('changed_project_owners', set()).update(owners)
+
+
+@event.listens_for(Session, 'after_commit')
+def _after_commit(db: Session):
+    # Also fired when a savepoint is released, e.g. by an operation of the write queue
+    if db.in_nested_transaction():
+        return
+    owners = db.info.pop('changed_project_owners', None)
+    if owners:
+        project_list_cache.invalidate(owners)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _after_rollback(db: Session):
+    if not db.in_nested_transaction():
+        db.info.pop('changed_project_owners', None)
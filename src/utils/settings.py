@@ -0,0 +1,85 @@
+from pydantic_settings import BaseSettings, SettingsConfigDict
+
+from typing import Literal, Optional
+
+
+class Settings(BaseSettings):
+    model_config = SettingsConfigDict(env_prefix='tasker_')
+
+    # Engine profile, explicitly set db_* values override values of the profile
+    db_profile: Literal['default', 'production'] = 'default'
+    db_journal_mode: Optional[str] = None
+    db_synchronous: Optional[str] = None
+    db_busy_timeout: Optional[int] = None  # ms
+    db_cache_size: Optional[int] = None  # pages, negative values are KiB
+    db_mmap_size: Optional[int] = None  # bytes
+    db_pool_size: Optional[int] = None
+    db_max_overflow: Optional[int] = None
+    db_pool_timeout: Optional[float] = None  # s
+    # Pool of read-only connections used by GET routes, the db_pool_* values apply if not set
+    db_read_pool_size: Optional[int] = None
+    db_read_max_overflow: Optional[int] = None
+    db_read_pool_timeout: Optional[float] = None  # s
+
+    # Serve requests through AsyncSession on the aiosqlite driver instead of sync sessions
+    async_database: bool = False
+
+    # Run mutations on a single writer which group commits them, see database.write_queue
+    write_queue_enabled: bool = False
+    write_queue_max_batch: int = 64  # operations per transaction
+    write_queue_max_delay: float = 2.0  # ms a batch waits for more operations
+
+    default_page_size: int = 50
+    max_page_size: int = 100
+    max_bulk_size: int = 1000
+    export_batch_size: int = 1000
+
+    # Algorithm of new password hashes, stored hashes of other algorithms are upgraded on login
+    password_hash_algorithm: Literal['scrypt', 'pbkdf2-sha256'] = 'scrypt'
+    password_scrypt_ln: int = 14  # log2 of the scrypt cost
+    password_pbkdf2_iterations: int = 600000
+    password_hash_workers: int = 4
+
+    # Cache of authenticated Basic credentials
+    principal_cache_size: int = 1024
+    principal_cache_ttl: float = 60.0  # s
+
+    # Signing key of bearer tokens, random per process (per launcher with workers) if not set
+    token_secret: Optional[str] = None
+    token_ttl: int = 900  # s
+    token_epoch_ttl: float = 30.0  # s, how long revocation epochs of users are cached
+
+    # Cache of public project listings per owner, disabled with size 0
+    project_list_cache_size: int = 1024
+    project_list_cache_ttl: float = 30.0  # s
+
+    # Per-route request and SQL metrics served at /api/metrics
+    metrics_enabled: bool = True
+
+    # Statements slower than the threshold (ms) are recorded with their plans, disabled if not set
+    slow_query_threshold: Optional[float] = None
+    # One file per process with the pid in its name, relative paths are next to the database file
+    slow_query_log_path: Optional[str] = 'slow_queries.jsonl'
+    slow_query_log_max_bytes: int = 10 * 1024 * 1024
+    slow_query_log_backups: int = 3
+
+    # Launcher of pre-forked server workers, see rest.launcher
+    server_host: str = '0.0.0.0'
+    server_port: int = 8000
+    server_workers: Optional[int] = None  # number of CPUs if not set
+    server_backlog: int = 2048
+    server_keep_alive: int = 5  # s
+    server_loop: Literal['auto', 'asyncio', 'uvloop'] = 'auto'
+    server_http: Literal['auto', 'h11', 'httptools'] = 'auto'
+    server_limit_concurrency: Optional[int] = None  # connections per worker, 503 above
+    server_max_requests: Optional[int] = None  # requests after which a worker is replaced
+    server_graceful_timeout: int = 30  # s in-flight requests get on shutdown and restart
+    server_health_interval: float = 5.0  # s between health reports of workers
+    server_health_timeout: float = 30.0  # s without a report after which a worker is replaced
+    server_status_path: Optional[str] = None  # JSON file with the health of all workers
+    # s, with several workers caps the TTLs of the principal, token epoch and project list caches.
+    # They are per process, a change reaches the caches of other workers only once entries expire.
+    server_worker_cache_ttl: float = 1.0
+
+
+settings = Settings()
@@ -0,0 +1,166 @@
+""" Opt-in recorder of slow SQL statements.
+
+Statements of instrumented engines taking at least `threshold` ms are recorded with their
+parameter shapes (types only, never values), duration and the crud function which issued them.
+The plan of every distinct slow statement is captured once with EXPLAIN QUERY PLAN.
+
+Every occurrence is appended to a rotating JSONL file, aggregates per statement are kept in
+memory for the top offenders listing. Each process writes its own file with its pid in the name
+(`slow_queries.<pid>.jsonl`), launcher workers rotating one shared file would lose records.
+Relative paths are taken from the directory of the database file.
+"""
+
+import json
+import logging
+import logging.handlers
+import os
+import sys
+import threading
+import time
+
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from utils.settings import settings
+
+
+_crud_modules = {'database.crud'}
+# Where database.db_init puts the database file
+_database_directory = Path(__file__).resolve().parent.parent.parent
+
+
+def parameter_shape(parameters: Any, executemany: bool = False) -> Any:
+    """ Types of statement parameters, for executemany of the first row with the row count. """
+    if executemany:
+        rows = list(parameters)
+        return dict(rows=len(rows), row=parameter_shape(rows[0]) if rows else None)
+    if isinstance(parameters, dict):
+        return {name: type(value).__name__ for name, value in parameters.items()}
+    return [type(value).__name__ for value in parameters or ()]
+
+
+def calling_crud_function() -> Optional[str]:
+    frame = sys._getframe(1)
+    while frame is not None:
+        if frame.f_globals.get('__name__') in _crud_modules:
+            return frame.f_code.co_name
+        frame = frame.f_back
+    return None
+
+
+class SlowQueryRecorder:
+    def __init__(self, threshold: float, log_path: Optional[str] = None,
+                 max_bytes: int = 10 * 1024 * 1024, backup_count: int = 3, max_statements: int = 1000):
+        self.threshold = threshold
+        self.max_statements = max_statements
+        self.log_path = str(_database_directory / log_path) if log_path is not None else None
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+        self._statements: Dict[str, Dict[str, Any]] = {}
+        self._lock = threading.Lock()
+        self._logger = None
+        self._logger_pid = None
+
+    @property
+    def log_file(self) -> Optional[str]:
+        """ File of the current process, `log_path` with the pid before the extension. """
+        if self.log_path is None:
+            return None
+        base, extension = os.path.splitext(self.log_path)
+        return f'{base}.{os.getpid()}{extension}'
+
+    def _get_logger(self) -> Optional[logging.Logger]:
+        # Created in the process which writes, a forked worker gets its own file
+        if self.log_path is None:
+            return None
+        with self._lock:
+            if self._logger_pid != os.getpid():
+                handler = logging.handlers.RotatingFileHandler(self.log_file, maxBytes=self.max_bytes,
+                                                               backupCount=self.backup_count, delay=True)
+                handler.setFormatter(logging.Formatter('%(message)s'))
+                self._logger = logging.getLogger(f'{__name__}.{id(self)}.{os.getpid()}')
+                self._logger.propagate = False
+                self._logger.setLevel(logging.INFO)
+                self._logger.addHandler(handler)
+                self._logger_pid = os.getpid()
+            return self._logger
+
+    def instrument(self, engine: Engine):
+        if not event.contains(engine, 'before_cursor_execute', self._before_cursor_execute):
+            event.listen(engine, 'before_cursor_execute', self._before_cursor_execute)
+            event.listen(engine, 'after_cursor_execute', self._after_cursor_execute)
+
+    def remove(self, engine: Engine):
+        if event.contains(engine, 'before_cursor_execute', self._before_cursor_execute):
+            event.remove(engine, 'before_cursor_execute', self._before_cursor_execute)
+            event.remove(engine, 'after_cursor_execute', self._after_cursor_execute)
+
+    def _before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        conn.info['slow_query_start'] = time.perf_counter()
+
+    def _after_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        duration = (time.perf_counter() - conn.info['slow_query_start']) * 1000
+        if duration >= self.threshold:
+            self.record(conn.connection.dbapi_connection, statement, parameters, executemany, duration)
+
+    def record(self, dbapi_connection, statement: str, parameters: Any, executemany: bool, duration: float):
+        shape = parameter_shape(parameters, executemany)
+        crud_function = calling_crud_function()
+        with self._lock:
+            aggregate = self._statements.get(statement)
+        if aggregate is None:
+            plan = self._explain(dbapi_connection, statement, list(parameters)[0] if executemany else parameters)
+            aggregate = dict(statement=statement, crud_function=crud_function, plan=plan,
+                             count=0, total_ms=0.0, max_ms=0.0)
+
+        with self._lock:
+            if statement not in self._statements and len(self._statements) < self.max_statements:
+                self._statements[statement] = aggregate
+            aggregate = self._statements.get(statement, aggregate)
+            aggregate['count'] += 1
+            aggregate['total_ms'] += duration
+            aggregate['max_ms'] = max(aggregate['max_ms'], duration)
+            aggregate['parameters'] = shape
+
+        logger = self._get_logger()
+        if logger is not None:
+            logger.info(json.dumps(dict(timestamp=time.time(),
+                                   duration_ms=duration,
+                                   statement=statement,
+                                   parameters=shape,
+                                   crud_function=crud_function,
+                                   plan=aggregate['plan'])))
+
+    @staticmethod
+    def _explain(dbapi_connection, statement: str, parameters: Any) -> Optional[List[str]]:
+        if not statement.lstrip().upper().startswith(('SELECT', 'WITH', 'INSERT', 'UPDATE', 'DELETE')):
+            return None
+        # Separate cursor so unfetched rows of the slow statement are kept, raw DBAPI one so the
+        # EXPLAIN does not go through engine events
+        explain_cursor = dbapi_connection.cursor()
+        try:
+            explain_cursor.execute(f'EXPLAIN QUERY PLAN {statement}', parameters)
+            return [row[-1] for row in explain_cursor.fetchall()]
+        except Exception as e:
+            return [f'EXPLAIN failed: {e}']
+        finally:
+            explain_cursor.close()
+
+    def top(self, limit: int = 20) -> List[Dict[str, Any]]:
+        """ Recorded statements by total time spent in them. """
+        with self._lock:
+            statements = [dict(aggregate) for aggregate in self._statements.values()]
+        return sorted(statements, key=lambda aggregate: aggregate['total_ms'], reverse=True)[:limit]
+
+    def clear(self):
+        with self._lock:
+            self._statements.clear()
+
+
+slow_query_recorder = SlowQueryRecorder(settings.slow_query_threshold or 0.0,
+                                        settings.slow_query_log_path,
+                                        settings.slow_query_log_max_bytes,
+                                        settings.slow_query_log_backups)
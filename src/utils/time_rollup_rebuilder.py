@@ -0,0 +1,10 @@
+from database.db_init import SessionLocal
+from database import crud
+
+
+session = SessionLocal()
+
+rollup_count = crud.rebuild_time_rollups(session)
+print(f'Rebuilt {rollup_count} time rollups')
+
+session.close()
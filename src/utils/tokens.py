@@ -0,0 +1,129 @@
+""" Stateless HMAC-signed bearer tokens.
+
+A token is `<payload>.<signature>`, both unpadded urlsafe base64. The payload is JSON with the
+username, role, revocation epoch of the user and expiry time. Tokens are verified in memory,
+only the epoch of a user is looked up and it is cached for `token_epoch_ttl` seconds.
+
+Without a configured `token_secret` the signing key is random per process, so tokens do not
+survive restarts and are not accepted by other processes. rest.launcher generates one key for
+all of its workers before forking them.
+"""
+
+import base64
+import hashlib
+import hmac
+import json
+import os
+import threading
+import time
+
+from typing import Dict, NamedTuple, Optional, Tuple
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from utils.settings import settings
+
+
+_secret = settings.token_secret.encode() if settings.token_secret else os.urandom(32)
+
+
+class TokenClaims(NamedTuple):
+    username: str
+    role: str
+    epoch: int
+    expires_at: int
+
+
+def _b64encode(data: bytes) -> str:
+    return base64.urlsafe_b64encode(data).decode().rstrip('=')
+
+
+def _b64decode(data: str) -> bytes:
+    return base64.urlsafe_b64decode(data + '=' * (-len(data) % 4))
+
+
+def _sign(payload: str) -> str:
+    return _b64encode(hmac.new(_secret, payload.encode(), hashlib.sha256).digest())
+
+
+def issue_token(username: str, role: str, epoch: int, ttl: Optional[int] = None) -> str:
+    ttl = settings.token_ttl if ttl is None else ttl
+    claims = dict(sub=username, role=role, epoch=epoch, exp=int(time.time()) + ttl)
+    payload = _b64encode(json.dumps(claims, separators=(',', ':')).encode())
+    return f'{payload}.{_sign(payload)}'
+
+
+def decode_token(token: str) -> Optional[TokenClaims]:
+    """ Returns claims of a token with valid signature which has not expired yet. """
+    payload, _, signature = token.partition('.')
+    # Compared as bytes, compare_digest rejects str with non-ASCII characters
+    if not hmac.compare_digest(_sign(payload).encode(), signature.encode()):
+        return None
+    try:
+        claims = json.loads(_b64decode(payload))
+        claims = TokenClaims(claims['sub'], claims['role'], claims['epoch'], claims['exp'])
+    except (ValueError, KeyError, TypeError):
+        return None
+    if claims.expires_at <= time.time():
+        return None
+    return claims
+
+
+class TokenEpochs:
+    """ Cache of per-user token revocation epochs.
+
+    Tokens issued with an epoch lower than the current one of the user are revoked. Entries
+    expire after `ttl` seconds so epochs bumped by other processes are picked up eventually.
+    Epochs only grow, a lower one read before a bump never replaces the cached one.
+    """
+
+    def __init__(self, ttl: float):
+        self.ttl = ttl
+        self._epochs: Dict[str, Tuple[float, int]] = {}
+        self._lock = threading.Lock()
+
+    def get(self, username: str) -> Optional[int]:
+        with self._lock:
+            entry = self._epochs.get(username)
+            if entry is None:
+                return None
+            expires_at, epoch = entry
+            if expires_at < time.monotonic():
+                del self._epochs[username]
+                return None
+            return epoch
+
+    def set(self, username: str, epoch: int):
+        with self._lock:
+            entry = self._epochs.get(username)
+            if entry is not None and entry[1] > epoch:
+                return
+            self._epochs[username] = (time.monotonic() + self.ttl, epoch)
+
+    def clear(self):
+        with self._lock:
+            self._epochs.clear()
+
+
+token_epochs = TokenEpochs(settings.token_epoch_ttl)
+
+
+def set_epoch_on_commit(db: Session, username: str, epoch: int):
+    """ Caches the new epoch of `username` once `db` commits. """
+    db.info.setdefault('changed_token_epochs', {})[username] = epoch
+
+
+@event.listens_for(Session, 'after_commit')
+def _after_commit(db: Session):
+    # Also fired when a savepoint is released, e.g. by an operation of the write queue
+    if db.in_nested_transaction():
+        return
+    for username, epoch in db.info.pop('changed_token_epochs', {}).items():
+        token_epochs.set(username, epoch)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _after_rollback(db: Session):
+    if not db.in_nested_transaction():
+        db.info.pop('changed_token_epochs', None)